@@ -1,34 +1,45 @@
 import os
 from pathlib import Path
+from dataset_index import DatasetIndex
 
 directories_to_scan = [
     Path("C:\\Users\\thiba\\OneDrive\\Bureau\\AI_Project\\Rotate"),
     Path("C:\\Users\\thiba\\OneDrive\\Bureau\\AI_Project\\Split") 
 ]
 
-IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
-
-
-def count_all_images(root_dir: Path):
+# Per-(split, class) image counts of every image under root_dir, read from the dataset index
+# after an incremental update. Two folder levels (Split/<split>/<class>) give split and class,
+# otherwise the labels stored by Split.py are used.
+def count_all_images(root_dir: Path, index: DatasetIndex):
 
     if not root_dir.exists():
         print(f" Error: The directory '{root_dir.resolve()}' does not exist.")
-        return 0
+        return {}
 
-    total_count = 0
+    index.update(root_dir)
+    root = os.path.abspath(root_dir)
 
-    for _, _, filenames in os.walk(root_dir):
-        image_files = [f for f in filenames if f.lower().endswith(IMAGE_EXTENSIONS)]
-        total_count += len(image_files)
+    counts = {}
+    for row in index.rows(root_dir):
+        parts = Path(os.path.relpath(os.path.dirname(row['path']), root)).parts
+        if len(parts) >= 2:
+            key = (parts[0], parts[1])
+        else:
+            key = (row['split'] or '', row['class'] or '')
+        counts[key] = counts.get(key, 0) + 1
 
-    return total_count
+    return counts
 
 if __name__ == "__main__":
 
+    index = DatasetIndex()
     for folder in directories_to_scan:
-        image_count = count_all_images(folder)
+        counts = count_all_images(folder, index)
 
         print("\n" + "="*50)
         print(f" Folder : {folder.name}")
         print("="*50)
-        print(f"Number of images : **{image_count}**")
+        print(f"Number of images : **{sum(counts.values())}**")
+        for (split, cls), n in sorted(counts.items()):
+            print(f"  {split or '-':<12s} {cls or '-':<12s} {n:6d}")
+    index.close()
@@ -1,72 +1,128 @@
 # Import libraries for image processing
 import os
-from PIL import Image, ExifTags
+import sys
+import json
+import time
 import shutil
+import subprocess
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from PIL import Image
+from dataset_index import DatasetIndex
 
 # Source directory containing original images
 input_root_dir = 'C:\\Users\\thiba\\OneDrive\\Bureau\\AI_Project\\Faces' 
 # Output directory for corrected images
 output_root_dir = 'C:\\Users\\thiba\\OneDrive\\Bureau\\AI_Project\\Rotate' 
-
-# Apply EXIF orientation correction to images
+# Manifest of already processed sources (lets reruns skip unchanged images)
+manifest_path = os.path.join(output_root_dir, 'rotate_manifest.json')
+# Number of worker processes
+num_workers = os.cpu_count() or 1
+
+# EXIF Orientation tag id (0x0112), looked up once instead of scanning ExifTags.TAGS per file
+ORIENTATION_TAG = 0x0112
+
+# Lossless jpegtran operation for each EXIF orientation value (2-8)
+JPEGTRAN_OPS = {
+    2: ['-flip', 'horizontal'],
+    3: ['-rotate', '180'],
+    4: ['-flip', 'vertical'],
+    5: ['-transpose'],
+    6: ['-rotate', '90'],
+    7: ['-transverse'],
+    8: ['-rotate', '270'],
+}
+
+# Equivalent PIL transpose for each orientation (fallback, decodes and re-encodes)
+PIL_OPS = {
+    2: [Image.FLIP_LEFT_RIGHT],
+    3: [Image.ROTATE_180],
+    4: [Image.FLIP_TOP_BOTTOM],
+    5: [Image.ROTATE_270, Image.FLIP_LEFT_RIGHT],
+    6: [Image.ROTATE_270],
+    7: [Image.ROTATE_90, Image.FLIP_LEFT_RIGHT],
+    8: [Image.ROTATE_90],
+}
+
+JPEGTRAN = shutil.which('jpegtran')
+
+
+# Lossless rotation with jpegtran; EXIF is dropped like the PIL path so the image is not rotated twice
+def jpegtran_rotate(image_path, output_path, orientation):
+    cmd = [JPEGTRAN, '-copy', 'none', '-perfect', *JPEGTRAN_OPS[orientation], '-outfile', output_path, image_path]
+    return subprocess.run(cmd, capture_output=True).returncode == 0
+
+
+# Apply EXIF orientation correction to images; returns the action taken
 def rotate_and_save(image_path, output_path):
 
     os.makedirs(os.path.dirname(output_path), exist_ok=True)
     
     try:
 
-        img = Image.open(image_path)
-        img_rotated = False
-
-        # Find EXIF orientation tag
-        orientation_key = next((tag for tag, value in ExifTags.TAGS.items() if value == 'Orientation'), None)
-        
-        exif = img._getexif()
-        orientation = exif.get(orientation_key) if exif and orientation_key else None
-
-        # Apply rotation based on EXIF orientation value
-        if orientation and orientation != 1:
-
-            print(f"Orientation found ({orientation}) for {os.path.basename(image_path)}. Applying correction.")
-            
-            # Apply correct transformation based on EXIF orientation value (1-8)
-            if orientation == 2:
-                img = img.transpose(Image.FLIP_LEFT_RIGHT)
-            elif orientation == 3:
-                img = img.transpose(Image.ROTATE_180)
-            elif orientation == 4:
-                img = img.transpose(Image.FLIP_TOP_BOTTOM)
-            elif orientation == 5:
-                img = img.transpose(Image.ROTATE_270).transpose(Image.FLIP_LEFT_RIGHT)
-            elif orientation == 6:
-                img = img.transpose(Image.ROTATE_270)
-            elif orientation == 7:
-                img = img.transpose(Image.ROTATE_90).transpose(Image.FLIP_LEFT_RIGHT)
-            elif orientation == 8:
-                img = img.transpose(Image.ROTATE_90)
-            
-            img_rotated = True
-        else:
-            print(f"No corrective orientation needed for {os.path.basename(image_path)} (missing EXIF or 'Top-Left').")
+        # Reading EXIF only parses the header, pixels are not decoded yet
+        with Image.open(image_path) as img:
+            orientation = img.getexif().get(ORIENTATION_TAG)
 
-        # Save corrected image or copy original
-        if img_rotated:
-            img.save(output_path)
-            print(f"Saved the CORRECTED image to {output_path}")
-        else:
-            # No rotation needed, just copy the file
-            img.close()
-            shutil.copy2(image_path, output_path)
-            print(f"Copied the ORIGINAL image without modification to {output_path}")
+            # Apply rotation based on EXIF orientation value
+            if orientation in PIL_OPS:
+
+                # Prefer a lossless DCT-domain transform when jpegtran is available
+                if JPEGTRAN and jpegtran_rotate(image_path, output_path, orientation):
+                    return 'rotated-lossless'
 
-    except Exception as e:
+                # Fallback: decode, transpose and re-encode at high quality
+                out = img
+                for op in PIL_OPS[orientation]:
+                    out = out.transpose(op)
+                out.save(output_path, quality=95)
+                return 'rotated'
+
+        # No rotation needed, just copy the file
+        shutil.copy2(image_path, output_path)
+        return 'copied'
+
+    except Exception:
 
         # Handle errors by copying original file
-        print(f"ERROR or unsupported file for PIL: {os.path.basename(image_path)}: {e}. Copying the original.")
         try:
             shutil.copy2(image_path, output_path)
-        except Exception as copy_e:
-            print(f"Final copy failed for {os.path.basename(image_path)}: {copy_e}")
+            return 'error-copied'
+        except Exception:
+            return 'error'
+
+
+# Worker entry point: correct/copy one source (size/mtime/hash come from the dataset index)
+def process_one(row, output_path):
+    action = rotate_and_save(row['path'], output_path)
+    return action, {'size': row['size'], 'mtime': row['mtime'], 'sha1': row['sha1'], 'action': action}
+
+
+def load_manifest():
+    if os.path.exists(manifest_path):
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    return {}
+
+
+def save_manifest(manifest):
+    tmp = manifest_path + '.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f)
+    os.replace(tmp, manifest_path)
+
+
+# A source is up to date if its size/mtime match the manifest and the output still exists
+def is_up_to_date(entry, row, output_path):
+    if entry is None or not os.path.exists(output_path):
+        return False
+    if entry['size'] == row['size'] and entry['mtime'] == row['mtime']:
+        return True
+    # Touched but identical content (e.g. OneDrive re-sync): refresh the entry, no reprocessing
+    if entry['size'] == row['size'] and entry['sha1'] == row['sha1']:
+        entry['mtime'] = row['mtime']
+        return True
+    return False
+
 
 def main():
     # Validate input directory
@@ -76,32 +132,57 @@ def main():
         return
 
     # Check/create output directory
-    if os.path.exists(output_root_dir):
-        print(f"Warning: Output directory '{output_root_dir}' already exists.")
-        print("Existing files will be overwritten.")
-    else:
-        os.makedirs(output_root_dir, exist_ok=True)
-        print(f"Output directory created: {output_root_dir}")
-
-    print(f"\nStarting image processing in '{input_root_dir}'...")
-    processed_count = 0
-
-    # Walk through all subdirectories and process JPG/JPEG files
-    for dirpath, dirnames, filenames in os.walk(input_root_dir):
-        for filename in filenames:
-
-            # Process only JPG/JPEG images
-            if filename.lower().endswith(('.jpg', '.jpeg')):
-                image_path = os.path.join(dirpath, filename)
-            
-                # Maintain directory structure in output
-                relative_path = os.path.relpath(image_path, input_root_dir)
-                output_image_path = os.path.join(output_root_dir, relative_path)
-
-                rotate_and_save(image_path, output_image_path)
-                processed_count += 1
-    
-    print(f"\n Processing complete. {processed_count} JPG/JPEG images processed or copied.")
+    os.makedirs(output_root_dir, exist_ok=True)
+    manifest = load_manifest()
+
+    # Refresh the dataset index (only changed folders are listed, only new/changed files hashed)
+    index = DatasetIndex()
+    stats = index.update(input_root_dir, hash_files=True)
+    print(f"Index: {stats['added']} added, {stats['updated']} updated, {stats['removed']} removed "
+          f"({stats['dirs']} folders scanned)")
+
+    # Collect JPG/JPEG files, keeping the directory structure in output
+    jobs = []
+    skipped = 0
+    for row in index.rows(input_root_dir, ('.jpg', '.jpeg')):
+        relative_path = os.path.relpath(row['path'], os.path.abspath(input_root_dir))
+        output_image_path = os.path.join(output_root_dir, relative_path)
+
+        if is_up_to_date(manifest.get(relative_path), row, output_image_path):
+            skipped += 1
+        else:
+            jobs.append((relative_path, row, output_image_path))
+    index.close()
+
+    print(f"Starting image processing in '{input_root_dir}' "
+          f"({len(jobs)} to process, {skipped} already done, {num_workers} workers, "
+          f"jpegtran {'found' if JPEGTRAN else 'not found - lossy fallback'})...")
+
+    counts = {}
+    errors = []
+    start = time.time()
+    with ProcessPoolExecutor(max_workers=num_workers) as pool:
+        futures = {pool.submit(process_one, row, out): rel for rel, row, out in jobs}
+        for done, fut in enumerate(as_completed(futures), 1):
+            action, entry = fut.result()
+            manifest[futures[fut]] = entry
+            counts[action] = counts.get(action, 0) + 1
+            if action.startswith('error'):
+                errors.append(futures[fut])
+
+            # Progress counter on one line; manifest checkpointed so an interrupted run resumes
+            if done % 50 == 0 or done == len(jobs):
+                sys.stdout.write(f"\r  {done}/{len(jobs)} images ({done / (time.time() - start):.1f} img/s)")
+                sys.stdout.flush()
+            if done % 500 == 0:
+                save_manifest(manifest)
+
+    save_manifest(manifest)
+
+    summary = ", ".join(f"{k}: {v}" for k, v in sorted(counts.items())) or "nothing to do"
+    print(f"\n\n Processing complete in {time.time() - start:.1f}s. {summary}. Skipped (unchanged): {skipped}.")
+    for rel in errors:
+        print(f"  unsupported by PIL (original copied if possible): {rel}")
     print(f"The corrected/copied images were saved in: '{output_root_dir}'")
 
 if __name__ == "__main__":
@@ -1,60 +1,141 @@
 import os
+import csv
 import shutil
+import hashlib
 import re
 from pathlib import Path
+from dataset_index import DatasetIndex
 
-# Source and destination directories
-src_dir = Path("C:\\Users\\thiba\\OneDrive\\Bureau\\AI_Project\\Rotate")
+# Source and destination directories (FaceCrop = aligned face crops written by face_crop.py)
+use_face_crops = False
+src_dir = Path("C:\\Users\\thiba\\OneDrive\\Bureau\\AI_Project\\" + ("FaceCrop" if use_face_crops else "Rotate"))
 dst_dir = Path("C:\\Users\\thiba\\OneDrive\\Bureau\\AI_Project\\Split")
 
-# Create Training and Validation subdirectories
-train_dir = dst_dir / "Training"
-val_dir = dst_dir / "Validation"
-
-train_dir.mkdir(parents=True, exist_ok=True)
-val_dir.mkdir(parents=True, exist_ok=True)
-
-# Extract class label from filename (e.g., "123-5.jpg" -> "123")
-def get_class_prefix(filename):
-    match = re.match(r"(\d+)", filename)
-    return match.group(1) if match else None
-
-print(f"Source folder : {src_dir.resolve()}")
-print(f"Destination folder : {dst_dir.resolve()}\n")
-print("Starting sorting and copying...")
-
-# Process each image file in source directory
-for file in os.listdir(src_dir):
-
-    # Skip non-image files
-    if not file.lower().endswith((".jpg", ".jpeg", ".png")):
-        continue
-
-    src_path = src_dir / file
-    prefix = get_class_prefix(file)
-
-    if prefix is None:
-        print(f" File ignored (no numeric prefix) : {file}")
-        continue
-
-    dest_folder = None
-    
-    # Training set: images ending in -1 to -6
-    if re.search(r"-[1-6]\.(jpg|jpeg|png)$", file, re.IGNORECASE):
-        dest_folder = train_dir / prefix
-        target_set = "Training"
-    
-    # Validation set: images ending in -7
-    elif re.search(r"-7\.(jpg|jpeg|png)$", file, re.IGNORECASE):
-        dest_folder = val_dir / prefix
-        target_set = "Validation"
-    
-    else:
-        continue
-
-    # Create class folder and copy image
-    dest_folder.mkdir(parents=True, exist_ok=True)
-    shutil.copy2(src_path, dest_folder / file)
-
-print("\n Split completed successfully!")
-print(f"Final directory: {dst_dir.resolve()}")
+# How files land in Split/: "copy" (original behaviour), "hardlink", "symlink",
+# or "manifest" (no files at all, only Split/split_manifest.csv for the trainers)
+split_mode = "copy"
+
+# Assignment rule: "suffix" (-1..-6 -> Training, -7 -> Validation) or "ratio"
+assignment = "suffix"
+val_ratio = 1 / 7       # "ratio" mode: files whose hash falls below this go to Validation (global, not per class)
+k_folds = 5             # fold id stored in the manifest for k-fold cross-validation
+seed = "42"             # salt for the deterministic per-file hash
+
+# Single regex: class prefix, image index and extension (e.g. "123-5.jpg")
+name_pat = re.compile(r"^(\d+)(?:.*-(\d+)|.*)\.(jpg|jpeg|png)$", re.IGNORECASE)
+
+manifest_path = dst_dir / "split_manifest.csv"
+
+
+# Stable pseudo-random number in [0, 1) per file, independent of listing order
+def file_unit(name, salt=""):
+    digest = hashlib.sha1(f"{seed}:{salt}{name}".encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big") / 2**64
+
+
+# Decide Training/Validation (or None = unused) and the fold for one file
+def assign(name, index):
+    u = file_unit(name)
+    # Folds use their own hash, so fold 0 is not simply the "ratio" validation set
+    fold = int(file_unit(name, "fold:") * k_folds)
+    if assignment == "ratio":
+        return ("Validation" if u < val_ratio else "Training"), fold
+    # Training set: images ending in -1 to -6 ; Validation set: images ending in -7
+    if index in ("1", "2", "3", "4", "5", "6"):
+        return "Training", fold
+    if index == "7":
+        return "Validation", fold
+    return None, fold
+
+
+# Place one file in Split/ without copying bytes when possible
+def place(src_path, dest_path):
+    if dest_path.exists():
+        # Already linked to the same file: nothing to do on re-split
+        if split_mode != "copy" and os.path.samefile(src_path, dest_path):
+            return
+        dest_path.unlink()
+    dest_path.parent.mkdir(parents=True, exist_ok=True)
+    try:
+        if split_mode == "hardlink":
+            os.link(src_path, dest_path)
+            return
+        if split_mode == "symlink":
+            os.symlink(src_path.resolve(), dest_path)
+            return
+    except OSError:
+        # Other drive / no symlink privilege: fall back to a real copy
+        pass
+    shutil.copy2(src_path, dest_path)
+
+
+def main():
+    print(f"Source folder : {src_dir.resolve()}")
+    print(f"Destination folder : {dst_dir.resolve()}\n")
+    print(f"Starting split (mode={split_mode}, assignment={assignment})...")
+
+    dst_dir.mkdir(parents=True, exist_ok=True)
+    rows = []
+    labels = []
+    assigned = {}   # file name -> (split, class) it belongs to now (split None = unused)
+    counts = {"Training": 0, "Validation": 0}
+
+    # Source listing comes from the dataset index (only re-listed when the folder changed)
+    index = DatasetIndex()
+    index.update(src_dir)
+    src_root = os.path.abspath(src_dir)
+    files = [r["path"] for r in index.rows(src_dir) if os.path.dirname(r["path"]) == src_root]
+
+    # Single pass over the source folder: parse, assign, place
+    for path in files:
+        name = os.path.basename(path)
+        m = name_pat.match(name)
+        if m is None:
+            print(f" File ignored (no numeric prefix) : {name}")
+            continue
+
+        prefix, index_str = m.group(1), m.group(2)
+        target_set, fold = assign(name, index_str)
+        assigned[name] = (target_set, prefix)
+        if target_set is None:
+            continue
+
+        src_path = Path(path)
+        rows.append((str(src_path.resolve()), prefix, target_set, fold))
+        labels.append((path, prefix, target_set))
+        counts[target_set] += 1
+        if split_mode != "manifest":
+            place(src_path, dst_dir / target_set / prefix / name)
+
+    # A file placed by an earlier run in another split (val_ratio/assignment changed) would be in
+    # both Training and Validation: remove the placements whose assignment differs from the current one
+    # (placements that still match are kept, also in manifest mode)
+    removed = 0
+    for split_name in ("Training", "Validation"):
+        for dest_path in (dst_dir / split_name).glob("*/*"):
+            current = assigned.get(dest_path.name)
+            if current is not None and current != (split_name, dest_path.parent.name):
+                dest_path.unlink()
+                removed += 1
+    if removed:
+        print(f" Removed {removed} stale file(s) from a previous split")
+
+    # Class/split of each source file, so Check_data.py can report them from the index
+    index.set_labels(labels)
+    index.close()
+
+    # Manifest is always written: it is the input for split_mode="manifest" training
+    rows.sort(key=lambda r: (r[1], r[0]))
+    with open(manifest_path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["path", "class", "split", "fold"])
+        writer.writerows(rows)
+
+    print("\n Split completed successfully!")
+    print(f"Training: {counts['Training']} | Validation: {counts['Validation']} | folds: {k_folds}")
+    print(f"Manifest: {manifest_path.resolve()}")
+    print(f"Final directory: {dst_dir.resolve()}")
+
+
+if __name__ == "__main__":
+    main()
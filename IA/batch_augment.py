@@ -0,0 +1,221 @@
+# Batched training augmentation on the training device, replacing the per-sample PIL train_tf of
+# efficientnet_b3.py. Input: uint8 (N, 3, 256, 256) batches; output: normalized float (N, 3, 224, 224).
+# Same transforms and parameter distributions, drawn independently for every sample:
+#   RandomResizedCrop(224, scale=(0.85, 1.0)) + RandomHorizontalFlip + RandomRotation(10)
+#       -> one affine sampling grid per sample (a single bilinear resampling)
+#   ColorJitter(0.25, 0.25, 0.2, 0.08)
+#       -> brightness / contrast / saturation / hue factors per sample, in a random order per sample
+#   RandomPerspective(0.12, p=0.2)
+#       -> per-sample homography grid for the selected samples
+# Differences with the PIL pipeline are resampling details only (bilinear instead of nearest for the
+# rotation, crop/flip/rotation fused into one interpolation).
+import math
+import torch
+import torch.nn.functional as F
+
+
+class BatchAugment:
+
+    def __init__(self, size=224, scale=(0.85, 1.0), ratio=(3 / 4, 4 / 3), flip_p=0.5, degrees=10,
+                 brightness=0.25, contrast=0.25, saturation=0.2, hue=0.08,
+                 distortion_scale=0.12, perspective_p=0.2,
+                 mean=(0.485, 0.456, 0.406), std=(0.229, 0.224, 0.225)):
+        self.size = size
+        self.scale, self.ratio = scale, ratio
+        self.flip_p, self.degrees = flip_p, degrees
+        self.brightness, self.contrast, self.saturation, self.hue = brightness, contrast, saturation, hue
+        self.distortion_scale, self.perspective_p = distortion_scale, perspective_p
+        self.mean, self.std = mean, std
+
+    def __call__(self, x):
+        """uint8 (N, 3, H, W) on any device -> augmented, normalized float32 (N, 3, size, size)."""
+        x = x.float().div_(255)
+        x = self.crop_flip_rotate(x)
+        x = self.color_jitter(x)
+        x = self.perspective(x)
+        mean = torch.tensor(self.mean, device=x.device).view(1, 3, 1, 1)
+        std = torch.tensor(self.std, device=x.device).view(1, 3, 1, 1)
+        return x.sub_(mean).div_(std)
+
+    # ---- geometry ----
+    def crop_boxes(self, n, H, W, device):
+        """RandomResizedCrop.get_params for n samples: (top, left, height, width) tensors."""
+        # 10 attempts per sample as in torchvision, the first valid one is kept
+        area = H * W * torch.empty(n, 10, device=device).uniform_(*self.scale)
+        log_r = torch.empty(n, 10, device=device).uniform_(math.log(self.ratio[0]), math.log(self.ratio[1]))
+        w = torch.sqrt(area * log_r.exp()).round()
+        h = torch.sqrt(area / log_r.exp()).round()
+        valid = (w > 0) & (h > 0) & (w <= W) & (h <= H)
+        first = valid.float().argmax(1, keepdim=True)
+        w = w.gather(1, first).squeeze(1)
+        h = h.gather(1, first).squeeze(1)
+
+        # Fallback when no attempt fits: central crop clamped to the ratio range
+        in_ratio = W / H
+        if in_ratio < self.ratio[0]:
+            fw, fh = W, round(W / self.ratio[0])
+        elif in_ratio > self.ratio[1]:
+            fw, fh = round(H * self.ratio[1]), H
+        else:
+            fw, fh = W, H
+        none = ~valid.any(1)
+        w = torch.where(none, torch.full_like(w, fw), w)
+        h = torch.where(none, torch.full_like(h, fh), h)
+
+        top = torch.floor(torch.rand(n, device=device) * (H - h + 1))
+        left = torch.floor(torch.rand(n, device=device) * (W - w + 1))
+        top = torch.where(none, (H - h) / 2, top)
+        left = torch.where(none, (W - w) / 2, left)
+        return top, left, h, w
+
+    def crop_flip_rotate(self, x):
+        n, _, H, W = x.shape
+        top, left, h, w = self.crop_boxes(n, H, W, x.device)
+
+        # Output coords q (normalized, rotated image) -> rotation -> flip -> crop box in the input
+        angle = torch.empty(n, device=x.device).uniform_(-self.degrees, self.degrees) * (math.pi / 180)
+        cos, sin = angle.cos(), angle.sin()
+        flip = torch.where(torch.rand(n, device=x.device) < self.flip_p, -1.0, 1.0)
+        sx, sy = w / W, h / H
+        cx = (left + w / 2) / W * 2 - 1
+        cy = (top + h / 2) / H * 2 - 1
+        theta = torch.stack([
+            torch.stack([sx * flip * cos, -sx * flip * sin, cx], 1),
+            torch.stack([sy * sin, sy * cos, cy], 1),
+        ], 1)
+        grid = F.affine_grid(theta, [n, 3, self.size, self.size], align_corners=False)
+        return F.grid_sample(x, grid, mode="bilinear", padding_mode="zeros", align_corners=False)
+
+    def perspective(self, x):
+        n, _, H, W = x.shape
+        sel = (torch.rand(n, device=x.device) < self.perspective_p).nonzero().squeeze(1)
+        if sel.numel() == 0:
+            return x
+        m = sel.numel()
+
+        # RandomPerspective.get_params: each corner moves inward by a random integer offset
+        bw = int(self.distortion_scale * (W // 2)) + 1
+        bh = int(self.distortion_scale * (H // 2)) + 1
+
+        def ri(lo, hi):
+            return torch.randint(lo, hi, (m,), device=x.device).double()
+
+        end = torch.stack([
+            torch.stack([ri(0, bw), ri(0, bh)], 1),
+            torch.stack([ri(W - bw, W), ri(0, bh)], 1),
+            torch.stack([ri(W - bw, W), ri(H - bh, H)], 1),
+            torch.stack([ri(0, bw), ri(H - bh, H)], 1),
+        ], 1)                                                            # (m, 4, 2)
+        start = torch.tensor([[0, 0], [W - 1, 0], [W - 1, H - 1], [0, H - 1]],
+                             dtype=torch.float64, device=x.device).expand(m, 4, 2)
+
+        # Homography coefficients mapping output (end) points to input (start) points
+        ex, ey = end[..., 0], end[..., 1]
+        sx, sy = start[..., 0], start[..., 1]
+        one, zero = torch.ones_like(ex), torch.zeros_like(ex)
+        rows_x = torch.stack([ex, ey, one, zero, zero, zero, -sx * ex, -sx * ey], -1)
+        rows_y = torch.stack([zero, zero, zero, ex, ey, one, -sy * ex, -sy * ey], -1)
+        A = torch.stack([rows_x, rows_y], 2).reshape(m, 8, 8)
+        b = torch.stack([sx, sy], 2).reshape(m, 8)
+        a, b_, c, d, e, f, g, h = torch.linalg.solve(A, b).float().unbind(1)
+
+        ys, xs = torch.meshgrid(torch.arange(H, device=x.device) + 0.5,
+                                torch.arange(W, device=x.device) + 0.5, indexing="ij")
+        view = lambda t: t.view(m, 1, 1)
+        den = view(g) * xs + view(h) * ys + 1
+        gx = (view(a) * xs + view(b_) * ys + view(c)) / den
+        gy = (view(d) * xs + view(e) * ys + view(f)) / den
+        grid = torch.stack([gx / (W / 2) - 1, gy / (H / 2) - 1], -1)
+
+        x = x.clone()
+        x[sel] = F.grid_sample(x[sel], grid, mode="bilinear", padding_mode="zeros", align_corners=False)
+        return x
+
+    # ---- color ----
+    def color_jitter(self, x):
+        n = x.size(0)
+        dev = x.device
+
+        def factor(amount, center=1.0):
+            return torch.empty(n, device=dev).uniform_(center - amount, center + amount).view(n, 1, 1, 1)
+
+        params = [factor(self.brightness), factor(self.contrast), factor(self.saturation),
+                  factor(self.hue, center=0.0)]
+        ops = [_brightness, _contrast, _saturation, _hue]
+        # Random order per sample (ColorJitter permutes the four ops on every call)
+        order = torch.rand(n, 4, device=dev).argsort(1)
+        for pos in range(4):
+            for k, op in enumerate(ops):
+                m = order[:, pos] == k
+                if m.any():
+                    x[m] = op(x[m], params[k][m])
+        return x
+
+
+def _gray(x):
+    return (0.2989 * x[:, 0] + 0.587 * x[:, 1] + 0.114 * x[:, 2]).unsqueeze(1)
+
+
+def _brightness(x, f):
+    return (x * f).clamp_(0, 1)
+
+
+def _contrast(x, f):
+    mean = _gray(x).mean(dim=(1, 2, 3), keepdim=True)
+    return (f * x + (1 - f) * mean).clamp_(0, 1)
+
+
+def _saturation(x, f):
+    return (f * x + (1 - f) * _gray(x)).clamp_(0, 1)
+
+
+def _hue(x, f):
+    h, s, v = _rgb_to_hsv(x).unbind(1)
+    h = torch.remainder(h + f.view(-1, 1, 1), 1.0)
+    return _hsv_to_rgb(h, s, v)
+
+
+def _rgb_to_hsv(x):
+    r, g, b = x.unbind(1)
+    maxc = x.max(1).values
+    minc = x.min(1).values
+    eqc = maxc == minc
+    cr = maxc - minc
+    ones = torch.ones_like(maxc)
+    s = cr / torch.where(eqc, ones, maxc)
+    cr_div = torch.where(eqc, ones, cr)
+    rc, gc, bc = (maxc - r) / cr_div, (maxc - g) / cr_div, (maxc - b) / cr_div
+    hr = (maxc == r) * (bc - gc)
+    hg = ((maxc == g) & (maxc != r)) * (2.0 + rc - bc)
+    hb = ((maxc != g) & (maxc != r)) * (4.0 + gc - rc)
+    h = torch.remainder((hr + hg + hb) / 6.0 + 1.0, 1.0)
+    return torch.stack([h, s, maxc], 1)
+
+
+def _hsv_to_rgb(h, s, v):
+    i = torch.floor(h * 6.0)
+    f = h * 6.0 - i
+    i = i.long() % 6
+    p = (v * (1 - s)).clamp(0, 1)
+    q = (v * (1 - s * f)).clamp(0, 1)
+    t = (v * (1 - s * (1 - f))).clamp(0, 1)
+    sector = (i.unsqueeze(1) == torch.arange(6, device=h.device).view(1, 6, 1, 1)).to(h.dtype)
+    table = torch.stack([
+        torch.stack([v, q, p, p, t, v], 1),
+        torch.stack([t, v, v, q, p, p], 1),
+        torch.stack([p, p, t, v, v, q], 1),
+    ], 1)                                                   # (N, 3, 6, H, W)
+    return torch.einsum("nkhw,nckhw->nchw", sector, table)
+
+
+def compare_stats(batch, reference_tf, augment, draws=8):
+    """Per-channel mean/std of augmented outputs from the PIL pipeline and from BatchAugment.
+
+    batch: uint8 (N, 3, 256, 256) on the CPU; reference_tf: the per-sample Compose (PIL input).
+    """
+    from torchvision.transforms.functional import to_pil_image
+    ref = torch.stack([reference_tf(to_pil_image(img)) for _ in range(draws) for img in batch])
+    out = torch.cat([augment(batch) for _ in range(draws)])
+    for name, t in (("PIL", ref), ("batch", out)):
+        print(f"{name:6s} mean {[round(v, 3) for v in t.mean(dim=(0, 2, 3)).tolist()]} "
+              f"std {[round(v, 3) for v in t.std(dim=(0, 2, 3)).tolist()]}", flush=True)
@@ -0,0 +1,212 @@
+# Reproducible performance benchmark for the IA pipeline.
+# Measures decode+preprocess throughput, forward latency (each member + fused ensemble) for
+# batch sizes 1..64, training step time for both trainers' setups and peak RSS, writes JSON
+# and compares it with a stored baseline so regressions show up as numbers.
+import io
+import json
+import os
+import platform
+import sys
+import time
+from pathlib import Path
+import torch
+import torch.nn as nn
+from PIL import Image
+from torchvision import models
+
+from marker import student_mod, preprocess, tensor_preprocess, list_test_files
+
+# ---- config ----
+results_dir = Path("bench_results")
+baseline_path = Path("bench_baseline.json")
+save_as_baseline = False            # overwrite the baseline with this run
+regression_threshold = 0.10         # flag metrics more than 10% worse than baseline
+batch_sizes = (1, 2, 4, 8, 16, 32, 64)
+warmup_runs = 2
+timed_runs = 5
+num_classes = 100                   # synthetic head size (timings barely depend on it)
+train_steps = 5
+decode_images = 64
+seed = 0
+# ----------------
+
+
+def peak_rss_mb():
+    """Peak resident memory of this process in MB, or None when no backend can report it."""
+    if sys.platform == "win32":
+        # Peak working set is only exposed through psutil on Windows
+        try:
+            import psutil
+        except ImportError:
+            return None
+        return psutil.Process().memory_info().peak_wset / 2**20
+    import resource
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / 2**20 if sys.platform == "darwin" else rss / 1024
+
+
+# Same architectures as train_convnext.py / efficientnet_b3.py (random weights: cost only)
+def build_arch(name):
+    if name == "convnext_base":
+        model = models.convnext_base(weights=None)
+        model.classifier[2] = nn.Linear(model.classifier[2].in_features, num_classes)
+    else:
+        model = models.efficientnet_b3(weights=None)
+        in_features = model.classifier[1].in_features
+        model.classifier = nn.Sequential(
+            nn.Dropout(0.45), nn.Linear(in_features, 640), nn.ReLU(),
+            nn.Dropout(0.4), nn.Linear(640, 512), nn.ReLU(),
+            nn.Dropout(0.35), nn.Linear(512, num_classes))
+    return model.eval()
+
+
+def timed(fn, runs=timed_runs, warmup=warmup_runs):
+    """Median wall time of fn() in seconds."""
+    for _ in range(warmup):
+        fn()
+    times = []
+    for _ in range(runs):
+        t0 = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - t0)
+    return sorted(times)[len(times) // 2]
+
+
+def synthetic_jpegs(n):
+    gen = torch.Generator().manual_seed(seed)
+    out = []
+    for _ in range(n):
+        arr = (torch.rand(480, 640, 3, generator=gen) * 255).to(torch.uint8).numpy()
+        buf = io.BytesIO()
+        Image.fromarray(arr).save(buf, format="JPEG", quality=90)
+        out.append(buf.getvalue())
+    return out
+
+
+def bench_decode():
+    results = {}
+    blobs = synthetic_jpegs(decode_images)
+    dt = timed(lambda: [preprocess(Image.open(io.BytesIO(b)).convert("RGB")) for b in blobs], runs=3, warmup=1)
+    results["synthetic_img_per_s"] = len(blobs) / dt
+    tp = tensor_preprocess
+    dt = timed(lambda: tp.normalize(torch.stack([tp.load(b) for b in blobs])), runs=3, warmup=1)
+    results["synthetic_tensor_img_per_s"] = len(blobs) / dt
+
+    # Real images when the test set is reachable
+    try:
+        files = list_test_files()[:decode_images]
+    except OSError:
+        files = []
+    if files:
+        dt = timed(lambda: [preprocess(Image.open(p).convert("RGB")) for p in files], runs=3, warmup=1)
+        results["real_img_per_s"] = len(files) / dt
+        dt = timed(lambda: tp.normalize(torch.stack([tp.load(p) for p in files])), runs=3, warmup=1)
+        results["real_tensor_img_per_s"] = len(files) / dt
+    return results
+
+
+def bench_forward():
+    results = {}
+    members = {"convnext_base": build_arch("convnext_base"), "efficientnet_b3": build_arch("efficientnet_b3")}
+    ensemble = student_mod.make_fused_ensemble(
+        [build_arch("convnext_base"), build_arch("efficientnet_b3")], [0.7, 0.3], torch, nn).eval()
+    candidates = dict(members, ensemble=torch.jit.script(ensemble))
+
+    with torch.inference_mode():
+        for name, model in candidates.items():
+            results[name] = {}
+            for bs in batch_sizes:
+                x = torch.randn(bs, 3, 224, 224)
+                dt = timed(lambda: model(x))
+                results[name][f"bs{bs}_ms"] = dt * 1000
+                print(f"  forward {name:16s} bs={bs:<3d} {dt * 1000:9.1f} ms  ({bs / dt:7.1f} img/s)", flush=True)
+    return results
+
+
+def bench_train():
+    # Batch sizes and optimisers of the two trainers
+    setups = {
+        "efficientnet_b3": (6, lambda p: torch.optim.AdamW(p, lr=8e-5, weight_decay=8e-4),
+                            nn.CrossEntropyLoss(label_smoothing=0.15)),
+        "convnext_base": (16, lambda p: torch.optim.Adam(p, lr=1e-4), nn.CrossEntropyLoss()),
+    }
+    results = {}
+    for name, (bs, make_opt, criterion) in setups.items():
+        model = build_arch(name).train()
+        optimizer = make_opt(model.parameters())
+        x = torch.randn(bs, 3, 224, 224)
+        y = torch.randint(0, num_classes, (bs,))
+
+        def step():
+            optimizer.zero_grad()
+            loss = criterion(model(x), y)
+            loss.backward()
+            optimizer.step()
+
+        dt = timed(step, runs=train_steps, warmup=1)
+        results[name] = {"batch_size": bs, "step_ms": dt * 1000, "img_per_s": bs / dt}
+        print(f"  train   {name:16s} bs={bs:<3d} {dt * 1000:9.1f} ms/step ({bs / dt:7.1f} img/s)", flush=True)
+    return results
+
+
+def flatten(d, prefix=""):
+    out = {}
+    for k, v in d.items():
+        key = f"{prefix}{k}"
+        if isinstance(v, dict):
+            out.update(flatten(v, key + "."))
+        elif isinstance(v, (int, float)):
+            out[key] = v
+    return out
+
+
+def compare(current, baseline):
+    """Print every metric next to the baseline; higher is better for */s, lower for the rest."""
+    cur, base = flatten(current["metrics"]), flatten(baseline["metrics"])
+    regressions = 0
+    print(f"\n{'metric':45s} {'baseline':>12s} {'current':>12s} {'change':>9s}")
+    for key in sorted(cur.keys() & base.keys()):
+        if key.endswith("batch_size") or base[key] == 0:
+            continue
+        change = (cur[key] - base[key]) / base[key]
+        worse = -change if key.endswith("_per_s") else change
+        flag = "  REGRESSION" if worse > regression_threshold else ""
+        regressions += bool(flag)
+        print(f"{key:45s} {base[key]:12.2f} {cur[key]:12.2f} {change:+8.1%}{flag}")
+    print(f"\n{regressions} regression(s) above {regression_threshold:.0%}")
+    return regressions
+
+
+def main():
+    torch.manual_seed(seed)
+    env = {
+        "python": platform.python_version(),
+        "torch": torch.__version__,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "torch_threads": torch.get_num_threads(),
+        "cuda": torch.cuda.is_available(),
+    }
+    print("Decode + preprocess ...", flush=True)
+    metrics = {"decode": bench_decode()}
+    print("Forward latency ...", flush=True)
+    metrics["forward"] = bench_forward()
+    print("Training steps ...", flush=True)
+    metrics["train"] = bench_train()
+    metrics["peak_rss_mb"] = peak_rss_mb()
+
+    result = {"timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"), "env": env, "metrics": metrics}
+    results_dir.mkdir(exist_ok=True)
+    out_path = results_dir / f"bench_{time.strftime('%Y%m%d_%H%M%S')}.json"
+    out_path.write_text(json.dumps(result, indent=2))
+    print(f"\nResults written to {out_path}")
+
+    if baseline_path.exists() and not save_as_baseline:
+        compare(result, json.loads(baseline_path.read_text()))
+    else:
+        baseline_path.write_text(json.dumps(result, indent=2))
+        print(f"Baseline saved to {baseline_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+# Full-state checkpoints (model, optimizer, scheduler, scaler, counters, RNG) for both trainers,
+# written by a background thread from a CPU snapshot so the training loop never waits on the disk.
+# Epoch checkpoints are rotated (only the last `keep` stay); the best model file is kept as before.
+import glob
+import os
+import queue
+import random
+import re
+import threading
+import time
+import torch
+
+
+def to_cpu(obj):
+    """Deep copy of a (nested) state with every tensor detached and copied to the CPU."""
+    if torch.is_tensor(obj):
+        return obj.detach().to("cpu", copy=True)
+    if isinstance(obj, dict):
+        return {k: to_cpu(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(to_cpu(v) for v in obj)
+    return obj
+
+
+def rng_state():
+    state = {"python": random.getstate(), "torch": torch.get_rng_state()}
+    if torch.cuda.is_available():
+        state["cuda"] = torch.cuda.get_rng_state_all()
+    return state
+
+
+def set_rng_state(state):
+    random.setstate(state["python"])
+    torch.set_rng_state(state["torch"])
+    if "cuda" in state and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(state["cuda"])
+
+
+def epoch_checkpoints(directory, prefix):
+    """[(epoch, path)] of the epoch checkpoint series in directory, oldest epoch first."""
+    pat = re.compile(rf"{re.escape(prefix)}_epoch(\d+)\.pt$")
+    return sorted((int(m.group(1)), p) for p in glob.glob(os.path.join(directory, f"{prefix}_epoch*.pt"))
+                  if (m := pat.search(p)))
+
+
+def latest_checkpoint(directory, prefix):
+    """Path of the most recent epoch checkpoint, or None."""
+    found = epoch_checkpoints(directory, prefix)
+    return found[-1][1] if found else None
+
+
+def load_checkpoint(path):
+    # Full-state checkpoints hold Python objects (RNG state), not only tensors
+    return torch.load(path, map_location="cpu", weights_only=False)
+
+
+def resumable_checkpoint(directory, prefix, classes, **expected):
+    """(path, state) of the latest checkpoint this run can continue from, else (None, None).
+
+    A run that finished (state["completed"]), trained on other classes or with other settings
+    (expected key/values, e.g. mode=...) is not resumed: training starts from scratch.
+    """
+    path = latest_checkpoint(directory, prefix)
+    if path is None:
+        return None, None
+    state = load_checkpoint(path)
+    if state.get("completed"):
+        reason = "run already completed"
+    elif state.get("classes") != list(classes):
+        reason = "different classes"
+    elif any(state.get(k) != v for k, v in expected.items()):
+        reason = "different settings"
+    else:
+        return path, state
+    print(f"Not resuming from {path} ({reason}), starting from scratch")
+    return None, None
+
+
+class AsyncCheckpointer:
+    """Writes checkpoints on a background thread; at most one write is pending at a time.
+
+    resumed=False (new run): an existing series in directory is moved to previous_<time>/ first, so
+    its files can neither be resumed by mistake nor outrank this run's files. Rotation only ever
+    deletes files of the series being continued or written.
+    """
+
+    def __init__(self, directory, prefix, keep=3, resumed=False):
+        self.directory = directory
+        self.prefix = prefix
+        self.keep = keep
+        os.makedirs(directory, exist_ok=True)
+        existing = epoch_checkpoints(directory, prefix)
+        if existing and not resumed:
+            archive = os.path.join(directory, time.strftime("previous_%Y%m%d_%H%M%S"))
+            os.makedirs(archive, exist_ok=True)
+            for _, p in existing:
+                os.replace(p, os.path.join(archive, os.path.basename(p)))
+            existing = []
+        self.series = [p for _, p in existing]   # oldest first
+        self.jobs = queue.Queue(maxsize=1)
+        self.error = None
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                return
+            state, path, rotate = job
+            try:
+                tmp = path + ".tmp"
+                torch.save(state, tmp)
+                os.replace(tmp, path)       # a crash mid-write never leaves a truncated checkpoint
+                if rotate:
+                    self._rotate(path)
+            except Exception as e:
+                self.error = e
+            finally:
+                self.jobs.task_done()
+
+    def _rotate(self, path):
+        if path in self.series:
+            self.series.remove(path)
+        self.series.append(path)
+        while len(self.series) > self.keep:
+            os.remove(self.series.pop(0))
+
+    def _submit(self, state, path, rotate):
+        if self.error is not None:
+            raise RuntimeError(f"checkpoint write failed: {self.error}")
+        # Snapshot on the caller's thread (training state must not change while it is written)
+        self.jobs.put((to_cpu(state), path, rotate))
+
+    def save_epoch(self, state, epoch):
+        """Full training state after `epoch`, in the rotated checkpoint series."""
+        self._submit(state, os.path.join(self.directory, f"{self.prefix}_epoch{epoch:03d}.pt"), True)
+
+    def save_file(self, state, path):
+        """Any other file (e.g. the best-model checkpoint), not rotated."""
+        self._submit(state, path, False)
+
+    def close(self):
+        """Wait for pending writes and stop the thread."""
+        self.jobs.join()
+        self.jobs.put(None)
+        self.thread.join()
+        if self.error is not None:
+            raise RuntimeError(f"checkpoint write failed: {self.error}")
@@ -0,0 +1,182 @@
+# Persistent dataset index (SQLite) shared by Check_data.py, Rotate.py, Split.py, marker.py and the
+# trainers, so they stop re-walking the image trees on every run.
+# One row per image: path, class, split, size, mtime, content hash and dimensions. Updates are
+# incremental: each directory is listed with os.scandir (size/mtime come with the listing on
+# Windows) and compared with its rows in one query; only new or modified files are hashed/opened.
+import hashlib
+import os
+import sqlite3
+import time
+from PIL import Image
+from torchvision.datasets.folder import VisionDataset, default_loader
+
+index_path = 'C:\\Users\\thiba\\OneDrive\\Bureau\\AI_Project\\dataset_index.sqlite'
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+
+# Content hash of a file (read in 1 MB chunks)
+def file_sha1(path):
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def image_size(path):
+    # Only the header is parsed, pixels are not decoded
+    try:
+        with Image.open(path) as img:
+            return img.size
+    except Exception:
+        return None, None
+
+
+# SQL condition "path is root or below root" (roots may overlap, so rows are not owned by a root)
+UNDER = "(path = ? OR substr(path, 1, ?) = ?)"
+
+
+def under(root):
+    prefix = os.path.join(root, '')
+    return root, len(prefix), prefix
+
+
+class DatasetIndex:
+
+    def __init__(self, db_path=index_path):
+        self.db = sqlite3.connect(db_path, timeout=60)
+        # class/split columns hold labels set by tools (Split.py); folder classes are derived per root
+        self.db.execute("""CREATE TABLE IF NOT EXISTS files (
+            path TEXT PRIMARY KEY, dir TEXT, class TEXT, split TEXT,
+            size INTEGER, mtime REAL, sha1 TEXT, width INTEGER, height INTEGER, indexed REAL)""")
+        self.db.execute("CREATE INDEX IF NOT EXISTS files_dir ON files (dir)")
+
+    def close(self):
+        self.db.close()
+
+    def update(self, root, hash_files=False):
+        """Bring the rows under root up to date; returns {'added', 'updated', 'removed', 'dirs'}.
+
+        Roots may overlap (Split/ and Split/Training share rows).
+        """
+        root = os.path.abspath(root)
+        known_dirs = {d for (d,) in self.db.execute(f"SELECT DISTINCT dir FROM files WHERE {UNDER}", under(root))}
+        stats = {'added': 0, 'updated': 0, 'removed': 0, 'dirs': 0}
+        seen_dirs = set()
+        stack = [root]
+
+        while stack:
+            d = stack.pop()
+            try:
+                entries = list(os.scandir(d))
+            except FileNotFoundError:
+                continue
+            seen_dirs.add(d)
+            stats['dirs'] += 1
+
+            # One query per directory; DirEntry.stat() costs no extra system call on Windows
+            known = {p: (size, mtime, sha1) for p, size, mtime, sha1 in
+                     self.db.execute("SELECT path, size, mtime, sha1 FROM files WHERE dir = ?", (d,))}
+            for entry in entries:
+                if entry.name.startswith('.'):
+                    continue
+                if entry.is_dir():
+                    stack.append(entry.path)
+                elif entry.name.lower().endswith(IMAGE_EXTENSIONS):
+                    self._index_file(entry, d, known.pop(entry.path, None), hash_files, stats)
+
+            # Files gone from this directory
+            for p in known:
+                self.db.execute("DELETE FROM files WHERE path = ?", (p,))
+                stats['removed'] += 1
+            self.db.commit()
+
+        # Directories that disappeared (and their files)
+        for d in known_dirs - seen_dirs:
+            cur = self.db.execute("DELETE FROM files WHERE dir = ?", (d,))
+            stats['removed'] += cur.rowcount
+        self.db.commit()
+        return stats
+
+    def _index_file(self, entry, d, row, hash_files, stats):
+        st = entry.stat()
+        if row is not None and row[0] == st.st_size and row[1] == st.st_mtime:
+            if hash_files and row[2] is None:
+                self.db.execute("UPDATE files SET sha1 = ? WHERE path = ?", (file_sha1(entry.path), entry.path))
+            return
+
+        width, height = image_size(entry.path)
+        sha1 = file_sha1(entry.path) if hash_files else None
+        # Class/split set by another tool (e.g. Split.py on a flat folder) survive a re-index
+        self.db.execute("""INSERT INTO files VALUES (?, ?, NULL, NULL, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(path) DO UPDATE SET size = excluded.size, mtime = excluded.mtime,
+                sha1 = excluded.sha1, width = excluded.width, height = excluded.height,
+                indexed = excluded.indexed""",
+                        (entry.path, d, st.st_size, st.st_mtime, sha1, width, height, time.time()))
+        stats['updated' if row is not None else 'added'] += 1
+
+    def rows(self, root, exts=IMAGE_EXTENSIONS):
+        """Indexed images under root as dicts, sorted by path.
+
+        class = first subfolder under root (ImageFolder layout), else the label set by set_labels().
+        """
+        root = os.path.abspath(root)
+        cur = self.db.execute(f"""SELECT path, class, split, size, mtime, sha1, width, height FROM files
+                                  WHERE {UNDER} ORDER BY path""", under(root))
+        keys = [c[0] for c in cur.description]
+        out = []
+        for r in cur:
+            if not r[0].lower().endswith(tuple(exts)):
+                continue
+            row = dict(zip(keys, r))
+            rel_dir = os.path.relpath(os.path.dirname(row['path']), root)
+            if rel_dir != '.':
+                row['class'] = rel_dir.split(os.sep)[0]
+            out.append(row)
+        return out
+
+    def files(self, root, exts=IMAGE_EXTENSIONS):
+        """[(path, class)] under root, sorted by path."""
+        return [(r['path'], r['class']) for r in self.rows(root, exts)]
+
+    def set_labels(self, labels):
+        """Store class/split decided by another tool: iterable of (path, class, split)."""
+        self.db.executemany("UPDATE files SET class = ?, split = ? WHERE path = ?",
+                            ((c, s, os.path.abspath(p)) for p, c, s in labels))
+        self.db.commit()
+
+
+def indexed_files(root, exts=IMAGE_EXTENSIONS, hash_files=False):
+    """Refresh the index for root and return its [(path, class)] (replacement for os.walk listings)."""
+    index = DatasetIndex()
+    try:
+        index.update(root, hash_files=hash_files)
+        return index.files(root, exts)
+    finally:
+        index.close()
+
+
+class IndexImageFolder(VisionDataset):
+    """ImageFolder-compatible dataset (classes, samples, targets) built from the index."""
+
+    def __init__(self, root, transform=None, loader=default_loader, exts=('.jpg', '.jpeg')):
+        super().__init__(str(root), transform=transform)
+        # Only files inside a class subfolder, like ImageFolder
+        top = os.path.abspath(root)
+        files = [(p, c) for p, c in indexed_files(root, exts) if os.path.dirname(p) != top]
+        # Same sorted class order as ImageFolder
+        self.classes = sorted({c for _, c in files})
+        self.class_to_idx = {c: i for i, c in enumerate(self.classes)}
+        self.samples = [(p, self.class_to_idx[c]) for p, c in files]
+        self.targets = [t for _, t in self.samples]
+        self.loader = loader
+
+    def __len__(self):
+        return len(self.samples)
+
+    def __getitem__(self, i):
+        path, target = self.samples[i]
+        img = self.loader(path)
+        if self.transform is not None:
+            img = self.transform(img)
+        return img, target
@@ -0,0 +1,189 @@
+# Knowledge distillation: the 0.7/0.3 ConvNeXt + EfficientNet ensemble teaches a small student
+# (MobileNetV3-Large or EfficientNet-B0) that fits the same build_model/predict contract.
+import json
+import time
+from pathlib import Path
+import numpy as np
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+import torch.optim as optim
+from torchvision import datasets, transforms, models
+from tqdm import tqdm
+
+from marker import student_mod
+from loaders import make_loader
+
+# Define paths to training and validation datasets
+train_dir = "C:\\Users\\thiba\\OneDrive\\Bureau\\AI_Project\\Split\\Training"
+val_dir = "C:\\Users\\thiba\\OneDrive\\Bureau\\AI_Project\\Split\\Validation"
+teacher_cache = Path("teacher_logits.npy")     # Teacher logits for train_dir, computed once
+student_path = "student_distilled.pt"          # Loaded by build_model(..., student=True)
+
+# Hyperparameters configuration
+student_arch = "mobilenet_v3_large"   # or "efficientnet_b0"
+batch_size = 32
+epochs = 40
+lr = 3e-4
+weight_decay = 1e-4
+temperature = 4.0       # Softens teacher/student distributions
+alpha = 0.7             # Weight of the distillation loss vs the hard-label loss
+patience = 10
+seed = 42
+
+torch.manual_seed(seed)
+device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+
+mean = [0.485, 0.456, 0.406]
+std  = [0.229, 0.224, 0.225]
+
+# Same augmentations as the EfficientNet trainer
+train_tf = transforms.Compose([
+    transforms.Resize((256, 256)),
+    transforms.RandomResizedCrop(224, scale=(0.85, 1.0)),
+    transforms.RandomHorizontalFlip(p=0.5),
+    transforms.RandomRotation(10),
+    transforms.ColorJitter(0.25, 0.25, 0.2, 0.08),
+    transforms.RandomPerspective(0.12, p=0.2),
+    transforms.ToTensor(),
+    transforms.Normalize(mean, std),
+])
+
+# Teacher sees the images exactly like marker.py does
+val_tf = transforms.Compose([
+    transforms.Resize((224, 224)),
+    transforms.ToTensor(),
+    transforms.Normalize(mean, std),
+])
+
+
+def valid_img(path):
+    name = Path(path).name
+    if name.startswith(".") or name.startswith("._"):
+        return False
+    return name.lower().endswith((".jpg", ".jpeg"))
+
+
+class IndexedImageFolder(datasets.ImageFolder):
+    """ImageFolder that also returns the sample index (to look up its cached teacher logits)."""
+
+    def __getitem__(self, i):
+        img, label = super().__getitem__(i)
+        return img, label, i
+
+
+def create_student(arch, num_classes, pretrained=True):
+    """Small ImageNet backbone with a new classification layer."""
+    if arch == "mobilenet_v3_large":
+        model = models.mobilenet_v3_large(weights=models.MobileNet_V3_Large_Weights.IMAGENET1K_V2 if pretrained else None)
+        model.classifier[3] = nn.Linear(model.classifier[3].in_features, num_classes)
+    elif arch == "efficientnet_b0":
+        model = models.efficientnet_b0(weights=models.EfficientNet_B0_Weights.IMAGENET1K_V1 if pretrained else None)
+        model.classifier[1] = nn.Linear(model.classifier[1].in_features, num_classes)
+    else:
+        raise ValueError(f"Unknown student architecture '{arch}'")
+    return model
+
+
+def teacher_logits(ds):
+    """Ensemble logits for every training image, cached on disk next to the sample list."""
+    meta_path = teacher_cache.with_suffix(".json")
+    paths = [p for p, _ in ds.samples]
+    ckpt_mtimes = [Path(p).stat().st_mtime for p in ("convnext_base_custom.pt", "efficientnet_b3.pt")]
+
+    # Soft targets are indexed by class id: the teachers must use the student's class order
+    for ckpt_file in ("convnext_base_custom.pt", "efficientnet_b3.pt"):
+        teacher_classes = [str(c) for c in student_mod.load_checkpoint(ckpt_file, torch)["classes"]]
+        if teacher_classes != [str(c) for c in ds.classes]:
+            raise ValueError(f"The classes of {ckpt_file} differ from the training set's; soft targets would be permuted.")
+
+    if teacher_cache.exists() and meta_path.exists():
+        meta = json.loads(meta_path.read_text())
+        if meta["paths"] == paths and meta["ckpt_mtimes"] == ckpt_mtimes:
+            print(f"Teacher logits loaded from {teacher_cache}")
+            return torch.from_numpy(np.load(teacher_cache))
+
+    teacher, _ = student_mod.build_model(torch, nn, models, None)
+    plain = datasets.ImageFolder(ds.root, transform=val_tf, is_valid_file=valid_img)
+    loader = make_loader(plain, 32, shuffle=False, name="teacher", log_wait=False)
+
+    start = time.time()
+    chunks = []
+    with torch.inference_mode():
+        for imgs, _ in tqdm(loader, desc="Teacher", leave=False):
+            chunks.append(teacher(imgs).float())
+    logits = torch.cat(chunks)
+    np.save(teacher_cache, logits.numpy())
+    meta_path.write_text(json.dumps({"paths": paths, "ckpt_mtimes": ckpt_mtimes}))
+    print(f"Teacher logits computed in {time.time() - start:.0f}s and cached in {teacher_cache}")
+    return logits
+
+
+def distillation_loss(student_logits, t_logits, labels):
+    """alpha * T^2 * KL(teacher_T || student_T) + (1 - alpha) * CE(labels)."""
+    soft = F.kl_div(F.log_softmax(student_logits / temperature, dim=1),
+                    F.softmax(t_logits / temperature, dim=1), reduction="batchmean")
+    hard = F.cross_entropy(student_logits, labels)
+    return alpha * temperature ** 2 * soft + (1 - alpha) * hard
+
+
+def evaluate(model, loader):
+    model.eval()
+    correct = total = 0
+    with torch.inference_mode():
+        for imgs, labels in loader:
+            imgs, labels = imgs.to(device), labels.to(device)
+            correct += (model(imgs).argmax(1) == labels).sum().item()
+            total += labels.size(0)
+    return correct / total
+
+
+def train_student():
+    train_ds = IndexedImageFolder(train_dir, transform=train_tf, is_valid_file=valid_img)
+    val_ds = datasets.ImageFolder(val_dir, transform=val_tf, is_valid_file=valid_img)
+    t_logits = teacher_logits(train_ds).to(device)
+
+    train_loader = make_loader(train_ds, batch_size, shuffle=True, name="train")
+    val_loader = make_loader(val_ds, batch_size, shuffle=False, name="val")
+
+    model = create_student(student_arch, len(train_ds.classes)).to(device)
+    optimizer = optim.AdamW(model.parameters(), lr=lr, weight_decay=weight_decay)
+    scheduler = optim.lr_scheduler.CosineAnnealingLR(optimizer, T_max=epochs)
+
+    best_acc, patience_count = 0.0, 0
+    for epoch in range(1, epochs + 1):
+        model.train()
+        for imgs, labels, idx in tqdm(train_loader, desc="Train", leave=False):
+            imgs, labels = imgs.to(device), labels.to(device)
+            optimizer.zero_grad()
+            loss = distillation_loss(model(imgs), t_logits[idx.to(device)], labels)
+            loss.backward()
+            optimizer.step()
+        scheduler.step()
+
+        va_acc = evaluate(model, val_loader)
+        print(f"Epoch {epoch:02d}/{epochs} | Val acc={va_acc:.4f}")
+
+        # Same checkpoint layout as the teachers, plus the architecture name
+        if va_acc > best_acc:
+            best_acc, patience_count = va_acc, 0
+            torch.save({
+                "model": model.state_dict(),
+                "classes": train_ds.classes,
+                "model_name": student_arch,
+                "epoch": epoch,
+                "val_acc": va_acc,
+            }, student_path)
+            print(f" New best student saved (acc={va_acc:.4f})")
+        else:
+            patience_count += 1
+            if patience_count >= patience:
+                print("\n Early Stopping")
+                break
+
+    params = sum(p.numel() for p in model.parameters()) / 1e6
+    print(f"\nBest student val accuracy: {best_acc:.4f} ({student_arch}, {params:.1f}M params) -> {student_path}")
+
+
+if __name__ == "__main__":
+    train_student()
@@ -0,0 +1,106 @@
+# DistributedDataParallel helpers for train_convnext.py (torchrun-compatible, gloo by default so it
+# also runs on CPU-only multi-socket machines) and the 1/2/4-process scaling report.
+#   torchrun --standalone --nproc_per_node=4 train_convnext.py
+#   python distributed.py              # short timed run for each process count + efficiency table
+import json
+import os
+import subprocess
+import sys
+from pathlib import Path
+import torch
+import torch.distributed as dist
+
+scaling_file = Path("ddp_scaling.json")
+
+
+def setup(backend="gloo"):
+    """Join the process group when launched by torchrun; returns (rank, world_size, local_rank).
+
+    Outside torchrun this is a no-op returning (0, 1, 0). Each process gets an equal share of the
+    CPU cores for its intra-op threads so N processes do not oversubscribe the machine.
+    """
+    if "WORLD_SIZE" not in os.environ:
+        return 0, 1, 0
+    rank = int(os.environ["RANK"])
+    world_size = int(os.environ["WORLD_SIZE"])
+    local_rank = int(os.environ.get("LOCAL_RANK", 0))
+    local_world = int(os.environ.get("LOCAL_WORLD_SIZE", world_size))
+    if torch.cuda.is_available():
+        torch.cuda.set_device(local_rank)
+    torch.set_num_threads(max(1, (os.cpu_count() or 1) // local_world))
+    dist.init_process_group(backend=backend)
+    return rank, world_size, local_rank
+
+
+def cleanup():
+    if dist.is_available() and dist.is_initialized():
+        dist.destroy_process_group()
+
+
+def is_main():
+    return not dist.is_initialized() or dist.get_rank() == 0
+
+
+def all_reduce_sum(*values):
+    """Sum scalars/tensors across ranks (identity on a single process); returns float64 values."""
+    t = torch.tensor([float(v) for v in values], dtype=torch.float64)
+    if dist.is_initialized():
+        dist.all_reduce(t, op=dist.ReduceOp.SUM)
+    return t.tolist()
+
+
+def broadcast_flag(flag):
+    """Rank 0's boolean on every rank (identity on a single process), e.g. a stop decision."""
+    t = torch.tensor([int(bool(flag))])
+    if dist.is_initialized():
+        dist.broadcast(t, src=0)
+    return bool(t.item())
+
+
+class ShardSampler(torch.utils.data.Sampler):
+    """Every rank-th sample, without DistributedSampler's padding (evaluation: each sample counted once)."""
+
+    def __init__(self, dataset):
+        rank = dist.get_rank() if dist.is_initialized() else 0
+        world_size = dist.get_world_size() if dist.is_initialized() else 1
+        self.indices = range(rank, len(dataset), world_size)
+
+    def __iter__(self):
+        return iter(self.indices)
+
+    def __len__(self):
+        return len(self.indices)
+
+
+def record_scaling(world_size, img_per_s):
+    """Store the aggregate training throughput of a run with world_size processes."""
+    results = json.loads(scaling_file.read_text()) if scaling_file.exists() else {}
+    results[str(world_size)] = img_per_s
+    scaling_file.write_text(json.dumps(results, indent=2))
+
+
+def scaling_report():
+    """Throughput and efficiency (img/s with N processes / (N x img/s with 1)) from ddp_scaling.json."""
+    if not scaling_file.exists():
+        print(f"No scaling results in {scaling_file}")
+        return
+    results = {int(k): v for k, v in json.loads(scaling_file.read_text()).items()}
+    base = results.get(1)
+    print(f"\n{'processes':>9s} {'img/s':>9s} {'speedup':>8s} {'efficiency':>11s}")
+    for n in sorted(results):
+        speedup = results[n] / base if base else float("nan")
+        print(f"{n:9d} {results[n]:9.1f} {speedup:8.2f} {speedup / n:11.1%}")
+
+
+def main(script="train_convnext.py", process_counts=(1, 2, 4)):
+    # Each run executes a short timed training (DDP_BENCHMARK_STEPS) and records its throughput
+    env = dict(os.environ, DDP_BENCHMARK_STEPS=os.environ.get("DDP_BENCHMARK_STEPS", "30"))
+    for n in process_counts:
+        print(f"--- {n} process(es) ---", flush=True)
+        subprocess.run([sys.executable, "-m", "torch.distributed.run", "--standalone",
+                        f"--nproc_per_node={n}", script], env=env, check=True)
+    scaling_report()
+
+
+if __name__ == "__main__":
+    main(*sys.argv[1:2])
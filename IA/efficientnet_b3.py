@@ -3,27 +3,99 @@ import torch
 import torch.nn as nn
 import torch.optim as optim
 from torchvision import datasets, transforms, models
-from torch.utils.data import DataLoader
 from pathlib import Path
 from tqdm import tqdm
+from packed_dataset import PackedImageDataset
+from manifest_dataset import ManifestImageFolder
+from dataset_index import IndexImageFolder
+from loaders import make_loader
+from batch_augment import BatchAugment, compare_stats
+from checkpointing import AsyncCheckpointer, resumable_checkpoint, rng_state, set_rng_state
+from sweep import trial_params, report_epoch
+from feature_cache import build_feature_store, train_head, freeze_backbone
+from profiling import StageTimer, TorchProfile, stage
+from mixed_precision import amp_dtype_for, make_scaler, autocast, to_device, train_step, compare_train_speed
 import time
 
 # Define paths to training and validation datasets
 train_dir = "C:\\Users\\thiba\\OneDrive\\Bureau\\AI_Project\\Split\\Training"
 val_dir = "C:\\Users\\thiba\\OneDrive\\Bureau\\AI_Project\\Split\\Validation"
+# Folder written by packed_dataset.py (None = decode the JPEGs every epoch)
+packed_dir = None
+# Split/split_manifest.csv written by Split.py (None = walk train_dir/val_dir)
+split_manifest = None
+val_fold = None         # k-fold: use this manifest fold as validation
+use_index = True        # List train_dir/val_dir from the dataset index (dataset_index.py) instead of walking them
 
 # Hyperparameters configuration
 batch_size = 6          # Number of images per batch
 epochs = 60             # Maximum number of training epochs
 lr = 8e-5               # Learning rate
 weight_decay = 8e-4     # L2 regularization parameter
+dropouts = (0.45, 0.4, 0.35)    # Dropout before each layer of the classifier head
+label_smoothing = 0.15  # Label smoothing of the cross-entropy loss
 seed = 42               # Random seed for reproducibility
+fast_train = False      # Autocast (bf16 CPU / fp16-bf16 GPU) + channels_last + on-device metrics
+compare_speed = False   # Time a few steps of the fp32 loop vs the fast mode before training
+batch_augment = False   # Run the training augmentations batch-wise on the device (batch_augment.py)
+check_augment = False   # Print output statistics of the PIL pipeline vs the batched one before training
+
+# Two-phase mode: head trained on cached frozen-backbone features, then optional partial fine-tuning
+head_only = False       # Phase 1 on features cached by feature_cache.py instead of full fine-tuning
+feature_dir = "features_b3"
+feature_variants = 4    # Augmented feature variants per training image (plus the clean one)
+head_epochs = 30
+head_lr = 1e-3
+unfreeze_stages = 0     # Phase 2: fine-tune only the last N backbone stages (0 = stop after phase 1)
+
+# Data loading (None = automatic: CPU count for workers, pinned memory only on GPU)
+num_workers = None      # Decode/augmentation worker processes
+pin_memory = None       # Page-locked batches for faster host-to-GPU copies
+prefetch_factor = 4     # Batches prepared in advance by each worker
+
+# Full-state checkpoints every epoch (background writes, last keep_checkpoints kept) and opt-in resume
+checkpoint_dir = "checkpoints_b3"
+run_name = "default"    # Checkpoints of this run go to checkpoint_dir/run_name
+keep_checkpoints = 3
+resume = False          # Continue an interrupted run (latest checkpoint of run_name, unless that run completed)
+best_path = "efficientnet_b3.pt"
+
+# Profiling: per-stage time table each epoch + Chrome trace (decode/transform split needs num_workers=0)
+profile = False
+profile_torch_steps = 0 # Capture a torch.profiler trace for this many training steps (0 = off)
+
+# Sweep trial (sweep.py): this trial's hyperparameters override the values above, before anything reads them
+params = trial_params(allowed=("batch_size", "epochs", "lr", "weight_decay", "dropouts", "label_smoothing",
+                               "fast_train", "batch_augment", "head_only", "feature_dir", "feature_variants",
+                               "head_epochs", "head_lr", "unfreeze_stages", "num_workers", "checkpoint_dir",
+                               "run_name", "resume", "best_path", "profile"))
+batch_size = params.get("batch_size", batch_size)
+epochs = params.get("epochs", epochs)
+lr = params.get("lr", lr)
+weight_decay = params.get("weight_decay", weight_decay)
+dropouts = params.get("dropouts", dropouts)
+label_smoothing = params.get("label_smoothing", label_smoothing)
+fast_train = params.get("fast_train", fast_train)
+batch_augment = params.get("batch_augment", batch_augment)
+head_only = params.get("head_only", head_only)
+feature_dir = params.get("feature_dir", feature_dir)
+feature_variants = params.get("feature_variants", feature_variants)
+head_epochs = params.get("head_epochs", head_epochs)
+head_lr = params.get("head_lr", head_lr)
+unfreeze_stages = params.get("unfreeze_stages", unfreeze_stages)
+num_workers = params.get("num_workers", num_workers)
+checkpoint_dir = params.get("checkpoint_dir", checkpoint_dir)
+run_name = params.get("run_name", run_name)
+resume = params.get("resume", resume)
+best_path = params.get("best_path", best_path)
+profile = params.get("profile", profile)
+
+timer = StageTimer(enabled=profile)
 
 # Set random seed for reproducibility
 torch.manual_seed(seed)
 # Use GPU if available, otherwise CPU
 device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-print("Device:", device)
 
 # ImageNet normalization values (standard for pretrained models)
 mean = [0.485, 0.456, 0.406]
@@ -48,6 +120,31 @@ val_tf = transforms.Compose([
     transforms.Normalize(mean, std),    # Normalize with ImageNet stats
 ])
 
+# Same augmentations on packed uint8 tensors (the Resize to 256 was done once at pack time)
+train_tf_packed = transforms.Compose([
+    transforms.RandomResizedCrop(224, scale=(0.85, 1.0), antialias=True),
+    transforms.RandomHorizontalFlip(p=0.5),
+    transforms.RandomRotation(10),
+    transforms.ColorJitter(0.25, 0.25, 0.2, 0.08),
+    transforms.RandomPerspective(0.12, p=0.2),
+    transforms.ConvertImageDtype(torch.float32),               # uint8 [0,255] -> float [0,1]
+    transforms.Normalize(mean, std),
+])
+
+# Batched augmentation: workers only decode + resize to 256, the rest runs on the device
+train_tf_uint8 = transforms.Compose([
+    transforms.Resize((256, 256)),
+    transforms.PILToTensor(),                                   # uint8 CHW
+])
+augment = BatchAugment(size=224, scale=(0.85, 1.0), flip_p=0.5, degrees=10,
+                       brightness=0.25, contrast=0.25, saturation=0.2, hue=0.08,
+                       distortion_scale=0.12, perspective_p=0.2, mean=mean, std=std)
+
+val_tf_packed = transforms.Compose([
+    transforms.ConvertImageDtype(torch.float32),
+    transforms.Normalize(mean, std),
+])
+
 # Filter function to exclude hidden or system files
 def valid_img(path):
     name = Path(path).name
@@ -57,21 +154,52 @@ def valid_img(path):
     # Accept only JPG/JPEG files
     return name.lower().endswith((".jpg", ".jpeg"))
 
-# Load datasets from folder structure (each subfolder = one class)
-train_ds = datasets.ImageFolder(train_dir, transform=train_tf, is_valid_file=valid_img)
-val_ds   = datasets.ImageFolder(val_dir, transform=val_tf, is_valid_file=valid_img)
-num_classes = len(train_ds.classes)
-
-# Create data loaders for batch processing
-train_loader = DataLoader(train_ds, batch_size=batch_size, shuffle=True)   # Shuffle training data
-val_loader   = DataLoader(val_ds, batch_size=batch_size, shuffle=False)    # Don't shuffle validation
-
-print("Number of classes :", num_classes)
-print("Train images :", len(train_ds))
-print("Val images   :", len(val_ds))
-
-
-def create_efficientnet_b3(num_classes):
+# Timed decode and augmentation (pass-through when profiling is off)
+image_loader = timer.wrap(datasets.folder.default_loader, "decode")
+reference_train_tf = train_tf
+train_tf = timer.wrap(train_tf_uint8 if batch_augment else train_tf, "transform")
+val_tf = timer.wrap(val_tf, "transform")
+
+# "Training" or "Validation" dataset from the configured source (packed, manifest or folders)
+def make_dataset(split, transform):
+    if packed_dir:
+        name = "Training_256" if split == "Training" else "Validation_224_jpeg"
+        return PackedImageDataset(Path(packed_dir) / name, transform=transform)
+    if split_manifest:
+        return ManifestImageFolder(split_manifest, split, val_fold, transform=transform, loader=image_loader)
+    # Folder structure: each subfolder = one class
+    root = train_dir if split == "Training" else val_dir
+    if use_index:
+        return IndexImageFolder(root, transform=transform, loader=image_loader)
+    return datasets.ImageFolder(root, transform=transform, is_valid_file=valid_img, loader=image_loader)
+
+# Datasets and loaders, built from train_model() only: DataLoader workers re-import this module
+# on Windows (spawn), so nothing expensive may run at import time
+def load_data():
+    global train_ds, val_ds, num_classes, train_loader, val_loader
+    print("Device:", device)
+
+    # Load datasets
+    if packed_dir:
+        train_ds = make_dataset("Training", None if batch_augment else train_tf_packed)
+        val_ds   = make_dataset("Validation", val_tf_packed)
+    else:
+        train_ds = make_dataset("Training", train_tf)
+        val_ds   = make_dataset("Validation", val_tf)
+    num_classes = len(train_ds.classes)
+
+    # Create data loaders for batch processing
+    train_loader = make_loader(train_ds, batch_size, shuffle=True, name="train", num_workers=num_workers,    # Shuffle training data
+                               pin_memory=pin_memory, prefetch_factor=prefetch_factor)
+    val_loader   = make_loader(val_ds, batch_size, shuffle=False, name="val", num_workers=num_workers,       # Don't shuffle validation
+                               pin_memory=pin_memory, prefetch_factor=prefetch_factor)
+
+    print("Number of classes :", num_classes)
+    print("Train images :", len(train_ds))
+    print("Val images   :", len(val_ds))
+
+
+def create_efficientnet_b3(num_classes, widths=(640, 512), dropouts=(0.45, 0.4, 0.35)):
     """Create EfficientNet-B3 model with custom classifier head."""
     # Load pretrained weights from ImageNet
     weights = models.EfficientNet_B3_Weights.IMAGENET1K_V1
@@ -80,99 +208,197 @@ def create_efficientnet_b3(num_classes):
     # Replace the classifier with a custom multi-layer head
     in_features = model.classifier[1].in_features
     model.classifier = nn.Sequential(
-        nn.Dropout(0.45),                       # Dropout for regularization
-        nn.Linear(in_features, 640),            # First dense layer
+        nn.Dropout(dropouts[0]),                # Dropout for regularization
+        nn.Linear(in_features, widths[0]),      # First dense layer
         nn.ReLU(),                              # Activation function
-        nn.Dropout(0.4),                        # Dropout
-        nn.Linear(640, 512),                    # Second dense layer
+        nn.Dropout(dropouts[1]),                # Dropout
+        nn.Linear(widths[0], widths[1]),        # Second dense layer
         nn.ReLU(),                              # Activation function
-        nn.Dropout(0.35),                       # Dropout
-        nn.Linear(512, num_classes)             # Output layer
+        nn.Dropout(dropouts[2]),                # Dropout
+        nn.Linear(widths[1], num_classes)       # Output layer
     )
 
     return model.to(device)
 
 
-def run_epoch(model, loader, criterion, optimizer=None, train=False):
+def run_epoch(model, loader, criterion, optimizer=None, train=False, scaler=None, prof=None, frozen=()):
     """Run one epoch of training or validation."""
-    # Set model mode (training or evaluation)
+    # Set model mode (training or evaluation); frozen stages keep their pretrained BatchNorm statistics
     model.train(train)
-    total, correct, loss_sum = 0, 0, 0.0
+    for m in frozen:
+        m.eval()
+    amp_dtype = amp_dtype_for(device) if fast_train else None
+
+    # Metrics stay on the device; they are read back once at the end of the epoch
+    total = 0
+    correct = torch.zeros((), dtype=torch.long, device=device)
+    loss_sum = torch.zeros((), device=device)
 
     # Progress bar for visual feedback
     loop = tqdm(loader, desc="Train" if train else "Val", leave=False)
-    for imgs, labels in loop:
+    for step, (imgs, labels) in enumerate(timer.timed_iter(loop) if profile else loop):
         # Move data to device (GPU/CPU)
-        imgs, labels = imgs.to(device), labels.to(device)
+        with stage(timer, "to_device"):
+            imgs, labels = to_device(imgs, labels, device, channels_last=fast_train and not (train and batch_augment))
 
-        if train:
-            optimizer.zero_grad()  # Reset gradients
+        # uint8 batch -> augmented, normalized float batch
+        if train and batch_augment:
+            with stage(timer, "augment"):
+                imgs = augment(imgs)
+                if fast_train:
+                    imgs = imgs.contiguous(memory_format=torch.channels_last)
 
-        # Enable/disable gradient computation
-        with torch.set_grad_enabled(train):
-            logits = model(imgs)            # Forward pass
-            loss = criterion(logits, labels) # Compute loss
-
-            if train:
-                loss.backward()      # Backward pass
-                optimizer.step()     # Update weights
+        if train:
+            # Forward + backward + weight update (loss scaled when training in fp16)
+            logits, loss = train_step(model, imgs, labels, criterion, optimizer, scaler, amp_dtype, timer)
+            if prof is not None:
+                prof.step()
+        else:
+            with stage(timer, "val_forward"), torch.no_grad(), autocast(device, amp_dtype):
+                logits = model(imgs)            # Forward pass
+                loss = criterion(logits, labels) # Compute loss
 
         # Calculate accuracy
         preds = logits.argmax(1)
         bsz = labels.size(0)
         total += bsz
-        correct += (preds == labels).sum().item()
-        loss_sum += loss.item() * bsz
+        correct += (preds == labels).sum()
+        loss_sum += loss.detach().float() * bsz
 
-        # Update progress bar
-        loop.set_postfix(loss=f"{loss.item():.4f}", acc=f"{correct/total:.4f}")
+        # Update progress bar (reading values syncs the device, so fast mode does it every 50 steps)
+        if not fast_train or step % 50 == 0:
+            loop.set_postfix(loss=f"{loss.item():.4f}", acc=f"{correct.item()/total:.4f}")
 
-    return loss_sum / total, correct / total
+    return loss_sum.item() / total, correct.item() / total
+
+
+def train_head_phase(model, criterion):
+    """Phase 1: backbone features cached once (clean + augmented variants), head fitted on them."""
+    if packed_dir:
+        clean_tf = transforms.Compose([transforms.Resize((224, 224), antialias=True), val_tf_packed])
+        aug_tf = train_tf_packed
+    else:
+        clean_tf, aug_tf = val_tf, reference_train_tf
+    train_store = build_feature_store(model, lambda tf: make_dataset("Training", tf),
+                                      [clean_tf] + [aug_tf] * feature_variants,
+                                      Path(feature_dir) / "train", device=device)
+    val_store = build_feature_store(model, lambda tf: make_dataset("Validation", tf), [clean_tf],
+                                    Path(feature_dir) / "val", device=device)
+    return train_head(model.classifier, train_store, val_store, criterion, epochs=head_epochs,
+                      lr=head_lr, weight_decay=weight_decay, device=device)
 
 
 def train_model():
     """Main training loop with early stopping and learning rate scheduling."""
+    load_data()
+
     # Initialize model
-    model = create_efficientnet_b3(num_classes)
+    model = create_efficientnet_b3(num_classes, dropouts=dropouts)
 
     # Loss function with label smoothing to prevent overconfidence
-    criterion = nn.CrossEntropyLoss(label_smoothing=0.15)
-    # AdamW optimizer (Adam with weight decay)
-    optimizer = optim.AdamW(model.parameters(), lr=lr, weight_decay=weight_decay)
+    criterion = nn.CrossEntropyLoss(label_smoothing=label_smoothing)
+
+    # Checkpoints record the training mode, so a series from another mode is never resumed
+    mode = f"head_only+{unfreeze_stages}" if head_only else "full"
+    run_dir = Path(checkpoint_dir) / run_name
+
+    # Interrupted run: latest full-state checkpoint (model, optimizer, scheduler, counters, RNG).
+    # Phase 1 alone writes no epoch checkpoints, so it is never resumed and always runs
+    ckpt_path, ckpt = None, None
+    if resume and not (head_only and unfreeze_stages == 0):
+        ckpt_path, ckpt = resumable_checkpoint(run_dir, "efficientnet_b3", train_ds.classes, mode=mode)
+
+    # Two-phase mode: head on cached features first, then (optionally) only the last stages end-to-end.
+    # A resumed phase 2 checkpoint already holds the trained head
+    frozen = []
+    if head_only:
+        head_acc = train_head_phase(model, criterion) if ckpt is None else None
+        if unfreeze_stages == 0:
+            torch.save({
+                "model": model.state_dict(),
+                "classes": train_ds.classes,
+                "model_name": "efficientnet_b3",
+                "epoch": 0,
+                "val_acc": head_acc
+            }, best_path)
+            print(f"Model saved in : {best_path}")
+            return best_path
+        frozen = freeze_backbone(model, unfreeze_stages)
+
+    if fast_train:
+        model = model.to(memory_format=torch.channels_last)
+
+    # AdamW optimizer (Adam with weight decay), on the parameters that are still trainable
+    optimizer = optim.AdamW((p for p in model.parameters() if p.requires_grad), lr=lr, weight_decay=weight_decay)
 
     # Learning rate scheduler: reduce LR when validation accuracy plateaus
     scheduler = optim.lr_scheduler.ReduceLROnPlateau(
         optimizer, mode='max', factor=0.45, patience=4, min_lr=5e-7
     )
+    # Loss scaler (only active for fp16 on GPU)
+    scaler = make_scaler(device, amp_dtype_for(device)) if fast_train else None
+
+    # Same input batch through both pipelines (statistics should match closely)
+    if check_augment and batch_augment:
+        compare_stats(next(iter(train_loader))[0], reference_train_tf, augment)
+
+    if compare_speed:
+        compare_train_speed(model, train_loader, criterion, optimizer, device,
+                            augment=augment if batch_augment else None)
+        if fast_train:
+            model = model.to(memory_format=torch.channels_last)
 
     # Early stopping configuration
     patience = 15      # Stop if no improvement after 15 epochs
     patience_count = 0
 
     best_acc = 0.0
-    best_path = "efficientnet_b3.pt"
+    start_epoch = 1
+
+    if ckpt is not None:
+        model.load_state_dict(ckpt["model"])
+        optimizer.load_state_dict(ckpt["optimizer"])
+        scheduler.load_state_dict(ckpt["scheduler"])
+        if scaler is not None and ckpt.get("scaler"):
+            scaler.load_state_dict(ckpt["scaler"])
+        best_acc, patience_count = ckpt["best_acc"], ckpt["patience_count"]
+        set_rng_state(ckpt["rng"])
+        start_epoch = ckpt["epoch"] + 1
+        print(f"Resumed from {ckpt_path} (epoch {ckpt['epoch']}, best acc {best_acc:.4f})")
+
+    # Checkpoints are snapshotted to CPU here and written by a background thread
+    checkpointer = AsyncCheckpointer(run_dir, "efficientnet_b3", keep=keep_checkpoints, resumed=ckpt is not None)
 
     start = time.time()     # Track training time
 
+    # torch.profiler capture of the first training steps (no-op when profile_torch_steps = 0)
+    prof = TorchProfile(profile_torch_steps, "torch_trace_efficientnet_b3.json")
+
     # Training loop
-    for epoch in range(1, epochs + 1):
+    for epoch in range(start_epoch, epochs + 1):
         # Run training epoch
-        tr_loss, tr_acc = run_epoch(model, train_loader, criterion, optimizer, train=True)
+        epoch_start = time.time()
+        tr_loss, tr_acc = run_epoch(model, train_loader, criterion, optimizer, train=True, scaler=scaler, prof=prof,
+                                   frozen=frozen)
+        tr_ips = len(train_ds) / (time.time() - epoch_start)
         # Run validation epoch
         va_loss, va_acc = run_epoch(model, val_loader, criterion, train=False)
 
         print(f"Epoch {epoch:02d}/{epochs} | "
-              f"Train acc={tr_acc:.4f} | Val acc={va_acc:.4f}")
+              f"Train acc={tr_acc:.4f} | Val acc={va_acc:.4f} | {tr_ips:.1f} img/s")
+        timer.report(f"Epoch {epoch:02d}")
+        timer.reset()
 
         # Adjust learning rate based on validation accuracy
         scheduler.step(va_acc)
 
         # Save model if validation accuracy improved
+        stop = False
         if va_acc > best_acc:
             best_acc = va_acc
             patience_count = 0
             # Save model checkpoint with metadata
-            torch.save({
+            checkpointer.save_file({
                 "model": model.state_dict(),
                 "classes": train_ds.classes,
                 "model_name": "efficientnet_b3",
@@ -183,15 +409,41 @@ def train_model():
         else:
             # Increment patience counter if no improvement
             patience_count += 1
-            if patience_count >= patience:
-                print("\n Early Stopping: more progress")
-                break
+            stop = patience_count >= patience
+
+        # Sweep trial: every epoch is reported; stopped early when clearly behind the other trials
+        pruned = report_epoch(epoch, va_acc)
+
+        # Full training state, enough to continue from the next epoch ("completed" = never resumed)
+        checkpointer.save_epoch({
+            "model": model.state_dict(),
+            "optimizer": optimizer.state_dict(),
+            "scheduler": scheduler.state_dict(),
+            "scaler": scaler.state_dict() if scaler is not None else None,
+            "epoch": epoch,
+            "best_acc": best_acc,
+            "patience_count": patience_count,
+            "rng": rng_state(),
+            "classes": train_ds.classes,
+            "mode": mode,
+            "completed": stop or pruned or epoch == epochs,
+        }, epoch)
+
+        if stop:
+            print("\n Early Stopping: more progress")
+            break
+        if pruned:
+            print("\n Pruned by the sweep")
+            break
+
+    checkpointer.close()    # Wait for the last writes
 
     # Print training summary
     total_min = (time.time() - start) / 60
     print(f"\nCompleted in {total_min:.1f} min")
     print(f"Improved validation accuracy : {best_acc:.4f}")
     print(f"Model saved in : {best_path}")
+    timer.write_chrome_trace("trace_efficientnet_b3.json")
 
     return best_path
 
@@ -0,0 +1,102 @@
+import importlib.util, sys, time
+from pathlib import Path
+import torch
+import torch.nn as nn
+from torchvision import models
+
+try:
+    import onnx
+    import onnxruntime as ort
+except ImportError:
+    onnx = ort = None
+
+# ---- config ----
+student_file = Path("student_infer.py")
+export_members = True          # also export each checkpoint on its own
+onnx_opset = 17
+benchmark_backends = True      # report startup + per-image latency for every backend
+bench_batch_sizes = (1, 8)
+bench_runs = 20
+# ----------------
+
+# --- controlled import (same as marker.py) ---
+spec = importlib.util.spec_from_file_location("student_infer", student_file)
+student_mod = importlib.util.module_from_spec(spec)
+sys.modules["student_infer"] = student_mod
+spec.loader.exec_module(student_mod)
+
+student_mod.torch = torch
+student_mod.nn = nn
+student_mod.models = models
+
+
+# TorchScript file with the class list stored next to the graph
+def save_torchscript(module, path, classes):
+    scripted = torch.jit.script(module)
+    torch.jit.save(scripted, path, _extra_files={"classes.txt": "\n".join(classes),
+                                                 "checkpoints.txt": student_mod.checkpoint_fingerprint(torch)})
+    print(f"TorchScript -> {path}")
+
+
+# ONNX file with a dynamic batch axis and the class list as model metadata
+def save_onnx(module, path, classes):
+    if onnx is None:
+        print(f"onnx not installed, skipping {path}")
+        return
+    dummy = torch.randn(2, 3, 224, 224)
+    torch.onnx.export(module, dummy, path,
+                      input_names=["input"], output_names=["logits"],
+                      dynamic_axes={"input": {0: "batch"}, "logits": {0: "batch"}},
+                      opset_version=onnx_opset)
+    proto = onnx.load(path)
+    for key, value in (("classes", "\n".join(classes)), ("checkpoints", student_mod.checkpoint_fingerprint(torch))):
+        entry = proto.metadata_props.add()
+        entry.key, entry.value = key, value
+    onnx.save(proto, path)
+    print(f"ONNX        -> {path}")
+
+
+def export_all():
+    # Eager fused ensemble (weights already folded into the heads)
+    ensemble, classes = student_mod.build_model(torch, nn, models, None, script=False)
+    save_torchscript(ensemble, "ensemble.ts", classes)
+    save_onnx(ensemble, "ensemble.onnx", classes)
+
+    if export_members:
+        for name, loader in (("convnext_base_custom", student_mod.load_convnext),
+                             ("efficientnet_b3", student_mod.load_efficientnet)):
+            member, member_classes = loader(torch, nn, models)
+            save_torchscript(member, f"{name}.ts", member_classes)
+            save_onnx(member, f"{name}.onnx", member_classes)
+
+
+def benchmark():
+    print(f"\n{'backend':12s} {'startup':>9s}  " + "  ".join(f"bs={bs:<3d} ms/img" for bs in bench_batch_sizes))
+    for backend in ("eager", "torchscript", "onnxruntime"):
+        if backend == "onnxruntime" and ort is None:
+            print(f"{backend:12s} onnxruntime not installed")
+            continue
+
+        t0 = time.perf_counter()
+        # script=False: the eager row times the plain nn.Module, not a TorchScript build of it
+        model, _ = student_mod.build_model(torch, nn, models, None, script=False, backend=backend, ort=ort)
+        startup = time.perf_counter() - t0
+
+        cells = []
+        with torch.inference_mode():
+            for bs in bench_batch_sizes:
+                x = torch.randn(bs, 3, 224, 224)
+                for _ in range(3):
+                    model(x)  # warm-up (TorchScript profiling runs, ORT arena allocation)
+                t0 = time.perf_counter()
+                for _ in range(bench_runs):
+                    model(x)
+                cells.append((time.perf_counter() - t0) / (bench_runs * bs) * 1000)
+
+        print(f"{backend:12s} {startup:8.2f}s  " + "  ".join(f"{ms:13.1f}" for ms in cells))
+
+
+if __name__ == "__main__":
+    export_all()
+    if benchmark_backends:
+        benchmark()
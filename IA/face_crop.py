@@ -0,0 +1,242 @@
+# Face detection + alignment stage, run after Rotate.py (EXIF fix) and before Split.py.
+# Each photo is replaced by a square crop around the largest face, rotated so the eyes are level.
+# Crops are cached by source content hash, so renamed/moved files and the marker.py test images
+# reuse the same crop, and only new or modified photos go through the detector.
+#
+# Detector: OpenCV YuNet (small CNN, fast on CPU, gives eye landmarks for alignment) when the
+# model file is present, otherwise the Haar cascade bundled with OpenCV (crop only, no alignment).
+import os
+import sys
+import json
+import hashlib
+import math
+import time
+import shutil
+import threading
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import cv2
+import numpy as np
+
+from dataset_index import file_sha1
+
+# Images corrected by Rotate.py
+input_root_dir = 'C:\\Users\\thiba\\OneDrive\\Bureau\\AI_Project\\Rotate'
+# Same tree with aligned face crops (use as src_dir in Split.py)
+output_root_dir = 'C:\\Users\\thiba\\OneDrive\\Bureau\\AI_Project\\FaceCrop'
+# Crops keyed by source SHA-1 (shared with marker.py)
+cache_dir = 'C:\\Users\\thiba\\OneDrive\\Bureau\\AI_Project\\FaceCropCache'
+manifest_path = os.path.join(output_root_dir, 'face_crop_manifest.json')
+# YuNet model (https://github.com/opencv/opencv_zoo, face_detection_yunet); Haar cascade if missing
+yunet_model = 'C:\\Users\\thiba\\OneDrive\\Bureau\\AI_Project\\face_detection_yunet_2023mar.onnx'
+num_workers = os.cpu_count() or 1
+
+crop_size = 256          # output side in pixels (training resizes/crops to 224 from 256)
+margin = 0.6             # extra context around the detected box (0.6 = 60% wider/taller)
+detect_max_side = 640    # photos are downscaled to this size for detection only
+score_threshold = 0.7
+
+
+_detector = None
+
+
+# One detector per process (lazily created in pool workers and DataLoader workers)
+def get_detector():
+    global _detector
+    if _detector is None:
+        if os.path.exists(yunet_model):
+            _detector = ('yunet', cv2.FaceDetectorYN.create(yunet_model, '', (320, 320), score_threshold))
+        else:
+            path = os.path.join(cv2.data.haarcascades, 'haarcascade_frontalface_default.xml')
+            _detector = ('haar', cv2.CascadeClassifier(path))
+    return _detector
+
+
+# cv2.imread/imwrite do not handle non-ASCII Windows paths, go through numpy buffers instead
+def read_bgr(path):
+    return cv2.imdecode(np.fromfile(path, dtype=np.uint8), cv2.IMREAD_COLOR)
+
+
+def write_jpeg(path, img):
+    ok, buf = cv2.imencode('.jpg', img, [cv2.IMWRITE_JPEG_QUALITY, 95])
+    if not ok:
+        raise ValueError(f'JPEG encoding failed for {path}')
+    # Unique temp name: two workers may crop the same content (duplicate images) at once
+    tmp = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    buf.tofile(tmp)
+    os.replace(tmp, path)
+
+
+# Largest face as (box x, y, w, h, eyes ((x, y) image-left, (x, y) image-right) or None)
+def detect_face(img):
+    h, w = img.shape[:2]
+    scale = min(1.0, detect_max_side / max(h, w))
+    small = cv2.resize(img, (round(w * scale), round(h * scale)), interpolation=cv2.INTER_AREA) if scale < 1 else img
+    kind, det = get_detector()
+
+    if kind == 'yunet':
+        det.setInputSize((small.shape[1], small.shape[0]))
+        _, faces = det.detect(small)
+        if faces is None or len(faces) == 0:
+            return None
+        f = max(faces, key=lambda r: r[2] * r[3]) / scale
+        return f[:4], ((f[4], f[5]), (f[6], f[7]))
+
+    gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+    faces = det.detectMultiScale(gray, scaleFactor=1.1, minNeighbors=5, minSize=(40, 40))
+    if len(faces) == 0:
+        return None
+    return max(faces, key=lambda r: r[2] * r[3]) / scale, None
+
+
+# Square crop centred on the face, rotated so the eyes are horizontal, in one warpAffine
+def align_crop(img, box, eyes):
+    x, y, bw, bh = box
+    cx, cy = x + bw / 2, y + bh / 2
+    side = max(bw, bh) * (1 + margin)
+    angle = 0.0
+    if eyes is not None:
+        (rx, ry), (lx, ly) = eyes
+        angle = math.degrees(math.atan2(ly - ry, lx - rx))
+    m = cv2.getRotationMatrix2D((float(cx), float(cy)), angle, crop_size / side)
+    m[0, 2] += crop_size / 2 - cx
+    m[1, 2] += crop_size / 2 - cy
+    return cv2.warpAffine(img, m, (crop_size, crop_size), flags=cv2.INTER_LINEAR,
+                          borderMode=cv2.BORDER_REPLICATE)
+
+
+# Crop of one photo and how it was obtained ('aligned', 'cropped' or 'no-face' = whole photo resized)
+def crop_image(img):
+    found = detect_face(img)
+    if found is None:
+        return cv2.resize(img, (crop_size, crop_size), interpolation=cv2.INTER_AREA), 'no-face'
+    box, eyes = found
+    return align_crop(img, box, eyes), 'aligned' if eyes is not None else 'cropped'
+
+
+# Cache location for a source hash; crop parameters are part of the path
+def cache_path(sha1):
+    return os.path.join(cache_dir, f'{crop_size}px_m{round(margin * 100)}', sha1[:2], sha1 + '.jpg')
+
+
+# Path of the cached crop for a photo, computing it on a miss; returns (path, status, sha1)
+def cached_crop(image_path, sha1=None):
+    return _cached_crop(sha1 or file_sha1(image_path), lambda: read_bgr(image_path), image_path)
+
+
+# Same for image bytes (serve.py uploads); the key is the same content hash as for a file
+def cached_crop_bytes(data):
+    decode = lambda: cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+    return _cached_crop(hashlib.sha1(data).hexdigest(), decode, 'uploaded image')
+
+
+def _cached_crop(sha1, decode, name):
+    path = cache_path(sha1)
+    if os.path.exists(path):
+        return path, 'cached', sha1
+    img = decode()
+    if img is None:
+        raise ValueError(f'cannot decode {name}')
+    crop, status = crop_image(img)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    write_jpeg(path, crop)
+    return path, status, sha1
+
+
+# Put the cached crop at its place in the output tree (hardlink, copy if linking fails)
+def place(src, dst):
+    os.makedirs(os.path.dirname(dst), exist_ok=True)
+    if os.path.exists(dst):
+        os.remove(dst)
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+
+# Worker entry point
+def process_one(image_path, output_path):
+    st = os.stat(image_path)
+    try:
+        crop, status, sha1 = cached_crop(image_path)
+        place(crop, output_path)
+    except Exception:
+        return 'error', {'size': st.st_size, 'mtime': st.st_mtime, 'sha1': None, 'status': 'error'}
+    return status, {'size': st.st_size, 'mtime': st.st_mtime, 'sha1': sha1, 'status': status}
+
+
+def load_manifest():
+    if os.path.exists(manifest_path):
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    return {}
+
+
+def save_manifest(manifest):
+    tmp = manifest_path + '.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f)
+    os.replace(tmp, manifest_path)
+
+
+# Unchanged source whose crop is still in place (and was made with the current parameters)
+def is_up_to_date(entry, image_path, output_path):
+    if entry is None or entry['sha1'] is None or not os.path.exists(output_path):
+        return False
+    st = os.stat(image_path)
+    return (entry['size'] == st.st_size and entry['mtime'] == st.st_mtime
+            and os.path.exists(cache_path(entry['sha1'])))
+
+
+def main():
+    if not os.path.exists(input_root_dir):
+        print(f"Error: Input directory '{input_root_dir}' does not exist.")
+        return
+
+    os.makedirs(output_root_dir, exist_ok=True)
+    manifest = load_manifest()
+
+    jobs = []
+    skipped = 0
+    for dirpath, dirnames, filenames in os.walk(input_root_dir):
+        for filename in filenames:
+            if filename.lower().endswith(('.jpg', '.jpeg')):
+                image_path = os.path.join(dirpath, filename)
+                relative_path = os.path.relpath(image_path, input_root_dir)
+                output_image_path = os.path.join(output_root_dir, relative_path)
+                if is_up_to_date(manifest.get(relative_path), image_path, output_image_path):
+                    skipped += 1
+                else:
+                    jobs.append((relative_path, image_path, output_image_path))
+
+    print(f"Face cropping '{input_root_dir}' ({len(jobs)} to process, {skipped} already done, "
+          f"{num_workers} workers, detector {get_detector()[0]})...")
+
+    counts = {}
+    errors = []
+    start = time.time()
+    with ProcessPoolExecutor(max_workers=num_workers) as pool:
+        futures = {pool.submit(process_one, img, out): rel for rel, img, out in jobs}
+        for done, fut in enumerate(as_completed(futures), 1):
+            status, entry = fut.result()
+            manifest[futures[fut]] = entry
+            counts[status] = counts.get(status, 0) + 1
+            if status == 'error':
+                errors.append(futures[fut])
+
+            if done % 50 == 0 or done == len(jobs):
+                sys.stdout.write(f"\r  {done}/{len(jobs)} images ({done / (time.time() - start):.1f} img/s)")
+                sys.stdout.flush()
+            if done % 500 == 0:
+                save_manifest(manifest)
+
+    save_manifest(manifest)
+
+    summary = ", ".join(f"{k}: {v}" for k, v in sorted(counts.items())) or "nothing to do"
+    print(f"\n\n Face cropping complete in {time.time() - start:.1f}s. {summary}. Skipped (unchanged): {skipped}.")
+    for rel in errors:
+        print(f"  could not be decoded: {rel}")
+    print(f"Aligned crops ({crop_size}x{crop_size}) saved in: '{output_root_dir}'")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,203 @@
+# Open-set face identification: penultimate-layer embeddings of both trained models stored in an
+# on-disk vector index. Enrolling a person appends a few vectors instead of retraining.
+import json
+import time
+from pathlib import Path
+import numpy as np
+import torch
+import torch.nn.functional as F
+from torch.utils.data import DataLoader
+from torchvision import models
+
+from marker import student_mod, TestImages, pat, list_test_files
+
+# ---- config ----
+index_dir = Path("face_index")
+enroll_dir = Path("C:\\Users\\thiba\\OneDrive\\Bureau\\AI_Project\\Split\\Training")   # one folder per identity
+threshold = 0.55        # cosine similarity below this = unknown person
+ivf_min_vectors = 5000  # switch from flat search to IVF once the index is this large
+nprobe = 8              # IVF lists scanned per query
+batch_size = 16
+# ----------------
+
+
+class EnsembleEmbedder:
+    """Pooled ConvNeXt features (1024-d) + EfficientNet 512-d head layer, L2-normalised and
+    concatenated with sqrt(0.7)/sqrt(0.3) scaling so a dot product is the weighted cosine."""
+
+    def __init__(self, convnext, effnet, weights=(0.7, 0.3)):
+        self.convnext = convnext.eval()
+        self.effnet = effnet.eval()
+        self.scales = [w ** 0.5 for w in weights]
+
+    @torch.inference_mode()
+    def __call__(self, x):
+        a = self.convnext.classifier[:2](self.convnext.avgpool(self.convnext.features(x)))
+        b = self.effnet.classifier[:-2](torch.flatten(self.effnet.avgpool(self.effnet.features(x)), 1))
+        emb = torch.cat([F.normalize(a, dim=1) * self.scales[0], F.normalize(b, dim=1) * self.scales[1]], dim=1)
+        return emb.float().numpy()
+
+
+def load_embedder():
+    convnext, _ = student_mod.load_convnext(torch, torch.nn, models)
+    effnet, _ = student_mod.load_efficientnet(torch, torch.nn, models)
+    return EnsembleEmbedder(convnext, effnet)
+
+
+class FaceIndex:
+    """Append-only vector store: vectors.f32 (N x dim), labels.txt, and once trained an IVF
+    layer (centroids.npy + lists.i32 giving each vector's list). Flat search until then."""
+
+    def __init__(self, root, dim):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.dim = dim
+        self.labels = []
+        if (self.root / "labels.txt").exists():
+            self.labels = (self.root / "labels.txt").read_text(encoding="utf-8").splitlines()
+        self.centroids = np.load(self.root / "centroids.npy") if (self.root / "centroids.npy").exists() else None
+        self._vectors = None
+        self._lists = self._load_lists()
+
+    def __len__(self):
+        return len(self.labels)
+
+    @property
+    def vectors(self):
+        # Re-mapped only when vectors were appended since the last map
+        n = len(self.labels)
+        if n == 0:
+            return np.zeros((0, self.dim), dtype=np.float32)
+        if self._vectors is None or self._vectors.shape[0] != n:
+            self._vectors = np.memmap(self.root / "vectors.f32", dtype=np.float32, mode="r", shape=(n, self.dim))
+        return self._vectors
+
+    def _load_lists(self):
+        if self.centroids is None or not (self.root / "lists.i32").exists():
+            return None
+        assign = np.fromfile(self.root / "lists.i32", dtype=np.int32)
+        return {c: list(np.flatnonzero(assign == c)) for c in range(len(self.centroids))}
+
+    def add(self, vectors, labels):
+        """Enroll vectors (n x dim, L2-normalised) for the given identity labels."""
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        start = len(self.labels)
+        with open(self.root / "vectors.f32", "ab") as f:
+            f.write(vectors.tobytes())
+        with open(self.root / "labels.txt", "a", encoding="utf-8") as f:
+            f.write("".join(f"{l}\n" for l in labels))
+        self.labels.extend(labels)
+
+        # Already IVF: each new vector joins its nearest list, no re-training needed
+        if self._lists is not None:
+            assign = (vectors @ self.centroids.T).argmax(1).astype(np.int32)
+            with open(self.root / "lists.i32", "ab") as f:
+                f.write(assign.tobytes())
+            for i, c in enumerate(assign):
+                self._lists[int(c)].append(start + i)
+
+    def train_ivf(self, nlist=None, iters=10, seed=0):
+        """Spherical k-means over the stored vectors, then assign every vector to a list."""
+        data = np.asarray(self.vectors)
+        nlist = nlist or max(1, int(np.sqrt(len(data))))
+        rng = np.random.default_rng(seed)
+        centroids = data[rng.choice(len(data), nlist, replace=False)].copy()
+        for _ in range(iters):
+            assign = (data @ centroids.T).argmax(1)
+            for c in range(nlist):
+                members = data[assign == c]
+                if len(members):
+                    centroids[c] = members.mean(0)
+            centroids /= np.linalg.norm(centroids, axis=1, keepdims=True) + 1e-12
+        assign = (data @ centroids.T).argmax(1).astype(np.int32)
+
+        np.save(self.root / "centroids.npy", centroids)
+        assign.tofile(self.root / "lists.i32")
+        self.centroids = centroids
+        self._lists = {c: list(np.flatnonzero(assign == c)) for c in range(nlist)}
+
+    def search(self, queries, k=5, nprobe=nprobe):
+        """Top-k (similarity, label) per query; IVF scans only the nprobe closest lists."""
+        vectors = self.vectors
+        results = []
+        for q in np.atleast_2d(queries):
+            if self._lists is None:
+                ids = np.arange(len(vectors))
+            else:
+                probe = np.argsort(-(self.centroids @ q))[:nprobe]
+                ids = np.fromiter((i for c in probe for i in self._lists[int(c)]), dtype=np.int64)
+            sims = vectors[ids] @ q
+            top = np.argsort(-sims)[:k]
+            results.append([(float(sims[t]), self.labels[ids[t]]) for t in top])
+        return results
+
+
+def identify(index, embeddings, k=5):
+    """Best matching identity per embedding, or "unknown" under the similarity threshold."""
+    out = []
+    for hits in index.search(embeddings, k=k):
+        if not hits or hits[0][0] < threshold:
+            out.append(("unknown", hits[0][0] if hits else 0.0))
+        else:
+            out.append((hits[0][1], hits[0][0]))
+    return out
+
+
+def embed_files(embedder, files):
+    loader = DataLoader(TestImages(files), batch_size=batch_size, shuffle=False)
+    chunks, kept = [], []
+    for x, idxs, errors in loader:
+        ok = [j for j, e in enumerate(errors) if not e]
+        if ok:
+            chunks.append(embedder(x[ok]))
+            kept.extend(int(idxs[j]) for j in ok)
+    return (np.concatenate(chunks) if chunks else np.zeros((0, 0), np.float32)), kept
+
+
+def enroll_identity(index, embedder, identity, image_paths):
+    """Add one person from a few photos; returns the time taken (embedding excluded)."""
+    vectors, kept = embed_files(embedder, list(image_paths))
+    t0 = time.perf_counter()
+    index.add(vectors, [str(identity)] * len(kept))
+    return time.perf_counter() - t0
+
+
+def main():
+    embedder = load_embedder()
+    dim = 1024 + 512
+    index = FaceIndex(index_dir, dim)
+
+    # First run: enroll every identity folder of enroll_dir
+    if len(index) == 0:
+        identities = sorted(p for p in enroll_dir.iterdir() if p.is_dir())
+        t0 = time.perf_counter()
+        for person in identities:
+            photos = sorted(f for f in person.iterdir() if f.suffix.lower() in (".jpg", ".jpeg")
+                            and not f.name.startswith("."))
+            enroll_identity(index, embedder, person.name, photos)
+        print(f"Enrolled {len(identities)} identities ({len(index)} vectors) in {time.perf_counter() - t0:.1f}s")
+        (index_dir / "index.json").write_text(json.dumps({"dim": dim, "threshold": threshold}))
+
+    if index.centroids is None and len(index) >= ivf_min_vectors:
+        index.train_ivf()
+        print(f"IVF index trained with {len(index.centroids)} lists")
+
+    # Open-set evaluation on the marker test set
+    files = [p for p in list_test_files() if pat.match(p.name)]
+    vectors, kept = embed_files(embedder, files)
+    t0 = time.perf_counter()
+    answers = identify(index, vectors)
+    lookup_ms = (time.perf_counter() - t0) / max(1, len(answers)) * 1000
+
+    correct = unknown = 0
+    for i, (label, sim) in zip(kept, answers):
+        true_label = pat.match(files[i].name).group(1)
+        correct += int(label == true_label)
+        unknown += int(label == "unknown")
+        print(f"{files[i].name:20s} true={true_label:>4s} pred={label:>7s} sim={sim:.3f}")
+    print(f"\nIdentified: {correct}/{len(answers)} ({correct / max(1, len(answers)):.4f}) | "
+          f"unknown: {unknown} | lookup {lookup_ms:.2f} ms/query over {len(index)} vectors")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+# Frozen-backbone feature store for the two-phase training mode of efficientnet_b3.py.
+# Pooled backbone features are computed once per image (variant 0 = validation transform, then a
+# few random augmentation draws) and kept in a memory-mapped float16 .npy. The classifier head then
+# trains on those features, which takes seconds per epoch instead of a full backbone pass.
+import json
+import os
+import time
+from pathlib import Path
+import numpy as np
+import torch
+from tqdm import tqdm
+
+from loaders import make_loader
+from profiling import TimedCall
+
+
+def pooled_features(model, x):
+    """Backbone output right before the classifier (torchvision EfficientNet layout), (N, D)."""
+    return torch.flatten(model.avgpool(model.features(x)), 1)
+
+
+def dataset_fingerprint(ds):
+    samples = getattr(ds, "samples", None)
+    if samples is not None:
+        return [p for p, _ in samples]
+    return [str(getattr(ds, "prefix", "")), len(ds)]
+
+
+def transform_key(tf):
+    """repr of a transform without its profiling wrapper (TimedCall), for the cache metadata."""
+    while isinstance(tf, TimedCall):
+        tf = tf.fn
+    return repr(tf)
+
+
+def build_feature_store(model, make_dataset, transforms_list, prefix, batch_size=32, device="cpu"):
+    """Pooled features for every sample under each transform in transforms_list (one variant each).
+
+    make_dataset(transform) returns the dataset (same sample order for every transform).
+    Reuses the store when samples and transforms match the cached metadata.
+    """
+    prefix = Path(prefix)
+    prefix.parent.mkdir(parents=True, exist_ok=True)
+    meta_path = prefix.with_suffix(".json")
+    first = make_dataset(transforms_list[0])
+    if len(first) == 0:
+        raise ValueError(f"No samples to extract features from (cache {prefix})")
+    meta = {"samples": dataset_fingerprint(first), "transforms": [transform_key(t) for t in transforms_list]}
+
+    if meta_path.exists() and prefix.with_suffix(".npy").exists():
+        if json.loads(meta_path.read_text()) == meta:
+            print(f"Features loaded from {prefix}.npy")
+            return FeatureStore(prefix)
+
+    model.eval()
+    start = time.time()
+    store = None
+    tmp_path = f"{prefix}.npy.tmp"
+    for v, tf in enumerate(transforms_list):
+        ds = first if v == 0 else make_dataset(tf)
+        loader = make_loader(ds, batch_size, shuffle=False, name=f"features[{v}]", log_wait=False)
+        offset = 0
+        with torch.inference_mode():
+            for imgs, _ in tqdm(loader, desc=f"Features {v + 1}/{len(transforms_list)}", leave=False):
+                feats = pooled_features(model, imgs.to(device)).float().cpu().numpy()
+                if store is None:
+                    store = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=np.float16,
+                                                      shape=(len(transforms_list), len(first), feats.shape[1]))
+                store[v, offset:offset + len(feats)] = feats
+                offset += len(feats)
+
+    store.flush()
+    del store
+    os.replace(tmp_path, prefix.with_suffix(".npy"))
+    np.save(f"{prefix}_labels.npy", np.asarray(first.targets, dtype=np.int64))
+    meta_path.write_text(json.dumps(meta))
+    print(f"Features for {len(first)} images x {len(transforms_list)} variants computed in "
+          f"{time.time() - start:.0f}s -> {prefix}.npy")
+    return FeatureStore(prefix)
+
+
+class FeatureStore:
+    """(variants, N, D) float16 features + labels, memory-mapped read-only."""
+
+    def __init__(self, prefix):
+        self.prefix = Path(prefix)
+        self.features = np.load(self.prefix.with_suffix(".npy"), mmap_mode="r")
+        self.labels = torch.from_numpy(np.load(f"{self.prefix}_labels.npy"))
+
+    def __len__(self):
+        return self.features.shape[1]
+
+    @property
+    def dim(self):
+        return self.features.shape[2]
+
+    def batches(self, batch_size, shuffle=False, variant=0, device="cpu"):
+        """(float32 features, labels) batches; variant=None draws a random variant per sample."""
+        n, variants = len(self), self.features.shape[0]
+        order = torch.randperm(n) if shuffle else torch.arange(n)
+        for i in range(0, n, batch_size):
+            idx = order[i:i + batch_size]
+            var = torch.randint(0, variants, (len(idx),)) if variant is None else torch.full((len(idx),), variant)
+            feats = torch.from_numpy(self.features[var.numpy(), idx.numpy()].astype(np.float32))
+            yield feats.to(device), self.labels[idx].to(device)
+
+
+def train_head(head, train_store, val_store, criterion, epochs=30, lr=1e-3, weight_decay=1e-4,
+               batch_size=256, device="cpu", verbose=True):
+    """Fit the classifier head on cached features; keeps (and loads back) the best validation state."""
+    head.to(device)
+    optimizer = torch.optim.AdamW(head.parameters(), lr=lr, weight_decay=weight_decay)
+    scheduler = torch.optim.lr_scheduler.CosineAnnealingLR(optimizer, T_max=epochs)
+    best_acc, best_state = 0.0, None
+    start = time.time()
+
+    for epoch in range(1, epochs + 1):
+        head.train()
+        for feats, labels in train_store.batches(batch_size, shuffle=True, variant=None, device=device):
+            optimizer.zero_grad(set_to_none=True)
+            loss = criterion(head(feats), labels)
+            loss.backward()
+            optimizer.step()
+        scheduler.step()
+
+        head.eval()
+        correct = 0
+        with torch.inference_mode():
+            for feats, labels in val_store.batches(1024, device=device):
+                correct += (head(feats).argmax(1) == labels).sum().item()
+        acc = correct / len(val_store)
+        if acc > best_acc:
+            best_acc = acc
+            best_state = {k: v.detach().clone() for k, v in head.state_dict().items()}
+        if verbose:
+            print(f"Head epoch {epoch:02d}/{epochs} | Val acc={acc:.4f}")
+
+    if best_state is not None:
+        head.load_state_dict(best_state)
+    if verbose:
+        print(f"Head trained in {time.time() - start:.1f}s | best val acc {best_acc:.4f}")
+    return best_acc
+
+
+def freeze_backbone(model, trainable_stages=0):
+    """Freeze model.features except its last `trainable_stages` blocks; returns the frozen modules.
+
+    Frozen modules should be kept in eval() mode during training so their BatchNorm statistics
+    stay those of the pretrained backbone.
+    """
+    stages = list(model.features.children())
+    frozen = stages[:len(stages) - trainable_stages] if trainable_stages > 0 else stages
+    for m in frozen:
+        m.requires_grad_(False)
+    return frozen
@@ -0,0 +1,121 @@
+# Inference result cache for marker.py / serving: key = hash of the decoded pixels + fingerprint of
+# the checkpoints (and model variant), value = top-k class indices and probabilities.
+# In-memory LRU with an optional SQLite tier; entries from other checkpoints are never returned.
+import hashlib
+import json
+import os
+import sqlite3
+from collections import OrderedDict
+
+CHECKPOINTS = ("convnext_base_custom.pt", "efficientnet_b3.pt", "student_distilled.pt")
+
+
+def pixel_digest(img):
+    """SHA-1 of a decoded PIL image (mode, size and raw pixels), independent of the file encoding."""
+    h = hashlib.sha1(f"{img.mode}:{img.size}".encode())
+    h.update(img.tobytes())
+    return h.hexdigest()
+
+
+def tensor_digest(t):
+    """SHA-1 of a preprocessed tensor (dtype, shape and raw values), for the tensor preprocessing path."""
+    h = hashlib.sha1(f"{t.dtype}:{tuple(t.shape)}".encode())
+    h.update(t.contiguous().numpy().tobytes())
+    return h.hexdigest()
+
+
+def checkpoint_fingerprint(paths=CHECKPOINTS, tag=""):
+    """Cheap fingerprint from size + mtime of each checkpoint; any rewrite of a .pt changes it."""
+    h = hashlib.sha1(tag.encode())
+    for p in paths:
+        if os.path.exists(p):
+            st = os.stat(p)
+            h.update(f"{p}:{st.st_size}:{st.st_mtime_ns}".encode())
+    return h.hexdigest()[:16]
+
+
+class InferenceCache:
+    """Bounded LRU of {pixel digest: (top-k indices, top-k probs)} for one model fingerprint."""
+
+    def __init__(self, capacity=4096, db_path=None, tag=""):
+        self.capacity = capacity
+        self.tag = tag
+        self.lru = OrderedDict()
+        self.hits = self.disk_hits = self.misses = self.evictions = self.invalidations = 0
+        self.db = None
+        if db_path:
+            self.db = sqlite3.connect(db_path, check_same_thread=False)
+            self.db.execute("CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, fingerprint TEXT, value TEXT)")
+        self.fingerprint = None
+        self.refresh()
+
+    def refresh(self):
+        """Drop everything cached for older checkpoints (called before each lookup batch)."""
+        fp = checkpoint_fingerprint(tag=self.tag)
+        if fp == self.fingerprint:
+            return
+        if self.fingerprint is not None:
+            self.invalidations += 1
+        self.fingerprint = fp
+        self.lru.clear()
+        if self.db is not None:
+            self.db.execute("DELETE FROM cache WHERE fingerprint != ?", (fp,))
+            self.db.commit()
+
+    def get(self, digest):
+        if digest in self.lru:
+            self.lru.move_to_end(digest)
+            self.hits += 1
+            return self.lru[digest]
+        if self.db is not None:
+            row = self.db.execute("SELECT value FROM cache WHERE key = ? AND fingerprint = ?",
+                                  (digest, self.fingerprint)).fetchone()
+            if row is not None:
+                value = tuple(json.loads(row[0]))
+                self._remember(digest, value)
+                self.disk_hits += 1
+                return value
+        self.misses += 1
+        return None
+
+    def put(self, digest, value):
+        self._remember(digest, value)
+        if self.db is not None:
+            self.db.execute("INSERT OR REPLACE INTO cache VALUES (?, ?, ?)",
+                            (digest, self.fingerprint, json.dumps(value)))
+
+    def _remember(self, digest, value):
+        self.lru[digest] = value
+        self.lru.move_to_end(digest)
+        while len(self.lru) > self.capacity:
+            self.lru.popitem(last=False)
+            self.evictions += 1
+
+    def commit(self):
+        if self.db is not None:
+            self.db.commit()
+
+    def stats(self):
+        lookups = self.hits + self.disk_hits + self.misses
+        return {
+            "size": len(self.lru),
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+            "hit_rate": (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+        }
+
+    def predict_batch(self, predict_batch, model, x, digests, preprocess, torch, k=1):
+        """Run predict_batch only for cache misses; returns one (indices, probs) per input row."""
+        self.refresh()
+        results = [self.get(d) for d in digests]
+        todo = [i for i, r in enumerate(results) if r is None]
+        if todo:
+            top_idx, top_probs = predict_batch(model, x[todo], preprocess, torch, k=k)
+            for i, idx, prob in zip(todo, top_idx.tolist(), top_probs.tolist()):
+                results[i] = (idx, prob)
+                self.put(digests[i], results[i])
+            self.commit()
+        return results
@@ -0,0 +1,67 @@
+# Shared DataLoader factory for efficientnet_b3.py and train_convnext.py:
+# worker processes, pinned memory, prefetching, persistent workers and data-wait logging.
+import os
+import time
+import torch
+from torch.utils.data import DataLoader
+
+
+def default_num_workers(processes=1):
+    """Leave one core to the training loop, cap at 8 (more rarely helps for JPEG decode).
+
+    processes: training processes sharing the machine (DDP), each gets its share of the cores.
+    """
+    return max(0, min(8, (os.cpu_count() or 1) // processes - 1))
+
+
+class TimedLoader:
+    """Iterates a DataLoader and logs which fraction of each epoch was spent waiting for batches."""
+
+    def __init__(self, loader, name):
+        self.loader = loader
+        self.name = name
+        self.dataset = loader.dataset
+        self.wait_s = 0.0
+        self.total_s = 0.0
+
+    def __len__(self):
+        return len(self.loader)
+
+    def __iter__(self):
+        self.wait_s = 0.0
+        epoch_start = time.perf_counter()
+        batches = iter(self.loader)
+        while True:
+            t0 = time.perf_counter()
+            try:
+                batch = next(batches)
+            except StopIteration:
+                break
+            self.wait_s += time.perf_counter() - t0
+            yield batch
+        self.total_s = time.perf_counter() - epoch_start
+        if self.total_s > 0:
+            print(f"[{self.name}] waiting on data: {self.wait_s / self.total_s:.1%} "
+                  f"({self.wait_s:.1f}s of {self.total_s:.1f}s)", flush=True)
+
+
+def make_loader(dataset, batch_size, shuffle, name="loader", num_workers=None, pin_memory=None,
+                prefetch_factor=4, persistent_workers=True, log_wait=True, sampler=None):
+    """DataLoader with throughput-friendly defaults.
+
+    num_workers=None picks default_num_workers(); pin_memory=None pins only when CUDA is used.
+    prefetch_factor and persistent_workers only apply when there are worker processes.
+    """
+    if num_workers is None:
+        num_workers = default_num_workers()
+    if pin_memory is None:
+        pin_memory = torch.cuda.is_available()
+
+    kwargs = {}
+    if num_workers > 0:
+        kwargs["prefetch_factor"] = prefetch_factor
+        kwargs["persistent_workers"] = persistent_workers
+
+    loader = DataLoader(dataset, batch_size=batch_size, shuffle=shuffle and sampler is None,
+                        sampler=sampler, num_workers=num_workers, pin_memory=pin_memory, **kwargs)
+    return TimedLoader(loader, name) if log_wait else loader
@@ -0,0 +1,41 @@
+# ImageFolder-compatible dataset reading Split/split_manifest.csv (written by Split.py)
+# instead of walking Split/Training and Split/Validation.
+import csv
+from torchvision.datasets.folder import VisionDataset, default_loader
+
+
+class ManifestImageFolder(VisionDataset):
+    """Images listed in the split manifest for one split (or one k-fold side).
+
+    split is "Training" or "Validation". When val_fold is given, the fold column is used
+    instead: Validation = rows with that fold, Training = every other fold.
+    """
+
+    def __init__(self, manifest_csv, split, val_fold=None, transform=None, loader=default_loader):
+        super().__init__(str(manifest_csv), transform=transform)
+        with open(manifest_csv, newline="", encoding="utf-8") as f:
+            rows = list(csv.DictReader(f))
+
+        # Class ids follow the same sorted order ImageFolder uses, over all rows
+        self.classes = sorted({r["class"] for r in rows})
+        self.class_to_idx = {c: i for i, c in enumerate(self.classes)}
+
+        if val_fold is None:
+            keep = [r for r in rows if r["split"] == split]
+        else:
+            in_val = split == "Validation"
+            keep = [r for r in rows if (int(r["fold"]) == val_fold) == in_val]
+
+        self.samples = [(r["path"], self.class_to_idx[r["class"]]) for r in keep]
+        self.targets = [t for _, t in self.samples]
+        self.loader = loader
+
+    def __len__(self):
+        return len(self.samples)
+
+    def __getitem__(self, i):
+        path, target = self.samples[i]
+        img = self.loader(path)
+        if self.transform is not None:
+            img = self.transform(img)
+        return img, target
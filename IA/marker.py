@@ -1,15 +1,47 @@
-import importlib.util, sys, re, time
+import importlib.util, sys, re, time, os
 from pathlib import Path
 from PIL import Image
 import torch
 import torch.nn as nn
+from torch.utils.data import Dataset, DataLoader
 from torchvision import models, transforms
+from infer_cache import InferenceCache, pixel_digest, tensor_digest
+from tensor_preprocess import TensorPreprocess, compare_with_compose
+from profiling import StageTimer
+from dataset_index import indexed_files
+from Split import use_face_crops
 
 # ---- config ----
 student_file = Path("student_infer.py")
 test_dir = Path("C:\\Users\\thiba\\OneDrive\\Bureau\\AI_Project\\Split\\Test\\Test")
+batch_size = 16                                   # images per forward pass (1 = original per-image loop)
+num_workers = max(0, (os.cpu_count() or 1) - 1)   # decode/preprocess worker processes
+backend = "eager"                                 # "eager", "torchscript" or "onnxruntime" (see export_models.py)
+use_student = False                               # distilled single model (distill_student.py) instead of the ensemble
+lazy_load = False                                 # build ensemble members on their first forward pass
+quantize = None                                   # None (fp32), "dynamic" or "static" INT8
+calib_dir = Path("C:\\Users\\thiba\\OneDrive\\Bureau\\AI_Project\\Split\\Validation")
+calib_images = 64                                 # validation images used for static calibration
+cache_size = 0                                    # in-memory result cache entries (0 = no cache)
+cache_db = None                                   # e.g. "inference_cache.sqlite" for a persistent tier
+preprocess_mode = "compose"                       # "compose" (PIL transforms) or "tensor" (uint8 tensors, batch normalize)
+jpeg_draft = True                                 # tensor mode: decode JPEGs at reduced size (DCT scaling)
+jpeg_decoder = "pil"                              # tensor mode: "pil" or "torchvision" (torchvision.io)
+face_crop = use_face_crops                        # classify the aligned face crop (face_crop.py); follows Split.py so the
+                                                  # models see the same kind of input they were trained on: the
+                                                  # student_infer predict functions only get what is passed here
+profile = False                                   # per-stage time table + trace_marker.json (Chrome trace)
+use_index = True                                  # list test_dir from the dataset index (dataset_index.py)
 # ----------------
 
+if quantize == "static":
+    import torch.ao.quantization.quantize_fx  # exposes torch.ao.quantization.quantize_fx to the student file
+ort = None
+if backend == "onnxruntime":
+    import onnxruntime as ort
+if face_crop:
+    from face_crop import cached_crop
+
 # --- controlled import (no imports inside student file) ---
 spec = importlib.util.spec_from_file_location("student_infer", student_file)
 student_mod = importlib.util.module_from_spec(spec)
@@ -29,43 +61,245 @@ preprocess = transforms.Compose([
                          [0.229, 0.224, 0.225]),
 ])
 
-# --- load model using student's function ---
-model, classes = student_mod.build_model(torch, nn, models, None)
-model.eval()
+timer = StageTimer(enabled=profile)
+
+# --- tensor preprocessing (same inputs up to resampling, see compare_with_compose) ---
+tensor_preprocess = TensorPreprocess(draft=jpeg_draft, decoder=jpeg_decoder)
+infer_preprocess = tensor_preprocess if preprocess_mode == "tensor" else preprocess
 
-# --- evaluation loop ---
 pat = re.compile(r"^(\d+)-\d+\.jpe?g$", re.IGNORECASE)
-files = sorted(p for p in test_dir.iterdir()
-               if p.is_file() and p.suffix.lower() in (".jpg", ".jpeg")
-               and not p.name.startswith(("._", ".")))
-
-total = correct = skipped = 0
-sum_infer_s = 0.0
-for p in files:
-    m = pat.match(p.name)
-    if not m:
-        skipped += 1
-        continue
-    true_label = m.group(1)
-    try:
-        img = Image.open(p).convert("RGB")
-        t0 = time.perf_counter()
-        idx = student_mod.predict(model, img, preprocess, torch)
-        dt = time.perf_counter() - t0
-        pred_label = str(classes[idx])
-    except Exception as e:
-        skipped += 1
-        print(f"{p.name:20s} true={true_label:>4s} pred=ERR acc={correct/(total or 1):.4f} [{e}]")
-        continue
-
-    total += 1
-    correct += int(pred_label == true_label)
-    sum_infer_s += dt
-    print(f"{p.name:20s} true={true_label:>4s} pred={pred_label:>4s} acc={correct/total:.4f}  [{dt:.3f}s]")
-
-final_acc = correct/total if total else 0.0
-print(f"\nEvaluated: {total} Correct: {correct} Skipped: {skipped} Final accuracy: {final_acc:.4f}")
-if total > 0:
-    avg_s = sum_infer_s / total
-    ips = total / sum_infer_s if sum_infer_s > 0 else 0.0
-    print(f"Average per-image time: {avg_s:.3f}s | Throughput: {ips:.2f} img/s")
\ No newline at end of file
+
+
+# --- decode + preprocess in worker processes ---
+class TestImages(Dataset):
+
+    def __init__(self, files, digests=False):
+        self.files = files
+        self.digests = digests   # also return the decoded-pixel hash (result cache key)
+
+    def __len__(self):
+        return len(self.files)
+
+    def __getitem__(self, i):
+        # Errors are returned instead of raised so one bad file does not kill the batch
+        try:
+            src = source_image(self.files[i])
+            if preprocess_mode == "tensor":
+                # uint8 224x224, normalized per batch in predict_batch
+                x = tensor_preprocess.load(src)
+                item = (x, i, "")
+                digest = tensor_digest(x) if self.digests else ""
+            else:
+                img = Image.open(src).convert("RGB")
+                item = (preprocess(img), i, "")
+                digest = pixel_digest(img) if self.digests else ""
+        except Exception as e:
+            dtype = torch.uint8 if preprocess_mode == "tensor" else torch.float32
+            item = (torch.zeros(3, 224, 224, dtype=dtype), i, str(e))
+            digest = ""
+        return item + (digest,) if self.digests else item
+
+
+# Image actually classified for a test file: the photo itself or its cached face crop
+def source_image(path):
+    return cached_crop(str(path))[0] if face_crop else path
+
+
+def percentile(values, q):
+    # Nearest-rank percentile on an already sorted list
+    if not values:
+        return 0.0
+    k = min(len(values) - 1, max(0, int(round(q / 100 * len(values))) - 1))
+    return values[k]
+
+
+# Evenly spaced sample of Split/Validation, consumed lazily by build_model on a cache miss
+def calibration_batches():
+    files = sorted(p for p in calib_dir.rglob("*")
+                   if p.suffix.lower() in (".jpg", ".jpeg") and not p.name.startswith("."))
+    sample = files[::max(1, len(files) // calib_images)][:calib_images]
+    loader = DataLoader(TestImages(sample), batch_size=max(1, batch_size),
+                        shuffle=False, num_workers=num_workers)
+    for x, _, errors in loader:
+        ok = [j for j, e in enumerate(errors) if not e]
+        if ok:
+            yield tensor_preprocess.normalize(x[ok]) if x.dtype == torch.uint8 else x[ok]
+
+
+def list_test_files():
+    if use_index:
+        # Index skips hidden files; only files directly in test_dir, like iterdir()
+        root = os.path.abspath(test_dir)
+        return sorted(Path(p) for p, _ in indexed_files(test_dir, (".jpg", ".jpeg")) if os.path.dirname(p) == root)
+    return sorted(p for p in test_dir.iterdir()
+                  if p.is_file() and p.suffix.lower() in (".jpg", ".jpeg")
+                  and not p.name.startswith(("._", ".")))
+
+
+# --- original evaluation loop (one image at a time) ---
+def evaluate_sequential(model, classes, files, verbose=True, cache=None):
+    total = correct = skipped = 0
+    sum_infer_s = 0.0
+    for p in files:
+        m = pat.match(p.name)
+        if not m:
+            skipped += 1
+            continue
+        true_label = m.group(1)
+        try:
+            with timer.stage("decode"):
+                src = source_image(p)
+                img = tensor_preprocess.open(src) if preprocess_mode == "tensor" else Image.open(src).convert("RGB")
+            t0 = time.perf_counter()
+            with timer.stage("inference"):
+                if cache is None:
+                    idx = student_mod.predict(model, img, infer_preprocess, torch)
+                else:
+                    if preprocess_mode == "tensor":
+                        # Same uint8 tensor and cache key as the batched path (normalized in predict_batch)
+                        x = tensor_preprocess.from_pil(img)
+                        digest = tensor_digest(x)
+                    else:
+                        x, digest = infer_preprocess(img), pixel_digest(img)
+                    (top, _), = cache.predict_batch(student_mod.predict_batch, model, x.unsqueeze(0),
+                                                    [digest], infer_preprocess, torch)
+                    idx = top[0]
+            dt = time.perf_counter() - t0
+            pred_label = str(classes[idx])
+        except Exception as e:
+            skipped += 1
+            if verbose:
+                print(f"{p.name:20s} true={true_label:>4s} pred=ERR acc={correct/(total or 1):.4f} [{e}]")
+            continue
+
+        total += 1
+        correct += int(pred_label == true_label)
+        sum_infer_s += dt
+        if verbose:
+            print(f"{p.name:20s} true={true_label:>4s} pred={pred_label:>4s} acc={correct/total:.4f}  [{dt:.3f}s]")
+
+    return total, correct, skipped, sum_infer_s, []
+
+
+# --- batched evaluation loop (worker pool decodes, one forward pass per batch) ---
+def evaluate_batched(model, classes, files, verbose=True, cache=None):
+    total = correct = skipped = 0
+    sum_infer_s = 0.0
+    batch_times = []
+
+    # Files without a parsable label are skipped before decoding
+    labelled = []
+    for p in files:
+        m = pat.match(p.name)
+        if m:
+            labelled.append((p, m.group(1)))
+        else:
+            skipped += 1
+
+    # Pixel hashes are only computed (in the workers) when the result cache is on
+    loader = DataLoader(TestImages([p for p, _ in labelled], digests=cache is not None),
+                        batch_size=batch_size, shuffle=False, num_workers=num_workers)
+
+    # "data" = time spent waiting for the workers (decode + preprocess not overlapped with inference)
+    for batch in timer.timed_iter(loader) if profile else loader:
+        x, idxs, errors = batch[:3]
+        ok = [j for j, e in enumerate(errors) if not e]
+
+        dt = 0.0
+        preds = []
+        if ok:
+            t0 = time.perf_counter()
+            xb = x[ok] if len(ok) < len(errors) else x
+            with timer.stage("inference"):
+                if cache is None:
+                    top_idx, _ = student_mod.predict_batch(model, xb, infer_preprocess, torch)
+                    preds = top_idx[:, 0].tolist()
+                else:
+                    results = cache.predict_batch(student_mod.predict_batch, model, xb,
+                                                  [batch[3][j] for j in ok], infer_preprocess, torch)
+                    preds = [top[0] for top, _ in results]
+            dt = time.perf_counter() - t0
+            batch_times.append(dt)
+
+        per_img = dt / len(ok) if ok else 0.0
+        pred_iter = iter(preds)
+        for j, i in enumerate(idxs.tolist()):
+            p, true_label = labelled[i]
+            if errors[j]:
+                skipped += 1
+                if verbose:
+                    print(f"{p.name:20s} true={true_label:>4s} pred=ERR acc={correct/(total or 1):.4f} [{errors[j]}]")
+                continue
+            pred_label = str(classes[next(pred_iter)])
+            total += 1
+            correct += int(pred_label == true_label)
+            if verbose:
+                print(f"{p.name:20s} true={true_label:>4s} pred={pred_label:>4s} acc={correct/total:.4f}  [{per_img:.3f}s]")
+        sum_infer_s += dt
+
+    return total, correct, skipped, sum_infer_s, batch_times
+
+
+def evaluate(model, classes, files, verbose=True, cache=None):
+    if batch_size <= 1 and num_workers == 0:
+        return evaluate_sequential(model, classes, files, verbose, cache)
+    return evaluate_batched(model, classes, files, verbose, cache)
+
+
+def main():
+    # --- load model using student's function ---
+    t0 = time.perf_counter()
+    model, classes = student_mod.build_model(torch, nn, models, None, quantize=quantize,
+                                             calib_batches=calibration_batches() if quantize else None,
+                                             backend=backend, ort=ort, student=use_student,
+                                             lazy=lazy_load, clock=time.perf_counter)
+    model.eval()
+    phases = " | ".join(f"{k} {v:.2f}s" for k, v in student_mod.startup_times.items() if k != "total")
+    print(f"Model ready ({backend}) in {time.perf_counter() - t0:.2f}s" + (f" [{phases}]" if phases else ""))
+
+    # --- evaluation loop ---
+    files = list_test_files()
+    if preprocess_mode == "tensor":
+        compare_with_compose(files[:64], preprocess, tensor_preprocess)
+
+    # Cache entries are tied to the checkpoints and to the model variant being evaluated
+    cache = None
+    if cache_size > 0:
+        cache = InferenceCache(cache_size, cache_db, tag=f"{backend}:{quantize}:{use_student}:{preprocess_mode}:{face_crop}")
+
+    wall0 = time.perf_counter()
+    total, correct, skipped, sum_infer_s, batch_times = evaluate(model, classes, files, cache=cache)
+    wall_s = time.perf_counter() - wall0
+
+    final_acc = correct/total if total else 0.0
+    print(f"\nEvaluated: {total} Correct: {correct} Skipped: {skipped} Final accuracy: {final_acc:.4f}")
+    if total > 0:
+        avg_s = sum_infer_s / total
+        ips = total / sum_infer_s if sum_infer_s > 0 else 0.0
+        print(f"Average per-image time: {avg_s:.3f}s | Throughput: {ips:.2f} img/s")
+        print(f"End-to-end (decode + inference): {wall_s:.2f}s | {total / wall_s:.2f} img/s")
+    if batch_times:
+        bt = sorted(batch_times)
+        print(f"Batch latency (batch_size={batch_size}, workers={num_workers}, n={len(bt)}): "
+              f"p50={percentile(bt, 50):.3f}s p90={percentile(bt, 90):.3f}s "
+              f"p99={percentile(bt, 99):.3f}s max={bt[-1]:.3f}s")
+    if cache is not None:
+        st = cache.stats()
+        print(f"Result cache: hit rate {st['hit_rate']:.1%} (memory {st['hits']}, disk {st['disk_hits']}, "
+              f"miss {st['misses']}) | evictions {st['evictions']} | entries {st['size']}")
+    timer.report("Evaluation")
+    timer.write_chrome_trace("trace_marker.json")
+
+    # --- quantized vs fp32: measured accuracy cost and speedup ---
+    if quantize and total > 0:
+        ref_model, ref_classes = student_mod.build_model(torch, nn, models, None)
+        ref_total, ref_correct, _, ref_infer_s, _ = evaluate(ref_model.eval(), ref_classes, files, verbose=False)
+        ref_acc = ref_correct / ref_total if ref_total else 0.0
+        speedup = ref_infer_s / sum_infer_s if sum_infer_s > 0 else 0.0
+        print(f"INT8 ({quantize}) vs fp32: accuracy {final_acc:.4f} vs {ref_acc:.4f} "
+              f"(delta {final_acc - ref_acc:+.4f}) | inference speedup x{speedup:.2f}")
+
+
+# Guard needed: DataLoader workers re-import this file on Windows (spawn)
+if __name__ == "__main__":
+    main()
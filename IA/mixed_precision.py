@@ -0,0 +1,108 @@
+# Opt-in fast training mode shared by efficientnet_b3.py and train_convnext.py:
+# autocast (bf16 on CPU, fp16/bf16 on GPU), grad scaling for fp16 and channels_last inputs.
+import copy
+import time
+import torch
+from profiling import stage
+
+
+def amp_dtype_for(device):
+    """Autocast dtype for a device: bf16 on CPU and recent GPUs, fp16 on older GPUs."""
+    device = torch.device(device)
+    if device.type == "cuda" and not torch.cuda.is_bf16_supported():
+        return torch.float16
+    return torch.bfloat16
+
+
+def make_scaler(device, amp_dtype):
+    """Grad scaler, only active for fp16 on CUDA (bf16 has the fp32 exponent range)."""
+    enabled = torch.device(device).type == "cuda" and amp_dtype == torch.float16
+    return torch.cuda.amp.GradScaler(enabled=enabled)
+
+
+def autocast(device, amp_dtype):
+    """Autocast context; amp_dtype=None gives plain fp32."""
+    return torch.autocast(device_type=torch.device(device).type, dtype=amp_dtype,
+                          enabled=amp_dtype is not None)
+
+
+def to_device(imgs, labels, device, channels_last=False):
+    """Move a batch to the device, optionally in NHWC (channels_last) layout."""
+    imgs = imgs.to(device, non_blocking=True)
+    if channels_last:
+        imgs = imgs.contiguous(memory_format=torch.channels_last)
+    return imgs, labels.to(device, non_blocking=True)
+
+
+def train_step(model, imgs, labels, criterion, optimizer, scaler=None, amp_dtype=None, timer=None):
+    """One optimisation step; returns (logits, loss) without reading them back to the host.
+
+    With a profiling.StageTimer, forward / backward / optimizer are timed as separate stages.
+    """
+    scaling = scaler is not None and scaler.is_enabled()
+    optimizer.zero_grad(set_to_none=True)
+    with stage(timer, "forward"), autocast(imgs.device, amp_dtype):
+        logits = model(imgs)
+        loss = criterion(logits, labels)
+    with stage(timer, "backward"):
+        (scaler.scale(loss) if scaling else loss).backward()
+    with stage(timer, "optimizer"):
+        if scaling:
+            scaler.step(optimizer)
+            scaler.update()
+        else:
+            optimizer.step()
+    return logits, loss
+
+
+def _sync(device):
+    if torch.device(device).type == "cuda":
+        torch.cuda.synchronize()
+
+
+def compare_train_speed(model, loader, criterion, optimizer, device, steps=10, augment=None):
+    """Time `steps` training steps with the default fp32/NCHW loop and with the fast mode.
+
+    The first step of each mode is a warm-up and is not counted. Model and optimizer
+    state are restored afterwards, so this can run right before the real training.
+    augment: batch augmentation applied to uint8 loader batches on the device (batch_augment.py).
+    """
+    model_state = copy.deepcopy(model.state_dict())
+    opt_state = copy.deepcopy(optimizer.state_dict())
+    results = {}
+
+    for fast in (False, True):
+        amp_dtype = amp_dtype_for(device) if fast else None
+        scaler = make_scaler(device, amp_dtype) if fast else None
+        model.to(memory_format=torch.channels_last if fast else torch.contiguous_format)
+        model.train()
+
+        seen, elapsed = 0, 0.0
+        batches = iter(loader)
+        for step in range(steps + 1):
+            try:
+                imgs, labels = next(batches)
+            except StopIteration:
+                break
+            imgs, labels = to_device(imgs, labels, device, channels_last=fast and augment is None)
+            if augment is not None:
+                imgs = augment(imgs)
+                if fast:
+                    imgs = imgs.contiguous(memory_format=torch.channels_last)
+            _sync(device)
+            t0 = time.perf_counter()
+            train_step(model, imgs, labels, criterion, optimizer, scaler, amp_dtype)
+            _sync(device)
+            if step > 0:
+                elapsed += time.perf_counter() - t0
+                seen += labels.size(0)
+        results["fast" if fast else "fp32"] = seen / elapsed if elapsed > 0 else 0.0
+
+    model.load_state_dict(model_state)
+    optimizer.load_state_dict(opt_state)
+    model.to(memory_format=torch.contiguous_format)
+
+    ratio = results["fast"] / results["fp32"] if results["fp32"] > 0 else 0.0
+    print(f"Train speed: fp32/NCHW {results['fp32']:.1f} img/s | "
+          f"{amp_dtype_for(device)}/channels_last {results['fast']:.1f} img/s | x{ratio:.2f}", flush=True)
+    return results
@@ -0,0 +1,124 @@
+# Pre-decoded, memory-mapped image cache for the trainers.
+# Run once to pack Split/Training and Split/Validation, then point the trainers at pack_dir.
+import hashlib
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+import numpy as np
+import torch
+from PIL import Image
+from torch.utils.data import Dataset
+from tqdm import tqdm
+
+from dataset_index import DatasetIndex, IndexImageFolder
+
+# ---- config ----
+train_dir = "C:\\Users\\thiba\\OneDrive\\Bureau\\AI_Project\\Split\\Training"
+val_dir = "C:\\Users\\thiba\\OneDrive\\Bureau\\AI_Project\\Split\\Validation"
+pack_dir = Path("C:\\Users\\thiba\\OneDrive\\Bureau\\AI_Project\\Packed")
+
+JPEG = (".jpg", ".jpeg")                # efficientnet_b3.py's filter
+JPEG_PNG = (".jpg", ".jpeg", ".png")    # train_convnext.py also reads PNGs
+
+# (source folder, packed name, side length, extensions) - sizes match the trainers' first Resize
+packs = [
+    (train_dir, "Training_256", 256, JPEG),         # efficientnet_b3.py: Resize(256) then RandomResizedCrop(224)
+    (train_dir, "Training_224", 224, JPEG_PNG),     # train_convnext.py: Resize(224)
+    (val_dir, "Validation_224", 224, JPEG_PNG),     # train_convnext.py validation
+    (val_dir, "Validation_224_jpeg", 224, JPEG),    # efficientnet_b3.py validation (same JPEG-only set as folder mode)
+]
+# ----------------
+
+
+def source_state(src_dir, exts):
+    """Fingerprint of a source folder: relative path, size and mtime of every image (dataset index)."""
+    root = os.path.abspath(src_dir)
+    index = DatasetIndex()
+    try:
+        index.update(src_dir)
+        rows = [r for r in index.rows(src_dir, exts) if os.path.dirname(r["path"]) != root]
+    finally:
+        index.close()
+    h = hashlib.sha1()
+    for r in rows:
+        h.update(f"{os.path.relpath(r['path'], root)}|{r['size']}|{r['mtime']}\n".encode("utf-8"))
+    return h.hexdigest()
+
+
+def _decode_resized(args):
+    path, size = args
+    with Image.open(path) as img:
+        return np.asarray(img.convert("RGB").resize((size, size), Image.BILINEAR), dtype=np.uint8)
+
+
+def pack_image_folder(src_dir, out_dir, name, size, exts=JPEG_PNG, workers=None):
+    """Decode + resize every image once into <name>.npy (N, size, size, 3) with labels and metadata."""
+    folder = IndexImageFolder(src_dir, exts=exts)
+    n = len(folder.samples)
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+
+    data = np.lib.format.open_memmap(out_dir / f"{name}.npy", mode="w+", dtype=np.uint8,
+                                     shape=(n, size, size, 3))
+    labels = np.array([label for _, label in folder.samples], dtype=np.int64)
+
+    # Decoding is the expensive part, so it is spread over a process pool
+    jobs = [(path, size) for path, _ in folder.samples]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for i, arr in enumerate(tqdm(pool.map(_decode_resized, jobs, chunksize=32), total=n, desc=name)):
+            data[i] = arr
+    data.flush()
+    del data
+
+    np.save(out_dir / f"{name}_labels.npy", labels)
+    (out_dir / f"{name}.json").write_text(json.dumps({
+        "classes": folder.classes,
+        "size": size,
+        "count": n,
+        "source": str(src_dir),
+        "extensions": list(exts),
+        "source_state": source_state(src_dir, exts),
+    }, indent=2))
+    return n
+
+
+class PackedImageDataset(Dataset):
+    """Reads uint8 CHW tensors from a packed file; only the random augmentations run per epoch."""
+
+    def __init__(self, prefix, transform=None):
+        self.prefix = Path(prefix)
+        meta = json.loads(self.prefix.with_suffix(".json").read_text())
+        # Source changed since packing (images added, removed or edited): the pack is stale
+        if "source_state" in meta and os.path.isdir(meta["source"]):
+            if source_state(meta["source"], tuple(meta["extensions"])) != meta["source_state"]:
+                raise ValueError(f"{self.prefix.name} is older than {meta['source']}: re-run packed_dataset.py")
+        self.classes = meta["classes"]
+        self.class_to_idx = {c: i for i, c in enumerate(self.classes)}
+        self.targets = np.load(self.prefix.parent / f"{self.prefix.name}_labels.npy").tolist()
+        self.transform = transform
+        self._data = None   # opened lazily so each DataLoader worker maps the file itself
+
+    def __len__(self):
+        return len(self.targets)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_data"] = None
+        return state
+
+    def __getitem__(self, i):
+        if self._data is None:
+            # Copy-on-write map: pages are shared with the OS cache, slices are writable views
+            self._data = np.load(self.prefix.with_suffix(".npy"), mmap_mode="c")
+        img = torch.from_numpy(self._data[i]).permute(2, 0, 1)
+        if self.transform is not None:
+            img = self.transform(img)
+        return img, self.targets[i]
+
+
+if __name__ == "__main__":
+    for src, name, size, exts in packs:
+        count = pack_image_folder(src, pack_dir, name, size, exts)
+        print(f"{name}: {count} images packed at {size}x{size}")
+    print(f"Packed datasets written to: {pack_dir}")
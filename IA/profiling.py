@@ -0,0 +1,147 @@
+# Lightweight per-stage instrumentation shared by efficientnet_b3.py, train_convnext.py and marker.py.
+# Records wall time and call counts per stage (data wait, decode, transforms, forward, backward,
+# optimizer...), prints a breakdown table per epoch and writes a Chrome trace (chrome://tracing,
+# Perfetto). Optionally captures a torch.profiler trace for the first N steps.
+#
+# Decode/transform stages are recorded inside the process that runs them: with DataLoader workers
+# they are only visible as "data" wait time in the training process (use num_workers=0 to split them).
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+import torch
+
+
+class StageTimer:
+
+    def __init__(self, enabled=True, sync_cuda=True):
+        self.enabled = enabled
+        self.sync_cuda = sync_cuda and torch.cuda.is_available()
+        self.totals = {}
+        self.counts = {}
+        self.events = []            # Chrome trace "complete" events
+        self._origin = time.perf_counter()
+
+    def __getstate__(self):
+        # Copies sent to DataLoader workers start empty
+        state = self.__dict__.copy()
+        state.update(totals={}, counts={}, events=[])
+        return state
+
+    def add(self, name, seconds, start=None):
+        if not self.enabled:
+            return
+        self.totals[name] = self.totals.get(name, 0.0) + seconds
+        self.counts[name] = self.counts.get(name, 0) + 1
+        if start is not None:
+            self.events.append({
+                "name": name, "ph": "X", "pid": os.getpid(), "tid": threading.get_ident(),
+                "ts": (start - self._origin) * 1e6, "dur": seconds * 1e6,
+            })
+
+    @contextmanager
+    def _stage(self, name):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            if self.sync_cuda:
+                torch.cuda.synchronize()
+            self.add(name, time.perf_counter() - t0, start=t0)
+
+    def stage(self, name):
+        """Context manager timing one occurrence of a stage (no-op when disabled)."""
+        return self._stage(name) if self.enabled else nullcontext()
+
+    def wrap(self, fn, name):
+        """Callable that times every call of fn (e.g. an image loader or a transforms.Compose)."""
+        return TimedCall(fn, self, name) if self.enabled else fn
+
+    def timed_iter(self, iterable, name="data"):
+        """Yields from iterable, timing each wait for the next item."""
+        it = iter(iterable)
+        while True:
+            t0 = time.perf_counter()
+            try:
+                item = next(it)
+            except StopIteration:
+                return
+            self.add(name, time.perf_counter() - t0, start=t0)
+            yield item
+
+    def report(self, title):
+        if not self.enabled or not self.totals:
+            return
+        total = sum(self.totals.values())
+        print(f"\n{title} - time per stage")
+        print(f"{'stage':22s} {'total s':>9s} {'share':>7s} {'calls':>8s} {'ms/call':>9s}")
+        for name, secs in sorted(self.totals.items(), key=lambda kv: -kv[1]):
+            calls = self.counts[name]
+            print(f"{name:22s} {secs:9.2f} {secs / total:7.1%} {calls:8d} {secs / calls * 1000:9.2f}")
+        print(flush=True)
+
+    def reset(self):
+        """Clear the per-epoch totals (trace events are kept)."""
+        self.totals, self.counts = {}, {}
+
+    def write_chrome_trace(self, path):
+        if not self.enabled:
+            return
+        with open(path, "w") as f:
+            json.dump({"traceEvents": self.events, "displayTimeUnit": "ms"}, f)
+        print(f"Chrome trace written to {path}")
+
+
+class TimedCall:
+    """Picklable timing wrapper (works across DataLoader worker processes)."""
+
+    def __init__(self, fn, timer, name):
+        self.fn, self.timer, self.name = fn, timer, name
+
+    def __call__(self, *args, **kwargs):
+        t0 = time.perf_counter()
+        out = self.fn(*args, **kwargs)
+        self.timer.add(self.name, time.perf_counter() - t0, start=t0)
+        return out
+
+
+def stage(timer, name):
+    """timer.stage(name), or a no-op when no timer is given."""
+    return timer.stage(name) if timer is not None else nullcontext()
+
+
+class TorchProfile:
+    """torch.profiler capture of the first `steps` training steps (steps=0 disables it).
+
+    Call .step() after every training step; the trace is exported and the profiler stopped
+    automatically once the steps are recorded.
+    """
+
+    def __init__(self, steps, trace_path):
+        self.prof = None
+        self.remaining = 0
+        self.trace_path = trace_path
+        if steps <= 0:
+            return
+        activities = [torch.profiler.ProfilerActivity.CPU]
+        if torch.cuda.is_available():
+            activities.append(torch.profiler.ProfilerActivity.CUDA)
+        self.prof = torch.profiler.profile(
+            activities=activities,
+            schedule=torch.profiler.schedule(wait=1, warmup=1, active=steps, repeat=1),
+            on_trace_ready=lambda p: p.export_chrome_trace(trace_path),
+            record_shapes=True,
+        )
+        self.prof.start()
+        self.remaining = steps + 2      # wait + warmup + active
+
+    def step(self):
+        if self.prof is None:
+            return
+        self.prof.step()
+        self.remaining -= 1
+        if self.remaining == 0:
+            self.prof.stop()
+            self.prof = None
+            print(f"torch.profiler trace written to {self.trace_path}", flush=True)
@@ -0,0 +1,198 @@
+# Long-running inference server: loads the ensemble once, groups concurrent uploads into
+# micro-batches (max batch size / max wait) and runs them on a worker thread.
+#   POST /predict   body = raw image bytes (JPEG/PNG)  -> {"class", "confidence", "top_k"}
+#   GET  /metrics   queue depth, batch-size histogram, p50/p95/p99 latency
+#   GET  /health
+# Standard library asyncio only (no web framework dependency).
+import asyncio
+import io
+import json
+import time
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image
+import torch
+import torch.nn as nn
+from torchvision import models
+
+from marker import student_mod, preprocess, percentile, face_crop
+
+if face_crop:
+    from face_crop import cached_crop_bytes
+
+# ---- config ----
+host = "127.0.0.1"       # local only; "0.0.0.0" to accept requests from other machines
+port = 8080
+max_batch_size = 16      # flush a batch as soon as it has this many images
+max_wait_ms = 10         # ... or when the oldest request has waited this long
+top_k = 3
+decode_workers = 4       # threads decoding/preprocessing uploads
+max_body_bytes = 20 * 1024 * 1024
+# ----------------
+
+
+class MicroBatcher:
+    """Collects preprocessed tensors from concurrent requests and runs one forward pass per batch."""
+
+    def __init__(self, model, classes):
+        self.model = model
+        self.classes = classes
+        self.queue = asyncio.Queue()
+        self.infer_pool = ThreadPoolExecutor(max_workers=1)     # one inference at a time, intra-op threads do the rest
+        self.batch_sizes = Counter()
+        self.latencies = deque(maxlen=10000)                    # end-to-end seconds, most recent requests
+        self.served = self.errors = 0
+
+    async def submit(self, x):
+        fut = asyncio.get_running_loop().create_future()
+        await self.queue.put((x, fut))
+        return await fut
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            items = [await self.queue.get()]
+            deadline = loop.time() + max_wait_ms / 1000
+            while len(items) < max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    items.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            self.batch_sizes[len(items)] += 1
+            x = torch.stack([t for t, _ in items])
+            try:
+                top_idx, top_probs = await loop.run_in_executor(self.infer_pool, self._infer, x)
+            except Exception as e:
+                for _, fut in items:
+                    if not fut.done():
+                        fut.set_exception(e)
+                continue
+            for (_, fut), idx, prob in zip(items, top_idx, top_probs):
+                if not fut.done():
+                    fut.set_result([(self.classes[i], p) for i, p in zip(idx, prob)])
+
+    def _infer(self, x):
+        top_idx, top_probs = student_mod.predict_batch(self.model, x, preprocess, torch, k=top_k)
+        return top_idx.tolist(), top_probs.tolist()
+
+    def metrics(self):
+        lat = sorted(self.latencies)
+        return {
+            "queue_depth": self.queue.qsize(),
+            "served": self.served,
+            "errors": self.errors,
+            "batch_size_histogram": dict(sorted(self.batch_sizes.items())),
+            "latency_ms": {f"p{q}": round(percentile(lat, q) * 1000, 2) for q in (50, 95, 99)},
+        }
+
+
+def decode(body):
+    # Same input as marker.py: the aligned face crop when the models were trained on crops
+    src = cached_crop_bytes(body)[0] if face_crop else io.BytesIO(body)
+    img = Image.open(src).convert("RGB")
+    return preprocess(img)
+
+
+class BodyTooLarge(ValueError):
+    pass
+
+
+async def read_request(reader):
+    request_line = await reader.readline()
+    if not request_line:
+        return None
+    method, path, _ = request_line.decode("latin-1").split(" ", 2)
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        key, _, value = line.decode("latin-1").partition(":")
+        headers[key.strip().lower()] = value.strip()
+    length = int(headers.get("content-length", 0))
+    if length > max_body_bytes:
+        raise BodyTooLarge(f"body larger than {max_body_bytes} bytes")
+    body = await reader.readexactly(length) if length else b""
+    return method, path.split("?", 1)[0], headers, body
+
+
+def response(status, payload, keep_alive):
+    body = json.dumps(payload).encode()
+    head = (f"HTTP/1.1 {status}\r\nContent-Type: application/json\r\nContent-Length: {len(body)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n")
+    return head.encode() + body
+
+
+async def handle(reader, writer, batcher, decode_pool):
+    loop = asyncio.get_running_loop()
+    try:
+        while True:
+            try:
+                req = await read_request(reader)
+            except BodyTooLarge as e:
+                writer.write(response("413 Payload Too Large", {"error": str(e)}, False))
+                break
+            except (ValueError, asyncio.IncompleteReadError):
+                writer.write(response("400 Bad Request", {"error": "malformed request"}, False))
+                break
+            if req is None:
+                break
+            method, path, headers, body = req
+            keep_alive = headers.get("connection", "").lower() != "close"
+
+            if method == "GET" and path == "/metrics":
+                out = response("200 OK", batcher.metrics(), keep_alive)
+            elif method == "GET" and path == "/health":
+                out = response("200 OK", {"status": "ok"}, keep_alive)
+            elif method == "POST" and path == "/predict":
+                t0 = time.perf_counter()
+                try:
+                    x = await loop.run_in_executor(decode_pool, decode, body)
+                    top = await batcher.submit(x)
+                except Exception as e:
+                    batcher.errors += 1
+                    out = response("422 Unprocessable Entity", {"error": str(e)}, keep_alive)
+                else:
+                    batcher.latencies.append(time.perf_counter() - t0)
+                    batcher.served += 1
+                    out = response("200 OK", {
+                        "class": top[0][0],
+                        "confidence": round(top[0][1], 4),
+                        "top_k": [{"class": c, "confidence": round(p, 4)} for c, p in top],
+                    }, keep_alive)
+            else:
+                out = response("404 Not Found", {"error": f"{method} {path}"}, keep_alive)
+
+            writer.write(out)
+            await writer.drain()
+            if not keep_alive:
+                break
+    finally:
+        writer.close()
+
+
+async def main():
+    t0 = time.perf_counter()
+    model, classes = student_mod.build_model(torch, nn, models, None)
+    model.eval()
+    print(f"Model ready in {time.perf_counter() - t0:.2f}s ({len(classes)} classes)")
+
+    batcher = MicroBatcher(model, classes)
+    decode_pool = ThreadPoolExecutor(max_workers=decode_workers)
+    batch_task = asyncio.create_task(batcher.run())
+
+    server = await asyncio.start_server(lambda r, w: handle(r, w, batcher, decode_pool), host, port)
+    print(f"Serving on http://{host}:{port} (max_batch_size={max_batch_size}, max_wait_ms={max_wait_ms})")
+    async with server:
+        try:
+            await server.serve_forever()
+        finally:
+            batch_task.cancel()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -36,57 +36,323 @@ class WeightedEnsembleModel:
         return weighted_logits
 
 
+# Fold an ensemble weight into the last Linear layer of a model (logits * w for free)
+def fold_weight(model, w, torch, nn):
+    last_linear = [m for m in model.modules() if isinstance(m, nn.Linear)][-1]
+    with torch.no_grad():
+        last_linear.weight.mul_(w)
+        if last_linear.bias is not None:
+            last_linear.bias.mul_(w)
+    return model
+
+
+# Post-training INT8 quantization of one member (after its ensemble weight is folded in)
+def quantize_member(model, mode, calib_batches, torch, nn):
+
+    # Dynamic: INT8 Linear weights, activations quantized on the fly (no calibration)
+    if mode == "dynamic":
+        return torch.ao.quantization.quantize_dynamic(model, {nn.Linear}, dtype=torch.qint8)
+
+    # Static: FX graph quantization calibrated on real validation images
+    if mode == "static":
+        qfx = torch.ao.quantization.quantize_fx
+        qconfig = torch.ao.quantization.get_default_qconfig_mapping(torch.backends.quantized.engine)
+        prepared = qfx.prepare_fx(model, qconfig, example_inputs=(calib_batches[0],))
+        with torch.no_grad():
+            for x in calib_batches:
+                prepared(x)
+        return qfx.convert_fx(prepared)
+
+    raise ValueError(f"Unknown quantization mode '{mode}' (expected 'dynamic' or 'static').")
+
+
+# Name, size and mtime of the checkpoints present ("" if none), stored in every exported artifact
+def checkpoint_fingerprint(torch):
+    parts = []
+    for p in ("convnext_base_custom.pt", "efficientnet_b3.pt"):
+        if torch.os.path.exists(p):
+            st = torch.os.stat(p)
+            parts.append(f"{p}:{st.st_size}:{st.st_mtime_ns}")
+    return "\n".join(parts)
+
+
+# An artifact is reused if it was exported from the checkpoints present now; without the
+# checkpoints (deployed artifact) there is nothing to compare against and it is trusted
+def artifact_is_fresh(exported_from, torch):
+    current = checkpoint_fingerprint(torch)
+    return not current or exported_from == current
+
+
+def _text(raw):
+    return raw.decode("utf-8") if isinstance(raw, bytes) else raw
+
+
+# Load a TorchScript ensemble saved with its class list; returns (model, classes, checkpoint fingerprint)
+def load_scripted(path, torch):
+    extra = {"classes.txt": "", "checkpoints.txt": ""}
+    model = torch.jit.load(path, map_location="cpu", _extra_files=extra)
+    return model.eval(), _text(extra["classes.txt"]).split("\n"), _text(extra["checkpoints.txt"])
+
+
+# ONNX Runtime session behind the same call/eval interface as the torch ensembles
+class OnnxEnsembleModel:
+
+    def __init__(self, session, torch):
+        self.session = session
+        self.torch = torch
+        self.input_name = session.get_inputs()[0].name
+
+    def eval(self):
+        return self
+
+    def to(self, device):
+        return self
+
+    def __call__(self, x):
+        out = self.session.run(None, {self.input_name: x.detach().cpu().contiguous().numpy()})[0]
+        return self.torch.from_numpy(out)
+
+
+# Load an exported ONNX ensemble (ort is the onnxruntime module, passed in by the harness);
+# returns (model, classes, checkpoint fingerprint)
+def load_onnx(path, ort, torch):
+    opts = ort.SessionOptions()
+    opts.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    opts.execution_mode = ort.ExecutionMode.ORT_PARALLEL
+    session = ort.InferenceSession(path, opts, providers=["CPUExecutionProvider"])
+    meta = session.get_modelmeta().custom_metadata_map
+    return OnnxEnsembleModel(session, torch), meta["classes"].split("\n"), meta.get("checkpoints", "")
+
+
+# Startup phase timings of the last build_model call (seconds, filled when a clock is given)
+startup_times = {}
+
+
+# Memory-mapped checkpoint: weights stay in the OS page cache and are shared across processes
+def load_checkpoint(path, torch):
+    try:
+        return torch.load(path, map_location="cpu", mmap=True, weights_only=True)
+    except (TypeError, RuntimeError):
+        # Older torch (no mmap) or legacy non-zip checkpoint: regular full load
+        return torch.load(path, map_location="cpu")
+
+
+# Build an architecture on the meta device and adopt the checkpoint tensors directly (no copy)
+def build_with_weights(build, state, torch):
+    try:
+        with torch.device("meta"):
+            model = build()
+        model.load_state_dict(state, strict=True, assign=True)
+    except (TypeError, AttributeError):
+        # torch < 2.1: allocate real parameters and copy the weights in
+        model = build()
+        model.load_state_dict(state, strict=True)
+    return model
+
+
+# Member that is only built (and weight-folded) on its first forward pass
+def make_lazy_member(load, weight, torch, nn):
+
+    class LazyMember(nn.Module):
+
+        def __init__(self):
+            super().__init__()
+            self.inner = None
+
+        def forward(self, x):
+            if self.inner is None:
+                self.inner = fold_weight(load(), weight, torch, nn).eval()
+            return self.inner(x)
+
+    return LazyMember()
+
+
+# Fused ensemble as a real nn.Module, built lazily because nn is injected after import
+def make_fused_ensemble(models_list, weights, torch, nn, quantize=None, calib_batches=None, fold=True):
+
+    class FusedEnsembleModel(nn.Module):
+        # Two members sharing one input; longer ensembles are nested pairwise
+
+        def __init__(self, first, second):
+            super().__init__()
+            self.first = first
+            self.second = second
+
+        @torch.jit.unused
+        def forward_streams(self, x):
+            # Eager GPU path: each member on its own CUDA stream
+            main = torch.cuda.current_stream()
+            s1, s2 = torch.cuda.Stream(), torch.cuda.Stream()
+            s1.wait_stream(main)
+            s2.wait_stream(main)
+            with torch.cuda.stream(s1):
+                a = self.first(x)
+            with torch.cuda.stream(s2):
+                b = self.second(x)
+            main.wait_stream(s1)
+            main.wait_stream(s2)
+            return a + b
+
+        def forward(self, x):
+            if not torch.jit.is_scripting():
+                # Tracing/ONNX export records a plain sum; the runtime parallelises it
+                if torch.jit.is_tracing():
+                    return self.first(x) + self.second(x)
+                if x.is_cuda:
+                    return self.forward_streams(x)
+            # Second member runs on the inter-op pool (truly concurrent once scripted)
+            fut = torch.jit.fork(self.second, x)
+            out = self.first(x)
+            return out + torch.jit.wait(fut)
+
+    members = models_list
+    if fold:
+        members = [fold_weight(m, w, torch, nn) for m, w in zip(models_list, weights)]
+    if quantize:
+        members = [quantize_member(m, quantize, calib_batches, torch, nn) for m in members]
+    fused = members[-1]
+    for m in reversed(members[:-1]):
+        fused = FusedEnsembleModel(m, fused)
+    return fused
+
+
 # Load ConvNeXt model from checkpoint
 def load_convnext(torch, nn, models):
-    ckpt = torch.load("convnext_base_custom.pt", map_location="cpu")
+    ckpt = load_checkpoint("convnext_base_custom.pt", torch)
     classes = [str(c) for c in ckpt["classes"]]
     num_classes = len(classes)
 
     # Rebuild model architecture
-    model = models.convnext_base(weights=None)
-    in_features = model.classifier[2].in_features
-    model.classifier[2] = nn.Linear(in_features, num_classes)
+    def build():
+        model = models.convnext_base(weights=None)
+        in_features = model.classifier[2].in_features
+        model.classifier[2] = nn.Linear(in_features, num_classes)
+        return model
 
     # Load trained weights
-    model.load_state_dict(ckpt["model"], strict=True)
+    model = build_with_weights(build, ckpt["model"], torch)
     model.eval()
     return model, classes
 
 
 # Load EfficientNet model from checkpoint
 def load_efficientnet(torch, nn, models):
-    ckpt = torch.load("efficientnet_b3.pt", map_location="cpu")
+    ckpt = load_checkpoint("efficientnet_b3.pt", torch)
     classes = [str(c) for c in ckpt["classes"]]
     num_classes = len(classes)
 
     # Rebuild model architecture
-    model = models.efficientnet_b3(weights=None)
-    in_features = model.classifier[1].in_features
-
-    model.classifier = nn.Sequential(
-        nn.Dropout(0.45),
-        nn.Linear(in_features, 640),
-        nn.ReLU(),
-        nn.Dropout(0.4),
-        nn.Linear(640, 512),
-        nn.ReLU(),
-        nn.Dropout(0.35),
-        nn.Linear(512, num_classes)
-    )
+    def build():
+        model = models.efficientnet_b3(weights=None)
+        in_features = model.classifier[1].in_features
+
+        model.classifier = nn.Sequential(
+            nn.Dropout(0.45),
+            nn.Linear(in_features, 640),
+            nn.ReLU(),
+            nn.Dropout(0.4),
+            nn.Linear(640, 512),
+            nn.ReLU(),
+            nn.Dropout(0.35),
+            nn.Linear(512, num_classes)
+        )
+        return model
 
     # Load trained weights
-    model.load_state_dict(ckpt["model"], strict=True)
+    model = build_with_weights(build, ckpt["model"], torch)
     model.eval()
     return model, classes
 
 
 
+# Load the distilled student (distill_student.py) from checkpoint
+def load_student(torch, nn, models):
+    ckpt = load_checkpoint("student_distilled.pt", torch)
+    classes = [str(c) for c in ckpt["classes"]]
+    num_classes = len(classes)
+
+    if ckpt["model_name"] not in ("mobilenet_v3_large", "efficientnet_b0"):
+        raise ValueError(f"Unknown student architecture '{ckpt['model_name']}'")
+
+    # Rebuild model architecture
+    def build():
+        if ckpt["model_name"] == "mobilenet_v3_large":
+            model = models.mobilenet_v3_large(weights=None)
+            model.classifier[3] = nn.Linear(model.classifier[3].in_features, num_classes)
+        else:
+            model = models.efficientnet_b0(weights=None)
+            model.classifier[1] = nn.Linear(model.classifier[1].in_features, num_classes)
+        return model
+
+    # Load trained weights (same mmap + meta-device path as the teachers)
+    model = build_with_weights(build, ckpt["model"], torch)
+    model.eval()
+    return model, classes
+
+
 # Build ensemble model from saved checkpoints
-def build_model(torch, nn, models, classes):
+def build_model(torch, nn, models, classes, fused=True, script=True,
+                quantize=None, calib_batches=None, backend="eager", ort=None, student=False,
+                lazy=False, clock=None):
+
+    # Per-phase startup timing (clock is injected by the harness, e.g. time.perf_counter)
+    tick = clock or (lambda: 0.0)
+    startup_times.clear()
+    t_start = t = tick()
+
+    # Distilled single-backbone model instead of the two-model ensemble
+    if student:
+        if not torch.os.path.exists("student_distilled.pt"):
+            raise FileNotFoundError("The student file 'student_distilled.pt' is required (run distill_student.py).")
+        model, classes_ref = load_student(torch, nn, models)
+        return (torch.jit.script(model) if script else model), classes_ref
+
+    # Compiled artifacts written by export_models.py skip the Python rebuild entirely
+    if backend in ("torchscript", "onnxruntime"):
+        path = "ensemble.ts" if backend == "torchscript" else "ensemble.onnx"
+        if not torch.os.path.exists(path):
+            raise FileNotFoundError(f"'{path}' is missing. Run export_models.py.")
+        if backend == "torchscript":
+            model, classes, exported_from = load_scripted(path, torch)
+        else:
+            model, classes, exported_from = load_onnx(path, ort, torch)
+        if not artifact_is_fresh(exported_from, torch):
+            raise FileNotFoundError(f"'{path}' was exported from other checkpoints. Run export_models.py.")
+        return model, classes
+    if backend != "eager":
+        raise ValueError(f"Unknown backend '{backend}' (expected 'eager', 'torchscript' or 'onnxruntime').")
+
+    # Quantized ensembles are cached as TorchScript next to the checkpoints
+    quant_cache = f"ensemble_int8_{quantize}.pt" if quantize else None
+    if quant_cache and torch.os.path.exists(quant_cache):
+        model, classes, exported_from = load_scripted(quant_cache, torch)
+        if artifact_is_fresh(exported_from, torch):
+            return model, classes
+    if quantize and not fused:
+        raise ValueError("Quantization is only available for the fused ensemble.")
+
+    if lazy and (quantize or not fused):
+        raise ValueError("Lazy loading is only available for the fp32 fused ensemble.")
 
     models_list = []
     classes_ref = None
 
+    # Lazy: only the class lists are read now (cheap with mmap); members build on first use
+    if lazy:
+        for path in ("convnext_base_custom.pt", "efficientnet_b3.pt"):
+            if not torch.os.path.exists(path):
+                raise FileNotFoundError(f"The file '{path}' is required.")
+        classes_ref = [str(c) for c in load_checkpoint("convnext_base_custom.pt", torch)["classes"]]
+        classes_eff = [str(c) for c in load_checkpoint("efficientnet_b3.pt", torch)["classes"]]
+        if classes_eff != classes_ref:
+            raise ValueError("The classes differ between ConvNeXt and EfficientNet!")
+        members = [make_lazy_member(lambda: load_convnext(torch, nn, models)[0], 0.7, torch, nn),
+                   make_lazy_member(lambda: load_efficientnet(torch, nn, models)[0], 0.3, torch, nn)]
+        ensemble = make_fused_ensemble(members, [0.7, 0.3], torch, nn, fold=False).eval()
+        startup_times["read classes"] = tick() - t
+        startup_times["total"] = tick() - t_start
+        return ensemble, classes_ref
+
     # Load ConvNeXt model (required)
     if torch.os.path.exists("convnext_base_custom.pt"):
         convnext_model, classes_conv = load_convnext(torch, nn, models)
@@ -94,6 +360,8 @@ def build_model(torch, nn, models, classes):
         classes_ref = classes_conv
     else:
         raise FileNotFoundError("The ConvNeXt file 'convnext_base_custom.pt' is required.")
+    startup_times["load convnext"] = tick() - t
+    t = tick()
 
     # Load EfficientNet model (required)
     if torch.os.path.exists("efficientnet_b3.pt"):
@@ -105,12 +373,39 @@ def build_model(torch, nn, models, classes):
         models_list.append(eff_model)
     else:
         raise FileNotFoundError("The EfficientNet file 'efficientnet_b3.pt' is required.")
+    startup_times["load efficientnet"] = tick() - t
+    t = tick()
 
     # Create weighted ensemble (ConvNeXt=70%, EfficientNet=30%)
     weights = [0.7, 0.3]
 
-    ensemble = WeightedEnsembleModel(models_list, weights)
-    ensemble.eval()
+    if not fused:
+        ensemble = WeightedEnsembleModel(models_list, weights)
+        ensemble.eval()
+        return ensemble, classes_ref
+
+    # Single graph: weights folded into the heads, members run concurrently
+    # calib_batches may be a lazy generator; it is only consumed on a cache miss
+    if quantize == "static":
+        calib_batches = list(calib_batches or [])
+        if not calib_batches:
+            raise ValueError("Static quantization needs calibration batches.")
+
+    ensemble = make_fused_ensemble(models_list, weights, torch, nn,
+                                   quantize=quantize, calib_batches=calib_batches).eval()
+    startup_times["fuse" + (f" + quantize ({quantize})" if quantize else "")] = tick() - t
+    t = tick()
+    if script or quant_cache:
+        try:
+            ensemble = torch.jit.script(ensemble)
+        except Exception as e:
+            print(f"TorchScript compilation failed, using eager fused ensemble: {e}")
+        else:
+            if quant_cache:
+                torch.jit.save(ensemble, quant_cache, _extra_files={"classes.txt": "\n".join(classes_ref),
+                                                                    "checkpoints.txt": checkpoint_fingerprint(torch)})
+        startup_times["script"] = tick() - t
+    startup_times["total"] = tick() - t_start
 
     return ensemble, classes_ref
 
@@ -129,3 +424,25 @@ def predict(model, image, preprocess, torch):
     with torch.inference_mode():
         logits = model(x)
         return int(logits.argmax(1).item())
+
+
+# Predict top-k classes for a batch of images in a single forward pass
+def predict_batch(model, images, preprocess, torch, k=1):
+
+    # Accept either a pre-stacked (N, 3, H, W) tensor or a list of PIL images
+    if torch.is_tensor(images):
+        x = images if images.dim() == 4 else images.unsqueeze(0)
+    else:
+        x = torch.stack([preprocess(img if img.mode == "RGB" else img.convert("RGB"))
+                         for img in images])
+
+    # uint8 batches (tensor preprocessing) are normalized here, in one op for the whole batch
+    if x.dtype == torch.uint8:
+        x = preprocess.normalize(x)
+
+    # Run inference once for the whole batch; results stay as tensors (no host sync here)
+    with torch.inference_mode():
+        logits = model(x)
+        probs = logits.softmax(dim=1)
+        top_probs, top_idx = probs.topk(min(k, probs.size(1)), dim=1)
+    return top_idx, top_probs
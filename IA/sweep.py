@@ -0,0 +1,208 @@
+# Hyperparameter sweep runner for efficientnet_b3.py / train_convnext.py.
+# Trials run in parallel, each as its own training process with a fixed thread budget. Every
+# epoch, a trial reports its validation accuracy to a local SQLite store and is stopped early
+# when it falls behind the others (successive halving or median stopping). Results stay in the
+# store, so a sweep can be inspected or extended later.
+#   python sweep.py
+import json
+import math
+import os
+import random
+import sqlite3
+import statistics
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# ---- config ----
+trainer = "efficientnet_b3.py"      # or "train_convnext.py"
+sweep_name = "b3_lr_wd_dropout"
+db_path = "sweeps.sqlite"
+n_trials = 16
+threads_per_trial = 4               # intra-op threads of each trial
+max_parallel = max(1, (os.cpu_count() or 1) // threads_per_trial)
+loader_workers_per_trial = 1        # DataLoader workers of each trial
+pruner = "halving"                  # "halving" (asynchronous successive halving), "median" or None
+min_epochs = 2                      # no pruning before this epoch
+eta = 3                             # halving: keep the top 1/eta at each rung (epochs min_epochs * eta^k)
+seed = 0
+
+# name -> ("loguniform", low, high) | ("uniform", low, high) | ("choice", [values]) | ("fixed", value)
+search_space = {
+    "lr": ("loguniform", 1e-5, 1e-3),
+    "weight_decay": ("loguniform", 1e-5, 1e-2),
+    "batch_size": ("choice", [6, 8, 16]),
+    "dropouts": ("choice", [(0.45, 0.4, 0.35), (0.3, 0.3, 0.2), (0.5, 0.5, 0.4)]),
+    "label_smoothing": ("uniform", 0.0, 0.2),
+    "epochs": ("fixed", 20),        # "num_epochs" for train_convnext.py
+}
+# ----------------
+
+
+def connect(path=None):
+    db = sqlite3.connect(path or os.environ.get("SWEEP_DB", db_path), timeout=60)
+    db.execute("PRAGMA journal_mode=WAL")      # concurrent trials write to the same store
+    db.execute("""CREATE TABLE IF NOT EXISTS trials (
+        id INTEGER PRIMARY KEY, sweep TEXT, trainer TEXT, params TEXT, status TEXT,
+        best_acc REAL, last_epoch INTEGER, started REAL, finished REAL)""")
+    db.execute("""CREATE TABLE IF NOT EXISTS epochs (
+        trial_id INTEGER, epoch INTEGER, val_acc REAL, ts REAL, PRIMARY KEY (trial_id, epoch))""")
+    return db
+
+
+# ---- trial side (called by the trainers) ----
+
+def trial_params(allowed):
+    """Hyperparameters of the current sweep trial ({} outside a sweep); also applies the thread budget.
+
+    allowed: names the trainer actually reads; any other key is an error instead of being ignored.
+    """
+    params = os.environ.get("SWEEP_PARAMS")
+    if not params:
+        return {}
+    params = json.loads(params)
+    unknown = sorted(set(params) - set(allowed))
+    if unknown:
+        raise ValueError(f"Sweep parameters not used by this trainer: {', '.join(unknown)}")
+    import torch
+    torch.set_num_threads(int(os.environ.get("SWEEP_THREADS", 1)))
+    return params
+
+
+def report_epoch(epoch, val_acc):
+    """Record this epoch's validation accuracy; True when the trial should stop (pruned)."""
+    trial_id = os.environ.get("SWEEP_TRIAL")
+    if trial_id is None:
+        return False
+    trial_id = int(trial_id)
+    db = connect()
+    with db:
+        db.execute("INSERT OR REPLACE INTO epochs VALUES (?, ?, ?, ?)", (trial_id, epoch, val_acc, time.time()))
+        db.execute("UPDATE trials SET best_acc = MAX(COALESCE(best_acc, 0), ?), last_epoch = ? WHERE id = ?",
+                   (val_acc, epoch, trial_id))
+    sweep, rule = os.environ["SWEEP_NAME"], os.environ.get("SWEEP_PRUNER") or None
+    pruned = rule is not None and should_prune(db, sweep, trial_id, epoch, rule)
+    if pruned:
+        with db:
+            db.execute("UPDATE trials SET status = 'pruned', finished = ? WHERE id = ?", (time.time(), trial_id))
+    db.close()
+    return pruned
+
+
+def best_so_far(db, sweep, epoch):
+    """{trial id: best val acc up to `epoch`} for every trial of the sweep that reached it."""
+    rows = db.execute("""SELECT e.trial_id, MAX(e.val_acc) FROM epochs e JOIN trials t ON t.id = e.trial_id
+                         WHERE t.sweep = ? AND e.epoch <= ? GROUP BY e.trial_id
+                         HAVING MAX(e.epoch) >= ?""", (sweep, epoch, epoch)).fetchall()
+    return dict(rows)
+
+
+def should_prune(db, sweep, trial_id, epoch, rule):
+    grace = int(os.environ.get("SWEEP_MIN_EPOCHS", min_epochs))
+    if epoch < grace:
+        return False
+    scores = best_so_far(db, sweep, epoch)
+    mine = scores.pop(trial_id, None)
+    if mine is None or not scores:
+        return False
+
+    if rule == "median":
+        # Median stopping: behind the median of the other trials at the same epoch
+        return mine < statistics.median(scores.values())
+
+    # Successive halving: only decided at rungs grace * eta^k, keep the top 1/eta seen at that rung
+    factor = int(os.environ.get("SWEEP_ETA", eta))
+    k = math.log(epoch / grace, factor)
+    if abs(k - round(k)) > 1e-9:
+        return False
+    everyone = sorted(list(scores.values()) + [mine], reverse=True)
+    if len(everyone) < factor:
+        return False                # not enough trials at this rung yet: let it continue
+    keep = max(1, len(everyone) // factor)
+    return mine < everyone[keep - 1]
+
+
+# ---- runner side ----
+
+def sample_params(rng):
+    params = {}
+    for name, spec in search_space.items():
+        kind = spec[0]
+        if kind == "loguniform":
+            params[name] = math.exp(rng.uniform(math.log(spec[1]), math.log(spec[2])))
+        elif kind == "uniform":
+            params[name] = rng.uniform(spec[1], spec[2])
+        elif kind == "choice":
+            params[name] = rng.choice(spec[1])
+        else:
+            params[name] = spec[1]
+    return params
+
+
+def run_trial(trial_id, params):
+    out_dir = os.path.join("sweeps", sweep_name, f"trial_{trial_id:03d}")
+    os.makedirs(out_dir, exist_ok=True)
+    # Trial outputs never touch the real checkpoints
+    params = dict(params, num_workers=loader_workers_per_trial, resume=False,
+                  checkpoint_dir=os.path.join(out_dir, "checkpoints"),
+                  best_path=os.path.join(out_dir, "best.pt"))
+    if trainer == "efficientnet_b3.py":
+        # head_only feature caches are written in place: parallel trials must not share one
+        params["feature_dir"] = os.path.join(out_dir, "features")
+    env = dict(os.environ,
+               SWEEP_PARAMS=json.dumps(params), SWEEP_TRIAL=str(trial_id), SWEEP_NAME=sweep_name,
+               SWEEP_DB=os.path.abspath(db_path), SWEEP_PRUNER=pruner or "", SWEEP_MIN_EPOCHS=str(min_epochs),
+               SWEEP_ETA=str(eta), SWEEP_THREADS=str(threads_per_trial),
+               OMP_NUM_THREADS=str(threads_per_trial), MKL_NUM_THREADS=str(threads_per_trial))
+
+    db = connect()
+    with db:
+        db.execute("UPDATE trials SET status = 'running', started = ? WHERE id = ?", (time.time(), trial_id))
+    with open(os.path.join(out_dir, "log.txt"), "w") as log:
+        code = subprocess.run([sys.executable, trainer], env=env, stdout=log, stderr=subprocess.STDOUT).returncode
+    with db:
+        # A pruned trial already marked itself
+        db.execute("UPDATE trials SET status = ?, finished = ? WHERE id = ? AND status = 'running'",
+                   ("done" if code == 0 else "failed", time.time(), trial_id))
+    status, best = db.execute("SELECT status, best_acc FROM trials WHERE id = ?", (trial_id,)).fetchone()
+    db.close()
+    return trial_id, status, best
+
+
+def leaderboard(db, top=10):
+    rows = db.execute("""SELECT id, status, best_acc, last_epoch, params FROM trials
+                         WHERE sweep = ? ORDER BY best_acc DESC LIMIT ?""", (sweep_name, top)).fetchall()
+    print(f"\n{'trial':>5s} {'status':>8s} {'best acc':>9s} {'epochs':>7s}  params")
+    for tid, status, best, last, params in rows:
+        print(f"{tid:5d} {status:>8s} {best or 0:9.4f} {last or 0:7d}  {json.loads(params)}")
+
+
+def main():
+    rng = random.Random(seed)
+    db = connect()
+    trials = []
+    with db:
+        for _ in range(n_trials):
+            params = sample_params(rng)
+            cur = db.execute("INSERT INTO trials (sweep, trainer, params, status) VALUES (?, ?, ?, 'queued')",
+                             (sweep_name, trainer, json.dumps(params)))
+            trials.append((cur.lastrowid, params))
+
+    print(f"Sweep '{sweep_name}': {n_trials} trials of {trainer}, {max_parallel} in parallel x "
+          f"{threads_per_trial} threads, pruner={pruner}", flush=True)
+    start = time.time()
+    # One slot per parallel trial; each trial is a fresh process (clean torch/DataLoader state)
+    with ThreadPoolExecutor(max_workers=max_parallel) as pool:
+        for done, (tid, status, best) in enumerate(pool.map(lambda t: run_trial(*t), trials), 1):
+            print(f"  trial {tid}: {status} (best acc {best or 0:.4f}) [{done}/{n_trials}]", flush=True)
+
+    epochs_run = db.execute("""SELECT COUNT(*) FROM epochs e JOIN trials t ON t.id = e.trial_id
+                               WHERE t.sweep = ?""", (sweep_name,)).fetchone()[0]
+    print(f"\nSweep finished in {(time.time() - start) / 60:.1f} min, {epochs_run} trial-epochs run")
+    leaderboard(db)
+    db.close()
+
+
+if __name__ == "__main__":
+    main()
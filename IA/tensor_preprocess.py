@@ -0,0 +1,96 @@
+# Tensor preprocessing for inference (marker.py / predict), alternative to the PIL transforms.Compose:
+#   decode  -> uint8 CHW tensor; JPEGs are decoded at reduced size (libjpeg DCT scaling, 1/2..1/8)
+#              when the image is far larger than 224x224, or with torchvision.io
+#   resize  -> antialiased bilinear on the uint8 tensor (same output size as Resize((224, 224)))
+#   normalize -> one fused multiply-add over the whole (N, 3, 224, 224) batch
+# Workers ship uint8 tensors (4x less than float32); the float batch only exists right before the forward.
+import io
+import time
+import torch
+from PIL import Image
+from torchvision.io import ImageReadMode, decode_image, read_file
+from torchvision.transforms import functional as TF
+
+MEAN = (0.485, 0.456, 0.406)
+STD = (0.229, 0.224, 0.225)
+
+
+class TensorPreprocess:
+
+    def __init__(self, size=(224, 224), draft=True, decoder="pil", mean=MEAN, std=STD):
+        self.size = size
+        self.draft = draft          # reduced-size JPEG decoding (PIL decoder only)
+        self.decoder = decoder      # "pil" or "torchvision"
+        # (x / 255 - mean) / std  ==  x * scale + shift
+        std = torch.tensor(std).view(3, 1, 1)
+        self.scale = 1.0 / (255.0 * std)
+        self.shift = -torch.tensor(mean).view(3, 1, 1) / std
+
+    def open(self, source):
+        """PIL RGB image, decoded at the smallest JPEG scale still >= the target size."""
+        img = Image.open(io.BytesIO(source) if isinstance(source, bytes) else source)
+        if self.draft:
+            img.draft("RGB", (self.size[1], self.size[0]))   # no-op for non-JPEG files
+        return img.convert("RGB")
+
+    def decode(self, source):
+        """uint8 (3, H, W) tensor from a path or encoded bytes."""
+        if self.decoder == "torchvision":
+            data = torch.frombuffer(bytearray(source), dtype=torch.uint8) if isinstance(source, bytes) \
+                else read_file(str(source))
+            return decode_image(data, mode=ImageReadMode.RGB)
+        return TF.pil_to_tensor(self.open(source))
+
+    def resize(self, t):
+        """uint8 (3, H, W) -> uint8 (3, *size), antialiased like the PIL Resize."""
+        if tuple(t.shape[-2:]) == tuple(self.size):
+            return t
+        return TF.resize(t, list(self.size), antialias=True)
+
+    def load(self, source):
+        """Decode + resize, the per-image part done in DataLoader workers."""
+        return self.resize(self.decode(source))
+
+    def normalize(self, x):
+        """uint8 (3, H, W) or (N, 3, H, W) -> normalized float32, in one fused op."""
+        return torch.addcmul(self.shift, x.float(), self.scale)
+
+    def from_pil(self, img):
+        """uint8 (3, *size) from an already decoded PIL image (same tensor as load())."""
+        if img.mode != "RGB":
+            img = img.convert("RGB")
+        return self.resize(TF.pil_to_tensor(img))
+
+    def __call__(self, img):
+        """Drop-in for the Compose pipeline on an already decoded PIL image (used by predict)."""
+        return self.normalize(self.from_pil(img))
+
+
+def compare_with_compose(files, compose, tp, batch_size=16):
+    """Per-image preprocessing cost (decode included) of the Compose pipeline vs the tensor path.
+
+    Also reports the largest per-pixel difference of the model inputs, so the speedup can be
+    weighed against how far the inputs move (draft decoding changes pixels slightly).
+    """
+    files = list(files)
+    if not files:
+        return {}
+
+    t0 = time.perf_counter()
+    ref = [compose(Image.open(p).convert("RGB")) for p in files]
+    compose_s = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    out = []
+    for i in range(0, len(files), batch_size):
+        batch = torch.stack([tp.load(p) for p in files[i:i + batch_size]])
+        out.extend(tp.normalize(batch))
+    tensor_s = time.perf_counter() - t0
+
+    max_diff = max(float((a - b).abs().max()) for a, b in zip(ref, out))
+    n = len(files)
+    print(f"Preprocessing ({n} images): Compose {compose_s / n * 1000:.2f} ms/img | "
+          f"tensor ({tp.decoder}{', draft' if tp.draft and tp.decoder == 'pil' else ''}) "
+          f"{tensor_s / n * 1000:.2f} ms/img | x{compose_s / tensor_s:.2f} | max input diff {max_diff:.3f}",
+          flush=True)
+    return {"compose_ms": compose_s / n * 1000, "tensor_ms": tensor_s / n * 1000, "max_diff": max_diff}
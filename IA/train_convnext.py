@@ -3,21 +3,67 @@ import os
 from pathlib import Path
 import torch
 import torch.nn as nn
-from torch.utils.data import DataLoader
+from torch.nn.parallel import DistributedDataParallel as DDP
+from torch.utils.data.distributed import DistributedSampler
+from loaders import make_loader, default_num_workers
+from checkpointing import AsyncCheckpointer, resumable_checkpoint, rng_state, set_rng_state
+from sweep import trial_params, report_epoch
+from distributed import setup, cleanup, is_main, all_reduce_sum, broadcast_flag, record_scaling, ShardSampler
 from torchvision import datasets, transforms, models
+from packed_dataset import PackedImageDataset
+from manifest_dataset import ManifestImageFolder
+from dataset_index import IndexImageFolder
+from profiling import StageTimer, TorchProfile, stage
+from mixed_precision import amp_dtype_for, make_scaler, autocast, to_device, train_step, compare_train_speed
+import time
 
 
 def main():
 
+    # DDP : lancé par torchrun (torchrun --nproc_per_node=N train_convnext.py), sinon un seul processus
+    ddp_backend = "gloo"   # gloo fonctionne sur CPU (machines multi-socket) comme sur GPU
+    rank, world_size, local_rank = setup(ddp_backend)
+    log = print if is_main() else (lambda *args, **kwargs: None)   # Affichage uniquement sur le rang 0
+    # Mesure de scalabilité (distributed.py) : nombre de pas chronométrés puis arrêt (0 = entraînement normal)
+    benchmark_steps = int(os.environ.get("DDP_BENCHMARK_STEPS", 0))
+
     # Chemins vers les dossiers d’entraînement et de validation
     train_dir = "C:\\Users\\thiba\\OneDrive\\Bureau\\AI_Project\\Split\\Training"
     val_dir = "C:\\Users\\thiba\\OneDrive\\Bureau\\AI_Project\\Split\\Validation"
+    packed_dir = None      # Dossier produit par packed_dataset.py (None = décodage JPEG à chaque époque)
+    split_manifest = None  # Split/split_manifest.csv produit par Split.py (None = parcours des dossiers)
+    val_fold = None        # k-fold : numéro du fold utilisé comme validation
+    use_index = True       # Liste des images lue dans l’index (dataset_index.py) au lieu de parcourir les dossiers
 
     # Hyperparamètres
     batch_size = 16        # Nombre d’images par batch
     num_epochs = 20        # Nombre total d’époques d’entraînement
     lr = 1e-4              # Taux d’apprentissage
-    device = "cuda" if torch.cuda.is_available() else "cpu"  # Sélection GPU/CPU
+    device = f"cuda:{local_rank}" if torch.cuda.is_available() else "cpu"  # Sélection GPU/CPU (un GPU par processus)
+    fast_train = False     # Autocast (bf16 CPU / fp16-bf16 GPU) + channels_last + métriques sur le device
+    compare_speed = False  # Compare quelques pas fp32 vs mode rapide avant l’entraînement
+    num_workers = None     # Processus de chargement (None = automatique selon le nombre de CPU)
+    pin_memory = None      # Mémoire verrouillée pour les copies vers le GPU (None = seulement si GPU)
+    prefetch_factor = 4    # Batches préparés à l’avance par chaque worker
+    checkpoint_dir = "checkpoints_convnext"   # Checkpoints complets à chaque époque (écriture en arrière-plan)
+    run_name = "default"   # Les checkpoints de cet entraînement vont dans checkpoint_dir/run_name
+    keep_checkpoints = 3   # Seuls les N derniers sont conservés
+    resume = False         # Reprise d’un entraînement interrompu (sauf si cet entraînement est terminé)
+    best_path = "convnext_base_custom.pt"   # Chemin où sauvegarder le meilleur modèle
+
+    # Essai d’un balayage (sweep.py) : les hyperparamètres de l’essai remplacent les valeurs ci-dessus
+    params = trial_params(allowed=("batch_size", "num_epochs", "lr", "num_workers", "checkpoint_dir", "resume",
+                                   "best_path"))
+    batch_size = params.get("batch_size", batch_size)
+    num_epochs = params.get("num_epochs", num_epochs)
+    lr = params.get("lr", lr)
+    num_workers = params.get("num_workers", num_workers)
+    checkpoint_dir = params.get("checkpoint_dir", checkpoint_dir)
+    resume = params.get("resume", resume)
+    best_path = params.get("best_path", best_path)
+    profile = False        # Tableau du temps par étape à chaque époque + trace Chrome (num_workers=0 pour séparer décodage/transforms)
+    profile_torch_steps = 0   # Trace torch.profiler sur ce nombre de pas d’entraînement (0 = désactivé)
+    timer = StageTimer(enabled=profile)
     
 
     # Transformations appliquées aux images d’entraînement (avec augmentation)
@@ -39,21 +85,64 @@ def main():
     ])
     
 
-    # Chargement des datasets depuis la structure de dossiers
-    train_ds = datasets.ImageFolder(train_dir, transform=train_tf)
-    val_ds = datasets.ImageFolder(val_dir, transform=val_tf)
+    # Variante sur tenseurs uint8 pré-décodés (le Resize 224 est déjà fait au packing)
+    train_tf_packed = transforms.Compose([
+        transforms.RandomHorizontalFlip(),
+        transforms.RandomRotation(10),
+        transforms.ConvertImageDtype(torch.float32),  # uint8 [0,255] -> float [0,1]
+        transforms.Normalize([0.485, 0.456, 0.406],
+                             [0.229, 0.224, 0.225]),
+    ])
+    val_tf_packed = transforms.Compose([
+        transforms.ConvertImageDtype(torch.float32),
+        transforms.Normalize([0.485, 0.456, 0.406],
+                             [0.229, 0.224, 0.225]),
+    ])
+
+    # Décodage et transformations chronométrés (inchangés si le profilage est désactivé)
+    image_loader = timer.wrap(datasets.folder.default_loader, "decode")
+    train_tf = timer.wrap(train_tf, "transform")
+    val_tf = timer.wrap(val_tf, "transform")
+
+    # Chargement des datasets depuis la structure de dossiers (ou depuis le cache packé)
+    if packed_dir:
+        train_ds = PackedImageDataset(Path(packed_dir) / "Training_224", transform=train_tf_packed)
+        val_ds = PackedImageDataset(Path(packed_dir) / "Validation_224", transform=val_tf_packed)
+    elif split_manifest:
+        train_ds = ManifestImageFolder(split_manifest, "Training", val_fold, transform=train_tf, loader=image_loader)
+        val_ds = ManifestImageFolder(split_manifest, "Validation", val_fold, transform=val_tf, loader=image_loader)
+    elif use_index:
+        train_ds = IndexImageFolder(train_dir, transform=train_tf, loader=image_loader, exts=(".jpg", ".jpeg", ".png"))
+        val_ds = IndexImageFolder(val_dir, transform=val_tf, loader=image_loader, exts=(".jpg", ".jpeg", ".png"))
+    else:
+        train_ds = datasets.ImageFolder(train_dir, transform=train_tf, loader=image_loader)
+        val_ds = datasets.ImageFolder(val_dir, transform=val_tf, loader=image_loader)
     
+    # En DDP chaque processus ne voit que sa part du dataset (validation sans doublons : chaque image comptée une fois)
+    train_sampler = val_sampler = None
+    if world_size > 1:
+        train_sampler = DistributedSampler(train_ds, shuffle=True)
+        val_sampler = ShardSampler(val_ds)
+        if num_workers is None:
+            num_workers = default_num_workers(int(os.environ.get("LOCAL_WORLD_SIZE", world_size)))
+
     # Création des DataLoaders pour charger les images par batch
-    train_loader = DataLoader(train_ds, batch_size=batch_size, shuffle=True)   # On mélange les images
-    val_loader = DataLoader(val_ds, batch_size=batch_size, shuffle=False)      # Pas de shuffle pour la validation
+    train_loader = make_loader(train_ds, batch_size, shuffle=True, name="train", num_workers=num_workers,   # On mélange les images
+                               pin_memory=pin_memory, prefetch_factor=prefetch_factor,
+                               log_wait=is_main(), sampler=train_sampler)
+    val_loader = make_loader(val_ds, batch_size, shuffle=False, name="val", num_workers=num_workers,        # Pas de shuffle pour la validation
+                             pin_memory=pin_memory, prefetch_factor=prefetch_factor,
+                             log_wait=is_main(), sampler=val_sampler)
     
     num_classes = len(train_ds.classes)   # Nombre de classes détectées automatiquement
 
 
     # Affichage des classes pour vérification
     classes_str = ", ".join(train_ds.classes)
-    print(f"Number of classes : {num_classes}", flush=True)
-    print(f"Classes : [{classes_str}]\n", flush=True)
+    log(f"Number of classes : {num_classes}", flush=True)
+    log(f"Classes : [{classes_str}]\n", flush=True)
+    if world_size > 1:
+        log(f"DDP : {world_size} processus ({ddp_backend}), batch global {batch_size * world_size}", flush=True)
 
     # Chargement d’un modèle ConvNeXt Base préentraîné sur ImageNet
     weights = models.ConvNeXt_Base_Weights.IMAGENET1K_V1
@@ -65,86 +154,173 @@ def main():
     
     # Envoi du modèle sur GPU ou CPU
     model = model.to(device)
+    if fast_train:
+        model = model.to(memory_format=torch.channels_last)   # Format NHWC, plus rapide pour les convolutions
     
     # Définition de la fonction de perte et de l’optimiseur
     criterion = nn.CrossEntropyLoss()                       # Perte adaptée au multi-classe
     optimizer = torch.optim.Adam(model.parameters(), lr=lr) # Optimiseur Adam
+    amp_dtype = amp_dtype_for(device) if fast_train else None   # None = fp32 classique
+    scaler = make_scaler(device, amp_dtype) if fast_train else None
+
+    # Mesure comparative img/s : boucle actuelle vs mode rapide (poids restaurés ensuite)
+    if compare_speed:
+        compare_train_speed(model, train_loader, criterion, optimizer, device)
+        if fast_train:
+            model = model.to(memory_format=torch.channels_last)
 
     best_acc = 0.0                # Meilleure précision obtenue
     patience_count = 0            # Compteur pour un éventuel early stopping (non utilisé ici)
-    best_path = "convnext_base_custom.pt"   # Chemin où sauvegarder le meilleur modèle
+    start_epoch = 1
+
+    # Reprise d’un entraînement interrompu : modèle, optimiseur, scaler, compteurs et état aléatoire
+    # (jamais en mesure de scalabilité ; un entraînement terminé ou sur d’autres classes repart de zéro)
+    run_dir = os.path.join(checkpoint_dir, run_name)
+    ckpt_path, ckpt = None, None
+    if resume and not benchmark_steps:
+        ckpt_path, ckpt = resumable_checkpoint(run_dir, "convnext_base", train_ds.classes)
+    if ckpt is not None:
+        model.load_state_dict(ckpt["model"])
+        optimizer.load_state_dict(ckpt["optimizer"])
+        if scaler is not None and ckpt.get("scaler"):
+            scaler.load_state_dict(ckpt["scaler"])
+        best_acc, patience_count = ckpt["best_acc"], ckpt["patience_count"]
+        if world_size == 1:
+            set_rng_state(ckpt["rng"])   # En DDP chaque rang garde son propre générateur
+        start_epoch = ckpt["epoch"] + 1
+        log(f"Resumed from {ckpt_path} (epoch {ckpt['epoch']}, best acc {best_acc:.4f})", flush=True)
+
+    # Écriture des checkpoints dans un thread (copie CPU prise à la fin de l’époque), rang 0 uniquement
+    checkpointer = AsyncCheckpointer(run_dir, "convnext_base", keep=keep_checkpoints,
+                                     resumed=ckpt is not None) if is_main() else None
+
+    # Synchronisation des gradients entre processus (all-reduce pendant le backward)
+    net = model
+    if world_size > 1:
+        model = DDP(model, device_ids=[local_rank] if torch.cuda.is_available() else None)
+
+    prof = TorchProfile(profile_torch_steps, "torch_trace_convnext.json")   # Premiers pas uniquement
     
     # Boucle d’entraînement principale
-    for epoch in range(1, num_epochs + 1):
-        print(f"\n--- Epoch {epoch}/{num_epochs} ---", flush=True)
+    for epoch in range(start_epoch, num_epochs + 1):
+        log(f"\n--- Epoch {epoch}/{num_epochs} ---", flush=True)
+        if train_sampler is not None:
+            train_sampler.set_epoch(epoch)   # Mélange différent à chaque époque, cohérent entre processus
     
         # Phase d’entraînement
         model.train()             # Passage en mode entraînement
-        train_loss = 0.0
-        correct = 0
+        # Les métriques restent sur le device : une seule synchronisation par époque
+        train_loss = torch.zeros((), device=device)
+        correct = torch.zeros((), dtype=torch.long, device=device)
         total = 0
+        epoch_start = time.time()
     
-        for images, labels in train_loader:
-            images, labels = images.to(device), labels.to(device)
+        for step, (images, labels) in enumerate(timer.timed_iter(train_loader) if profile else train_loader):
+            if benchmark_steps and step == 1:
+                epoch_start, total = time.time(), 0   # Premier pas = échauffement, non compté
+            with stage(timer, "to_device"):
+                images, labels = to_device(images, labels, device, channels_last=fast_train)
     
-            # Forward + Backward + Optimisation
-            optimizer.zero_grad()        # Réinitialisation des gradients
-            outputs = model(images)      # Prédiction
-            loss = criterion(outputs, labels)  # Calcul de la perte
-            loss.backward()              # Rétropropagation
-            optimizer.step()             # Mise à jour des poids
+            # Forward + Backward + Optimisation (autocast / loss scaling en mode rapide)
+            outputs, loss = train_step(model, images, labels, criterion, optimizer, scaler, amp_dtype, timer)
+            prof.step()
     
             # Calcul des métriques d'entraînement
-            train_loss += loss.item() * images.size(0)
+            train_loss += loss.detach().float() * images.size(0)
             _, pred = torch.max(outputs, 1)
-            correct += (pred == labels).sum().item()
+            correct += (pred == labels).sum()
             total += labels.size(0)
+            if benchmark_steps and step == benchmark_steps:
+                break
     
-        train_acc = correct / total
-        train_loss /= total
+        # Métriques agrégées sur tous les processus
+        elapsed = time.time() - epoch_start
+        train_loss, train_correct, total = all_reduce_sum(train_loss.item(), correct.item(), total)
+        train_acc = train_correct / total
+        train_loss = train_loss / total
+        train_ips = total / elapsed
+
+        if benchmark_steps:
+            log(f"{world_size} processus : {train_ips:.1f} img/s ({benchmark_steps} pas)", flush=True)
+            if is_main():
+                record_scaling(world_size, train_ips)
+            cleanup()
+            return
     
         # Phase de validation
         model.eval()             # Mode évaluation (désactive dropout, batchnorm training)
-        val_loss = 0.0
-        correct = 0
+        val_loss = torch.zeros((), device=device)
+        correct = torch.zeros((), dtype=torch.long, device=device)
         total = 0
     
         with torch.no_grad():    # Pas de calcul de gradient
-            for images, labels in val_loader:
-                images, labels = images.to(device), labels.to(device)
+            for images, labels in timer.timed_iter(val_loader) if profile else val_loader:
+                images, labels = to_device(images, labels, device, channels_last=fast_train)
     
-                outputs = model(images)          # Forward seul
-                loss = criterion(outputs, labels)
+                with stage(timer, "val_forward"), autocast(device, amp_dtype):
+                    outputs = model(images)          # Forward seul
+                    loss = criterion(outputs, labels)
     
                 # Suivi des métriques
-                val_loss += loss.item() * images.size(0)
+                val_loss += loss.float() * images.size(0)
                 _, pred = torch.max(outputs, 1)
-                correct += (pred == labels).sum().item()
+                correct += (pred == labels).sum()
                 total += labels.size(0)
     
-        val_acc = correct / total
-        val_loss /= total
+        val_loss, val_correct, total = all_reduce_sum(val_loss.item(), correct.item(), total)
+        val_acc = val_correct / total
+        val_loss = val_loss / total
     
         # Affichage des statistiques
-        print(f"Train loss: {train_loss:.4f} | acc: {train_acc:.4f}", flush=True)
-        print(f"Val   loss: {val_loss:.4f} | acc: {val_acc:.4f}", flush=True)
+        log(f"Train loss: {train_loss:.4f} | acc: {train_acc:.4f} | {train_ips:.1f} img/s", flush=True)
+        log(f"Val   loss: {val_loss:.4f} | acc: {val_acc:.4f}", flush=True)
+        timer.report(f"Epoch {epoch}")
+        timer.reset()
     
-        # Sauvegarde du meilleur modèle (basé sur la précision validation)
+        # Sauvegarde du meilleur modèle (basé sur la précision validation), par le rang 0 uniquement
         if val_acc > best_acc:
             best_acc = val_acc
             patience_count = 0
-            torch.save({
-                "model": model.state_dict(),
-                "classes": train_ds.classes,
-                "model_name": "convnext_base",
+            if checkpointer is not None:
+                checkpointer.save_file({
+                    "model": net.state_dict(),   # Modèle sans l’enveloppe DDP (clés sans "module.")
+                    "classes": train_ds.classes,
+                    "model_name": "convnext_base",
+                    "epoch": epoch,
+                    "val_acc": val_acc
+                }, best_path)
+            log(f"New best model saved in {best_path}", flush=True)
+
+        # Essai d’un balayage : arrêt anticipé si l’essai est nettement derrière les autres
+        # (décision prise par le rang 0 seul puis diffusée : tous les rangs s’arrêtent ensemble)
+        pruned = broadcast_flag(is_main() and report_epoch(epoch, val_acc))
+
+        # État complet pour reprendre à l’époque suivante ("completed" : jamais repris)
+        if checkpointer is not None:
+            checkpointer.save_epoch({
+                "model": net.state_dict(),
+                "optimizer": optimizer.state_dict(),
+                "scaler": scaler.state_dict() if scaler is not None else None,
                 "epoch": epoch,
-                "val_acc": val_acc
-            }, best_path)
-            print(f"New best model saved in {best_path}", flush=True)
+                "best_acc": best_acc,
+                "patience_count": patience_count,
+                "rng": rng_state(),
+                "classes": train_ds.classes,
+                "completed": pruned or epoch == num_epochs,
+            }, epoch)
+
+        if pruned:
+            log("\nPruned by the sweep", flush=True)
+            break
     
-    # Fin de l’entraînement
-    print("\nTraining session finished.", flush=True)
-    print(f"Improved validation accuracy : {best_acc:.4f}", flush=True)
+    # Fin de l’entraînement (attente des dernières écritures)
+    if checkpointer is not None:
+        checkpointer.close()
+    log("\nTraining session finished.", flush=True)
+    log(f"Improved validation accuracy : {best_acc:.4f}", flush=True)
+    if is_main():
+        timer.write_chrome_trace("trace_convnext.json")
+    cleanup()
     
 
 # Point d’entrée du script